@@ -0,0 +1,73 @@
+"""Code to initiate the benchmarking of the flat file generation and patient extraction on synthetic data."""
+
+# Python imports.
+import argparse
+import os
+import sys
+
+# User imports.
+if __package__ != "Benchmark":
+    # The code was not called from within the Code directory using 'python -m Benchmark'.
+    # Therefore, we need to add the top level Code directory in order to use absolute imports.
+    currentDir = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+    codeDir = os.path.abspath(os.path.join(currentDir, os.pardir))
+    sys.path.append(codeDir)
+from Benchmark import benchmark
+from Benchmark import synthetic_data
+
+
+# ====================== #
+# Create Argument Parser #
+# ====================== #
+parser = argparse.ArgumentParser(description="Benchmark the flat file generation and patient extraction on seeded "
+                                             "synthetic data sets.",
+                                 epilog="For additional information on the presets and the format of the results file "
+                                        "please see the README.")
+
+# Optional arguments.
+parser.add_argument("-c", "--compare",
+                    help="The location of a previous results file to compare the results of this run against.",
+                    type=str)
+parser.add_argument("-o", "--output",
+                    help="The location of the directory to generate the data sets and results in. Default: a "
+                         "directory called Benchmark in the Results directory.",
+                    type=str)
+parser.add_argument("-p", "--presets",
+                    choices=sorted(synthetic_data.PRESETS),
+                    default=["small"],
+                    help="The sizes of data set to benchmark with. Default: small.",
+                    nargs='+')
+parser.add_argument("-r", "--repeats",
+                    default=1,
+                    help="The number of times to time each step. Default: 1.",
+                    type=int)
+parser.add_argument("-s", "--seed",
+                    default=0,
+                    help="The seed used to generate the synthetic data. Default: 0.",
+                    type=int)
+
+# ============================ #
+# Parse and Validate Arguments #
+# ============================ #
+args = parser.parse_args()
+dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+dirTop = os.path.abspath(os.path.join(dirCurrent, os.pardir, os.pardir))
+dirOutput = os.path.join(dirTop, "Results", "Benchmark")
+dirOutput = args.output if args.output else dirOutput
+errorsFound = []  # Container for any error messages generated during the validation.
+if args.repeats < 1:
+    errorsFound.append("The number of repeats must be at least 1.")
+if args.compare and not os.path.isfile(args.compare):
+    errorsFound.append("The results file to compare against could not be found.")
+if errorsFound:
+    print("\n\nThe following errors were encountered while parsing the input arguments:\n")
+    print('\n'.join(errorsFound))
+    sys.exit()
+
+# ================== #
+# Run the Benchmarks #
+# ================== #
+fileResults = benchmark.main(dirOutput, args.presets, args.repeats, args.seed)
+print("Results saved to {:s}".format(fileResults))
+if args.compare:
+    print('\n'.join(benchmark.compare(args.compare, fileResults)))
@@ -0,0 +1,174 @@
+"""Time the flat file generation and each stage of the patient extraction on synthetic data sets."""
+
+# Python imports.
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+
+# User imports.
+from . import synthetic_data
+from GenerateDataFiles import generate_flat_files
+from PatientExtraction import conf
+from PatientExtraction import patient_extraction
+
+
+def main(dirOutput, presets=("small",), repeats=1, seed=0, fileResults=None, extractionOptions=None):
+    """Run the benchmarks and save the results.
+
+    The results file has the format:
+        {
+            "Commit": "git commit hash or null",
+            "Python": "3.x.y",
+            "Created": "YYYY-MM-DDTHH:MM:SS",
+            "Presets": {
+                "small": {
+                    "Parameters": {...},  # The parameters used to generate the synthetic data.
+                    "GenerateFlatFiles": {"Seconds": [...]},
+                    "PatientExtraction": {"Seconds": [...]},
+                    "Stages": {"JSONDecoding": {"Seconds": [...], "Calls": 0}, ...},
+                    "Counters": {"PatientsScanned": 0, ...}
+                },
+                ...
+            }
+        }
+    with one timing per repeat.
+
+    :param dirOutput:           The location of the directory to generate the data sets and extraction output in.
+    :type dirOutput:            str
+    :param presets:             The names of the presets (see synthetic_data.PRESETS) to benchmark.
+    :type presets:              list
+    :param repeats:             The number of times to time each step.
+    :type repeats:              int
+    :param seed:                The seed used to generate the synthetic data.
+    :type seed:                 int
+    :param fileResults:         The location to save the results to. Defaults to a timestamped file in dirOutput.
+    :type fileResults:          str | None
+    :param extractionOptions:   Additional keyword arguments to pass to patient_extraction.main. The stages of the
+                                    extraction are timed unless timeStages is set to False in these.
+    :type extractionOptions:    dict | None
+    :return:                    The location of the results file.
+    :rtype:                     str
+
+    """
+
+    conf.init()
+    conf.control_logging(False)
+    results = {"Commit": _get_commit(), "Python": platform.python_version(),
+               "Created": datetime.datetime.now().isoformat(timespec="seconds"), "Presets": {}}
+
+    for preset in presets:
+        # Generate the synthetic data.
+        dirPreset = os.path.join(dirOutput, preset)
+        parameters = dict(synthetic_data.PRESETS[preset], Seed=seed)
+        files = synthetic_data.main(dirPreset, numPatients=parameters["NumPatients"],
+                                    numCodes=parameters["NumCodes"], codesPerPatient=parameters["CodesPerPatient"],
+                                    associationsPerCode=parameters["AssociationsPerCode"], seed=seed)
+        fileFlatData = os.path.join(dirPreset, "FlatPatientData.tsv")
+        presetResults = {"Parameters": parameters, "GenerateFlatFiles": {"Seconds": []},
+                         "PatientExtraction": {"Seconds": []}, "Stages": {}, "Counters": {}}
+
+        for _ in range(repeats):
+            # Time the generation of the flat file.
+            if os.path.isfile(fileFlatData):
+                os.remove(fileFlatData)
+            startTime = time.perf_counter()
+            generate_flat_files.main(files["Journal"], fileFlatData)
+            presetResults["GenerateFlatFiles"]["Seconds"].append(time.perf_counter() - startTime)
+
+            # Time the extraction.
+            dirExtraction = os.path.join(dirPreset, "Extraction")
+            shutil.rmtree(dirExtraction, ignore_errors=True)
+            os.makedirs(dirExtraction)
+            startTime = time.perf_counter()
+            patient_extraction.main(files["CaseDefinitions"], dirExtraction, fileFlatData, files["Coding"],
+                                    files["PatientSubset"], **dict({"timeStages": True}, **(extractionOptions or {})))
+            presetResults["PatientExtraction"]["Seconds"].append(time.perf_counter() - startTime)
+
+            # Record the time spent in each stage of the extraction.
+            with open(os.path.join(dirExtraction, "RunReport.json"), 'r') as fidReport:
+                runReport = json.load(fidReport)
+            for i, j in runReport["Timings"].items():
+                stageResults = presetResults["Stages"].setdefault(i, {"Seconds": [], "Calls": j["Calls"]})
+                stageResults["Seconds"].append(j["Seconds"])
+            presetResults["Counters"] = runReport["Counters"]
+
+        results["Presets"][preset] = presetResults
+
+    # Save the results.
+    if not fileResults:
+        fileResults = os.path.join(
+            dirOutput, "Benchmark_{:s}.json".format(datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S"))
+        )
+    with open(fileResults, 'w') as fidResults:
+        json.dump(results, fidResults, indent=4)
+        fidResults.write('\n')
+    return fileResults
+
+
+def compare(fileBaseline, fileCurrent):
+    """Compare the results of two benchmark runs (e.g. from two different commits).
+
+    The comparison uses the fastest repeat of each step, and a ratio below 1 means the current run is faster.
+
+    :param fileBaseline:    The location of the results of the baseline run.
+    :type fileBaseline:     str
+    :param fileCurrent:     The location of the results of the run to compare against the baseline.
+    :type fileCurrent:      str
+    :return:                The lines of the comparison, formatted as "preset\tstep\tbaseline\tcurrent\tratio".
+    :rtype:                 list
+
+    """
+
+    with open(fileBaseline, 'r') as fidBaseline, open(fileCurrent, 'r') as fidCurrent:
+        baseline = json.load(fidBaseline)
+        current = json.load(fidCurrent)
+
+    comparison = ["Preset\tStep\tBaseline\tCurrent\tRatio"]
+    for preset in current["Presets"]:
+        if preset not in baseline["Presets"]:
+            continue
+        baselineSteps = _get_steps(baseline["Presets"][preset])
+        currentSteps = _get_steps(current["Presets"][preset])
+        for step in currentSteps:
+            if step in baselineSteps:
+                ratio = currentSteps[step] / baselineSteps[step] if baselineSteps[step] else float("nan")
+                comparison.append("{:s}\t{:s}\t{:.4f}\t{:.4f}\t{:.2f}".format(
+                    preset, step, baselineSteps[step], currentSteps[step], ratio
+                ))
+    return comparison
+
+
+def _get_steps(presetResults):
+    """Get the fastest time for each step in the results for a preset.
+
+    :param presetResults:   The results for a single preset.
+    :type presetResults:    dict
+    :return:                The fastest time for each step.
+    :rtype:                 dict
+
+    """
+
+    steps = {"GenerateFlatFiles": min(presetResults["GenerateFlatFiles"]["Seconds"]),
+             "PatientExtraction": min(presetResults["PatientExtraction"]["Seconds"])}
+    for i, j in presetResults["Stages"].items():
+        steps[i] = min(j["Seconds"])
+    return steps
+
+
+def _get_commit():
+    """Get the hash of the commit that the code being benchmarked is at.
+
+    :return:    The commit hash, or None if it could not be determined.
+    :rtype:     str | None
+
+    """
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
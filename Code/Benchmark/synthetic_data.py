@@ -0,0 +1,215 @@
+"""Generate seeded synthetic patient data for benchmarking the flat file generation and patient extraction."""
+
+# Python imports.
+import datetime
+import itertools
+import os
+import random
+
+# Globals.
+CODE_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+SQL_PREFIX = "insert into `journal`(`id`,`code`,`date`,`value1`,`value2`,`text`) values ("
+TEXT_WORDS = ["patient", "reviewed", "stable", "referred", "clinic", "follow", "up", "bp", "high", "normal", "repeat",
+              "test", "advised", "diet", "exercise", "medication", "changed", "seen", "by", "gp", "nurse"]
+MIN_DATE = datetime.date(1990, 1, 1).toordinal()
+MAX_DATE = datetime.date(2020, 12, 31).toordinal()
+PRESETS = {
+    "small": {"NumPatients": 1000, "NumCodes": 2000, "CodesPerPatient": 20, "AssociationsPerCode": 3},
+    "medium": {"NumPatients": 20000, "NumCodes": 20000, "CodesPerPatient": 40, "AssociationsPerCode": 4},
+    "large": {"NumPatients": 200000, "NumCodes": 100000, "CodesPerPatient": 60, "AssociationsPerCode": 5}
+}  # Standard sizes of data set to benchmark with.
+
+
+def main(dirOutput, numPatients=1000, numCodes=2000, codesPerPatient=20, associationsPerCode=3, valueRate=0.3,
+         valueDistribution="normal", freeTextRate=0.1, edgeCaseRate=0.01, seed=0):
+    """Generate a synthetic data set.
+
+    The data set consists of the files:
+        journal.sql - The patient data in the SQL insert format expected by GenerateDataFiles.
+        Coding.tsv - The mapping from each code used in the patient data to a description.
+        CaseDefinitions.txt - A case definitions file containing a mixture of wildcard codes, negated codes, date and
+            value restrictions, modes and outputs.
+        PatientSubset.txt - An empty patient subset file (meaning all patients are extracted).
+
+    The number of codes each patient has and the number of associations with each code are drawn uniformly from
+    1 to twice the requested average minus one. Codes are drawn from the coding dictionary with a Zipf-like
+    distribution, so that a few codes are common and most are rare.
+
+    :param dirOutput:           The location of the directory to write the data set to.
+    :type dirOutput:            str
+    :param numPatients:         The number of patients to generate.
+    :type numPatients:          int
+    :param numCodes:            The number of codes in the coding dictionary.
+    :type numCodes:             int
+    :param codesPerPatient:     The average number of distinct codes each patient has.
+    :type codesPerPatient:      int
+    :param associationsPerCode: The average number of associations a patient has with each of their codes.
+    :type associationsPerCode:  int
+    :param valueRate:           The fraction of associations that have a non-zero value 1 (half as many have a
+                                    non-zero value 2).
+    :type valueRate:            float
+    :param valueDistribution:   The distribution to draw values from. One of normal, lognormal or uniform.
+    :type valueDistribution:    str
+    :param freeTextRate:        The fraction of associations with free text.
+    :type freeTextRate:         float
+    :param edgeCaseRate:        The fraction of associations exercising an edge case of the SQL parsing. These are
+                                    free text containing commas, codes recorded with their values
+                                    (e.g. '2469,v=130,w=80') and associations without a code.
+    :type edgeCaseRate:         float
+    :param seed:                The seed for the random number generator.
+    :type seed:                 int
+    :return:                    The locations of the journal, coding, case definitions and patient subset files.
+    :rtype:                     dict
+
+    """
+
+    rng = random.Random(seed)
+    os.makedirs(dirOutput, exist_ok=True)
+    files = {
+        "Journal": os.path.join(dirOutput, "journal.sql"),
+        "Coding": os.path.join(dirOutput, "Coding.tsv"),
+        "CaseDefinitions": os.path.join(dirOutput, "CaseDefinitions.txt"),
+        "PatientSubset": os.path.join(dirOutput, "PatientSubset.txt")
+    }
+
+    # Generate the coding dictionary.
+    codes = generate_codes(numCodes, rng)
+    with open(files["Coding"], 'w') as fidCoding:
+        for i in codes:
+            fidCoding.write("{:s}\tSynthetic code {:s}\n".format(i, i))
+
+    # Generate the patient data.
+    codeWeights = list(itertools.accumulate(1 / (i + 1) for i in range(len(codes))))  # Zipf-like code popularity.
+    codeValueMeans = {i: rng.uniform(1, 200) for i in codes}  # Each code has its own typical value.
+    drawValue = _value_generator(valueDistribution, rng)
+    with open(files["Journal"], 'w') as fidJournal:
+        for patientID in range(1, numPatients + 1):
+            numPatientCodes = rng.randint(1, 2 * codesPerPatient - 1)
+            patientCodes = set(rng.choices(codes, cum_weights=codeWeights, k=numPatientCodes))
+            patientLines = []
+            for code in patientCodes:
+                for _ in range(rng.randint(1, 2 * associationsPerCode - 1)):
+                    date = datetime.date.fromordinal(rng.randint(MIN_DATE, MAX_DATE))
+                    value1 = drawValue(codeValueMeans[code]) if rng.random() < valueRate else 0.0
+                    value2 = drawValue(codeValueMeans[code] / 2) if rng.random() < valueRate / 2 else 0.0
+                    text = "null"
+                    if rng.random() < freeTextRate:
+                        text = "'{:s}'".format(' '.join(rng.choices(TEXT_WORDS, k=rng.randint(1, 8))))
+                    sqlCode = "'{:s}'".format(code)
+                    if rng.random() < edgeCaseRate:
+                        edgeCase = rng.randrange(3)
+                        if edgeCase == 0:
+                            # Free text containing the delimiter.
+                            text = "'{:s}, {:s}, {:s}'".format(*rng.choices(TEXT_WORDS, k=3))
+                        elif edgeCase == 1:
+                            # A code recorded with its values.
+                            sqlCode = "'{:s},v={:.0f},w={:.0f}'".format(code, value1, value2)
+                        else:
+                            # An association without a code.
+                            sqlCode = "''"
+                    patientLines.append("{:s}{:d},{:s},'{:s}',{:.4f},{:.4f},{:s});\n".format(
+                        SQL_PREFIX, patientID, sqlCode, date.isoformat(), value1, value2, text
+                    ))
+            rng.shuffle(patientLines)  # The flat file generation must sort the associations itself.
+            fidJournal.writelines(patientLines)
+
+    # Generate the case definitions and the (empty) patient subset.
+    with open(files["CaseDefinitions"], 'w') as fidCaseDefs:
+        fidCaseDefs.write(generate_case_definitions(codes, rng))
+    open(files["PatientSubset"], 'w').close()
+
+    return files
+
+
+def generate_codes(numCodes, rng):
+    """Generate a hierarchical coding dictionary in the style of Read codes.
+
+    Codes are built by extending existing codes by one character, so that wildcard codes (e.g. C10%) match a range of
+    child codes. Codes are at most five characters long.
+
+    :param numCodes:    The number of codes to generate.
+    :type numCodes:     int
+    :param rng:         The random number generator to use.
+    :type rng:          random.Random
+    :return:            The generated codes in the order they were generated (most general first).
+    :rtype:             list
+
+    """
+
+    codes = []
+    seen = set()
+    parents = ['']  # Codes that can be extended to create child codes.
+    while len(codes) < numCodes:
+        parent = rng.choice(parents)
+        code = parent + rng.choice(CODE_ALPHABET)
+        if code in seen:
+            continue
+        seen.add(code)
+        codes.append(code)
+        if len(code) < 5:
+            parents.append(code)
+    return codes
+
+
+def generate_case_definitions(codes, rng, numCases=10):
+    """Generate the text of a case definitions file using a given set of codes.
+
+    :param codes:       The codes in the coding dictionary, ordered from most to least common.
+    :type codes:        list
+    :param rng:         The random number generator to use.
+    :type rng:          random.Random
+    :param numCases:    The number of case definitions to generate.
+    :type numCases:     int
+    :return:            The text of the case definitions file.
+    :rtype:             str
+
+    """
+
+    modeChoices = ["all", "earliest", "latest", "max1", "max2", "min1", "min2"]
+    outputChoices = ["code", "count", "date", "exists", "max1", "max2", "mean1", "mean2", "median1", "median2", "min1",
+                     "min2", "val1", "val2"]
+    commonCodes = codes[:max(1, len(codes) // 20)]
+    caseDefinitions = []
+    for caseNum in range(numCases):
+        lines = ["# Synthetic Case {:d}".format(caseNum + 1)]
+        lines.append("> mode {:s}".format(' '.join(rng.sample(modeChoices, rng.randint(1, 3)))))
+        lines.append("> out {:s}".format(' '.join(rng.sample(outputChoices, rng.randint(1, 5)))))
+        if caseNum % 3 == 1:
+            lines.append("> from {:d}-01-01".format(rng.randint(1995, 2015)))
+        if caseNum % 4 == 2:
+            lines.append("> val1 > {:d}".format(rng.randint(1, 100)))
+        if caseNum % 5 == 3:
+            startYear = rng.randint(1992, 2010)
+            lines.append("> from {:d}-01-01 to {:d}-12-31".format(startYear, startYear + rng.randint(1, 8)))
+        lines.extend(rng.sample(commonCodes, min(len(commonCodes), rng.randint(1, 5))))
+        wildcardCodes = [i for i in commonCodes if len(i) <= 2]
+        if wildcardCodes and caseNum % 2 == 0:
+            # Add a wildcard code along with a negated child code.
+            wildcardCode = rng.choice(wildcardCodes)
+            lines.append("{:s}%".format(wildcardCode))
+            childCodes = [i for i in codes if i.startswith(wildcardCode) and i != wildcardCode]
+            if childCodes:
+                lines.append("-{:s}".format(rng.choice(childCodes)))
+        caseDefinitions.append('\n'.join(lines))
+    return "\n\n".join(caseDefinitions) + '\n'
+
+
+def _value_generator(valueDistribution, rng):
+    """Create a function that draws a value for an association given the typical value for its code.
+
+    :param valueDistribution:   The distribution to draw values from. One of normal, lognormal or uniform.
+    :type valueDistribution:    str
+    :param rng:                 The random number generator to use.
+    :type rng:                  random.Random
+    :return:                    A function that takes the typical value and returns a drawn value.
+    :rtype:                     function
+
+    """
+
+    if valueDistribution == "normal":
+        return lambda x: abs(rng.gauss(x, x / 5))
+    elif valueDistribution == "lognormal":
+        return lambda x: rng.lognormvariate(0, 0.5) * x
+    elif valueDistribution == "uniform":
+        return lambda x: rng.uniform(0, 2 * x)
+    raise ValueError("Unknown value distribution {:s}.".format(valueDistribution))
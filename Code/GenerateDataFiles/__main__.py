@@ -9,6 +9,9 @@ import sys
 if __package__ == "GenerateDataFiles":
     # If the package is GenerateDataFiles, then relative imports are needed.
     from . import generate_flat_files
+    from PatientExtraction import code_layout
+    from PatientExtraction import sharding
+    from PatientExtraction import split_layout
 else:
     # The code was not called from within the Code directory using 'python -m GenerateDataFiles'.
     # Therefore, we need to add the top level Code directory to the search path and use absolute imports.
@@ -16,6 +19,9 @@ else:
     codeDir = os.path.abspath(os.path.join(currentDir, os.pardir))
     sys.path.append(codeDir)
     from GenerateDataFiles import generate_flat_files
+    from PatientExtraction import code_layout
+    from PatientExtraction import sharding
+    from PatientExtraction import split_layout
 
 
 # ====================== #
@@ -30,10 +36,44 @@ parser.add_argument("-p", "--patient",
                     help="The location of the file containing the patient medical history data in SQL insert format. "
                          "Default: a file called journal.sql in the Data directory.",
                     type=str)
+parser.add_argument("-c", "--cohort-index",
+                    action="store_true",
+                    help="Save an index of the patients with each code alongside the flat file. This lets the patient "
+                         "extraction answer case definitions that only use the count and exists outputs without "
+                         "reading the flat file. Default: the index is not saved.")
+parser.add_argument("-i", "--progress",
+                    default=0,
+                    help="The number of seconds between reports of the progress through the patient data file (0 to "
+                         "not report progress). Default: 0 (progress is not reported).",
+                    type=float)
+parser.add_argument("-k", "--code-layout",
+                    action="store_true",
+                    help="Write the associations grouped by code, along with a directory of where each code's "
+                         "associations are, to files named after the output file (e.g. FlatPatientData.codes.tsv). "
+                         "The patient extraction can then be given the .codes.tsv file, and only reads the "
+                         "associations of the codes that the case definitions use. Can not be used with "
+                         "--summaries. Default: a single flat file is written.")
 parser.add_argument("-o", "--output",
                     help="The location of the file to write the output files to. Default: a file called "
                          "FlatPatientData.tsv in the Data directory.",
                     type=str)
+parser.add_argument("-n", "--shards",
+                    help="The number of shard files to split the flat file into, with each patient assigned to a "
+                         "shard by a stable hash of their ID (e.g. FlatPatientData.shard0.tsv). The shards can be "
+                         "extracted independently and their extracted data merged. Can not be used with --split or "
+                         "--code-layout. Default: a single flat file is written.",
+                    type=int)
+parser.add_argument("-s", "--summaries",
+                    action="store_true",
+                    help="Write a summary of each patient's associations with each code after their record. These let "
+                         "the patient extraction answer case definitions without restrictions from the summaries "
+                         "alone. Default: summaries are not written.")
+parser.add_argument("-t", "--split",
+                    action="store_true",
+                    help="Write the dates, values and text of the associations to separate files named after the "
+                         "output file (e.g. FlatPatientData.dates.tsv). The patient extraction can then be given the "
+                         "dates file, and only reads the values when the case definitions need them. Default: a "
+                         "single flat file is written.")
 
 # ============================ #
 # Parse and Validate Arguments #
@@ -49,10 +89,28 @@ if not os.path.isfile(filePatients):
     print("\n\nThe following errors were encountered while parsing the input arguments:\nThe file containing patient "
           "data could not be found.")
     sys.exit()
-if os.path.isfile(fileOutput):
-    os.remove(fileOutput)
+if args.shards is not None and (args.shards < 1 or args.split or args.code_layout):
+    print("\n\nThe following errors were encountered while parsing the input arguments:\nThe number of shards must be "
+          "at least 1, and shards can not be used with the split or code layouts.")
+    sys.exit()
+if args.code_layout and args.summaries:
+    print("\n\nThe following errors were encountered while parsing the input arguments:\nSummaries can not be written "
+          "with the code layout.")
+    sys.exit()
+if args.code_layout:
+    filesOutput = code_layout.layout_files(fileOutput).values()
+elif args.split:
+    filesOutput = split_layout.split_files(fileOutput).values()
+elif args.shards:
+    filesOutput = sharding.shard_files(fileOutput, args.shards)
+else:
+    filesOutput = [fileOutput]
+for i in filesOutput:
+    if os.path.isfile(i):
+        os.remove(i)
 
 # ======================= #
 # Generate the Flat Files #
 # ======================= #
-generate_flat_files.main(filePatients, fileOutput)
+generate_flat_files.main(filePatients, fileOutput, args.progress, args.summaries, args.cohort_index,
+                         args.split, args.code_layout, args.shards)
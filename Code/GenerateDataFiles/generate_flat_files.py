@@ -4,25 +4,70 @@
 import collections
 import datetime
 import json
+import logging
 import operator
+import os
 
+# User imports.
+from PatientExtraction import code_layout
+from PatientExtraction import cohort_index
+from PatientExtraction import progress
+from PatientExtraction import record_summary
+from PatientExtraction import sharding
+from PatientExtraction import split_layout
 
-def main(filePatients, fileOutput):
+# Globals.
+LOGGER = logging.getLogger(__name__)
+
+
+def main(filePatients, fileOutput, progressInterval=None, summaries=False, cohortIndex=False, split=False,
+         codeLayout=False, shards=None):
     """Generate the flat files to use for the patient extraction.
 
     The SQL file that the data is read from is assumed to have all patient entries listed consecutively.
 
-    :param filePatients:    The location of the patient data file (in SQL insert format).
-    :type filePatients:     str
-    :param fileOutput:      The location of the file where the patient data should be saved.
-    :type fileOutput:       str
+    :param filePatients:        The location of the patient data file (in SQL insert format).
+    :type filePatients:         str
+    :param fileOutput:          The location of the file where the patient data should be saved.
+    :type fileOutput:           str
+    :param progressInterval:    The number of seconds between reports of the progress through the patient data file.
+                                    Progress is not reported when this is None or 0.
+    :type progressInterval:     float | None
+    :param summaries:           Whether to write the summaries of each patient's codes after their record (see
+                                    PatientExtraction.record_summary).
+    :type summaries:            bool
+    :param cohortIndex:         Whether to save an index of the patients with each code alongside the flat file (see
+                                    PatientExtraction.cohort_index).
+    :type cohortIndex:          bool
+    :param split:               Whether to write the patient data in the split layout, with the dates, values and text
+                                    of the associations in separate files named after fileOutput (see
+                                    PatientExtraction.split_layout).
+    :type split:                bool
+    :param codeLayout:          Whether to write the patient data in the code layout, with the associations grouped
+                                    by code in files named after fileOutput (see PatientExtraction.code_layout).
+                                    Summaries are not written with the code layout.
+    :type codeLayout:           bool
+    :param shards:              The number of shards to split the flat file into by patient, with the shards named
+                                    after fileOutput (see PatientExtraction.sharding). Any cohort index is saved
+                                    alongside each shard. None to write a single flat file. Can not be used with the
+                                    split or code layouts.
+    :type shards:               int | None
 
     """
 
+    # Setup the reporting of the progress through the patient data.
+    progressReporter = None
+    if progressInterval:
+        progressReporter = progress.ProgressReporter(os.path.getsize(filePatients), progressInterval, "rows",
+                                                     "GenerateDataFiles", logger=LOGGER)
+
+    fileShards = sharding.shard_files(fileOutput, shards) if shards else [fileOutput]  # The files to write to.
+    indices = [cohort_index.CohortIndex() for _ in fileShards] if cohortIndex else None  # The index of each file.
+    layoutWriter = code_layout.CodeLayoutWriter(fileOutput) if codeLayout else None  # The writer of the code layout.
     currentPatient = None  # The ID of the patient who's record is currently being built.
     patientData = collections.defaultdict(list)  # The data for the current patient.
     with open(filePatients, 'r') as fidPatients:
-        for line in fidPatients:
+        for line in (progressReporter.track(fidPatients) if progressReporter else fidPatients):
             if line[:6] == "insert":
                 # The line contains information about a row in the journal table.
                 line = line[75:]  # Strip of the SQL insert syntax at the beginning.
@@ -62,7 +107,9 @@ def main(filePatients, fileOutput):
 
                 if patientID != currentPatient and currentPatient:
                     # A new patient has been found and this is not the first line of the file.
-                    save_patient(currentPatient, patientData, fileOutput)  # Record the old patient's data.
+                    # Record the old patient's data.
+                    fileShard, index = _patient_shard(currentPatient, fileShards, indices)
+                    save_patient(currentPatient, patientData, fileShard, summaries, index, split, layoutWriter)
                     patientData = collections.defaultdict(list)  # Clear the patient data.
 
                 # Update the patient's data.
@@ -76,10 +123,42 @@ def main(filePatients, fileOutput):
                     continue
 
     # Record the final patient's data.
-    save_patient(currentPatient, patientData, fileOutput)
+    fileShard, index = _patient_shard(currentPatient, fileShards, indices)
+    save_patient(currentPatient, patientData, fileShard, summaries, index, split, layoutWriter)
+    if layoutWriter is not None:
+        layoutWriter.finish()
+    if indices is not None:
+        if layoutWriter is not None:
+            cohort_index.save(indices[0], layoutWriter.files["Data"])
+        elif split:
+            cohort_index.save(indices[0], split_layout.split_files(fileOutput)["Dates"])
+        else:
+            for fileShard, index in zip(fileShards, indices):
+                cohort_index.save(index, fileShard)
+
+    if progressReporter:
+        progressReporter.finish()
+
+
+def _patient_shard(patientID, fileShards, indices):
+    """Determine the file to save a patient's medical history to, and the index to add them to.
+
+    :param patientID:           The ID of the patient.
+    :type patientID:            str
+    :param fileShards:          The locations of the files being written (one per shard).
+    :type fileShards:           list
+    :param indices:             The index of the patients in each file (None when no indices are being built).
+    :type indices:              list | None
+    :return:                    The location of the patient's file, and its index (None if there is no index).
+    :rtype:                     str, PatientExtraction.cohort_index.CohortIndex | None
 
+    """
+
+    shard = sharding.shard_of(patientID, len(fileShards))
+    return fileShards[shard], indices[shard] if indices is not None else None
 
-def save_patient(patientID, patientData, fileOutput):
+
+def save_patient(patientID, patientData, fileOutput, summaries=False, index=None, split=False, layoutWriter=None):
     """Save a single patient's medical history in JSON format on a single line.
 
     :param patientID:           The ID of the patient
@@ -89,6 +168,16 @@ def save_patient(patientID, patientData, fileOutput):
     :type patientData:          dict
     :param fileOutput:          The location of the file to save the patient's data to.
     :type fileOutput:           str
+    :param summaries:           Whether to write the summaries of the patient's codes after their record.
+    :type summaries:            bool
+    :param index:               The index of the patients with each code to add the patient to (None to not index the
+                                    patient).
+    :type index:                PatientExtraction.cohort_index.CohortIndex | None
+    :param split:               Whether to save the patient's data in the split layout named after fileOutput.
+    :type split:                bool
+    :param layoutWriter:        The writer of the code layout to add the patient to in place of saving their data to
+                                    fileOutput (None to save the data to fileOutput).
+    :type layoutWriter:         PatientExtraction.code_layout.CodeLayoutWriter | None
 
     """
 
@@ -102,6 +191,21 @@ def save_patient(patientID, patientData, fileOutput):
         for j in patientData[code]:
             j["Date"] = j["Date"].strftime("%Y-%m-%d")
 
+    if index is not None:
+        index.add_patient(patientID, patientData)
+
     # Output the current patient's data.
+    if layoutWriter is not None:
+        layoutWriter.add_patient(patientID, patientData)
+        return
+    if split:
+        summaryText = json.dumps(record_summary.summarise_record(patientData)) if summaries else None
+        split_layout.write_patient(patientID, patientData, split_layout.split_files(fileOutput), summaryText)
+        return
     with open(fileOutput, 'a') as fidOutput:
-        fidOutput.write("{0:s}\t{1:s}\n".format(patientID, json.dumps(patientData)))
+        if summaries:
+            fidOutput.write("{0:s}\t{1:s}\t{2:s}\n".format(
+                patientID, json.dumps(patientData), json.dumps(record_summary.summarise_record(patientData))
+            ))
+        else:
+            fidOutput.write("{0:s}\t{1:s}\n".format(patientID, json.dumps(patientData)))
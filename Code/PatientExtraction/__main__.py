@@ -2,6 +2,7 @@
 
 # Python imports.
 import argparse
+import cProfile
 import datetime
 import logging
 import os
@@ -16,7 +17,10 @@ if __package__ != "PatientExtraction":
     codeDir = os.path.abspath(os.path.join(currentDir, os.pardir))
     sys.path.append(codeDir)
 from PatientExtraction import conf
+from PatientExtraction import extraction_plan
+from PatientExtraction import output_sinks
 from PatientExtraction import patient_extraction
+from PatientExtraction import sharding
 
 
 # ====================== #
@@ -29,7 +33,10 @@ parser = argparse.ArgumentParser(description="Extract patients meeting user-defi
                                         "determine where case definition errors might have occurred.")
 
 # Mandatory arguments.
-parser.add_argument("input", help="The location of the file containing the case definitions.", type=str)
+parser.add_argument("input",
+                    help="The location of the file containing the case definitions, or of an extraction plan compiled "
+                         "from them by a previous run (ExtractionPlan.json in its output directory).",
+                    type=str)
 
 # Optional arguments.
 parser.add_argument("-c", "--coding",
@@ -48,6 +55,92 @@ parser.add_argument("-p", "--patient",
                     help="The location of the file containing the IDs of the patients that the extraction should be "
                          "restricted to (one ID per line). Default: a file PatientSubset.txt in the Data directory.",
                     type=str)
+parser.add_argument("--compile-only",
+                    action="store_true",
+                    help="Whether to only compile the case definitions into an extraction plan (saved to "
+                         "ExtractionPlan.json in the output directory) without extracting any patient data. "
+                         "Default: compile the plan and perform the extraction.")
+parser.add_argument("-e", "--explain",
+                    action="store_true",
+                    help="Whether to write a report of the time spent on, and the selectivity of the restrictions and "
+                         "modes of, each case definition to ExplainReport.json in the output directory. "
+                         "Default: do not write the report.")
+parser.add_argument("-i", "--progress",
+                    default=0,
+                    help="The number of seconds between reports of the progress through the patient data file (0 to "
+                         "not report progress). Default: 0 (progress is not reported).",
+                    type=float)
+parser.add_argument("-m", "--trace-memory",
+                    action="store_true",
+                    help="Whether to record the memory high-water mark of each stage of the extraction and the largest "
+                         "patient records in the run report. This uses tracemalloc, and so slows the extraction down. "
+                         "Default: do not record memory usage.")
+parser.add_argument("--max-record-bytes",
+                    help="The size (in bytes) above which a patient's record is decoded one code at a time, "
+                         "with only the codes used by the case definitions being decoded. This bounds the memory used "
+                         "by patients with very long histories. Default: always decode the whole record.",
+                    type=int)
+parser.add_argument("--no-code-cache",
+                    action="store_true",
+                    help="Whether to read the code descriptions file directly rather than using (and creating) a "
+                         "cached, indexed copy of it stored alongside the file. Default: use the cache.")
+parser.add_argument("--no-cohort-index",
+                    action="store_true",
+                    help="Whether to always read the patient data file rather than extracting all patients from its "
+                         "cohort index (when the index is up to date and every case only uses the count and exists "
+                         "outputs). Default: use the index when possible.")
+parser.add_argument("-n", "--processes",
+                    default=1,
+                    help="The number of worker processes to use for the extraction. Using more than one process "
+                         "implies --pipelined. When --shards is given, this is instead the number of shards extracted "
+                         "at once. Default: 1.",
+                    type=int)
+parser.add_argument("--prefix-matching",
+                    action="store_true",
+                    help="Whether wildcard codes (e.g. C10%%) should be matched against the codes in each patient's "
+                         "record rather than being expanded into the matching codes in the code descriptions file. "
+                         "This also matches codes missing from the code descriptions file. Default: expand wildcards.")
+parser.add_argument("--profile",
+                    action="store_true",
+                    help="Whether to profile the extraction with cProfile and save the profile to "
+                         "PatientExtraction.prof in the output directory. Only the main process is profiled, and "
+                         "sharded extractions are not profiled. Default: do not profile.")
+parser.add_argument("--shards",
+                    help="The number of shards that the patient data file was split into (see GenerateDataFiles). "
+                         "Each shard is extracted independently into a ShardN subdirectory of the output directory, "
+                         "and the shards' extracted data is then merged. Only the tsv and ndjson sinks can be used. "
+                         "Default: the patient data is not sharded.",
+                    type=int)
+parser.add_argument("--sorted-merge",
+                    action="store_true",
+                    help="Whether to merge the extracted data of the shards with the patients in order of their IDs "
+                         "rather than concatenating the shards. This needs the patients in the patient data file to "
+                         "be in order of their IDs. Default: concatenate the shards.")
+parser.add_argument("--sink",
+                    choices=sorted(output_sinks.SINKS),
+                    default="tsv",
+                    help="The format to write the extracted data in: a tab separated file (tsv), optionally gzip "
+                         "(tsv.gz) or xz (tsv.xz) compressed, newline delimited JSON (ndjson), a table in an SQLite "
+                         "database (sqlite) or the sparse format (sparse). Default: tsv.",
+                    type=str)
+parser.add_argument("-s", "--sparse",
+                    action="store_const",
+                    const="sparse",
+                    dest="sink",
+                    help="Write only the non-empty extracted values, as (patient, column, value) lines in "
+                         "DataExtraction.sparse.tsv with the columns and patients listed in separate files, instead of "
+                         "DataExtraction.tsv (shorthand for --sink sparse). Use 'python -m "
+                         "PatientExtraction.sparse_output' to convert the sparse output to DataExtraction.tsv.")
+parser.add_argument("-t", "--pipelined",
+                    action="store_true",
+                    help="Whether to read the patient data, extract from it and write the output in separate "
+                         "pipelined stages. Default: do not pipeline.")
+parser.add_argument("--time-stages",
+                    action="store_true",
+                    help="Whether to time the stages run for every patient or case (reading lines, decoding JSON, "
+                         "converting dates, applying restrictions, selecting associations and generating output) in "
+                         "RunReport.json. This slows the extraction down. Default: only time the stages run once or "
+                         "per batch.")
 parser.add_argument("-w", "--overwrite",
                     action="store_true",
                     help="Whether the output directory should be overwritten if it exists. Default: do not overwrite.")
@@ -64,13 +157,18 @@ errorsFound = []  # Container for any error messages generated during the valida
 
 # Validate the input file.
 fileInput = args.input
+isPlan = False  # Whether the input file is a compiled extraction plan.
 if not os.path.isfile(fileInput):
     errorsFound.append("The input file location does not contain a file.")
+else:
+    isPlan = extraction_plan.is_plan_file(fileInput)
+    if isPlan and args.compile_only:
+        errorsFound.append("The input file is already a compiled extraction plan.")
 
-# Validate the location of the code mapping file.
+# Validate the location of the code mapping file (not needed when the input is already compiled).
 fileCodeDescriptions = os.path.join(dirData, "Coding.tsv")
 fileCodeDescriptions = args.coding if args.coding else fileCodeDescriptions
-if not os.path.isfile(fileCodeDescriptions):
+if not isPlan and not os.path.isfile(fileCodeDescriptions):
     errorsFound.append("The file containing the code to description mappings could not be found.")
 
 # Validate the output directory.
@@ -93,15 +191,31 @@ elif os.path.exists(dirOutput):
 # Validate the patient medical history data file.
 filePatientData = os.path.join(dirData, "FlatPatientData.tsv")
 filePatientData = args.histories if args.histories else filePatientData
-if not os.path.isfile(filePatientData):
+fileShards = sharding.shard_files(filePatientData, args.shards) if args.shards else [filePatientData]
+if not args.compile_only and not all(os.path.isfile(i) for i in fileShards):
     errorsFound.append("The file containing the patient data could not be found.")
+if args.shards is not None and args.shards < 1:
+    errorsFound.append("The number of shards must be at least 1.")
+if args.shards and args.sink not in sharding.MERGEABLE_SINKS:
+    errorsFound.append("The extracted data of the shards can only be merged with the {:s} sinks.".format(
+        " and ".join(sorted(sharding.MERGEABLE_SINKS))))
 
 # Validate the file containing the patient subset to use.
 filePatientSubset = os.path.join(dirData, "PatientSubset.txt")
 filePatientSubset = args.patient if args.patient else filePatientSubset
-if not os.path.isfile(filePatientSubset):
+if not args.compile_only and not os.path.isfile(filePatientSubset):
     errorsFound.append("The location containing the subset of patients to use is not a file.")
 
+# Validate the number of processes.
+processes = args.processes
+if processes < 1:
+    errorsFound.append("The number of processes must be at least 1.")
+
+# Validate the maximum record size.
+maxRecordBytes = args.max_record_bytes
+if maxRecordBytes is not None and maxRecordBytes < 0:
+    errorsFound.append("The maximum record size must not be negative.")
+
 # Display errors if any were found.
 if errorsFound:
     print("\n\nThe following errors were encountered while parsing the input arguments:\n")
@@ -146,4 +260,33 @@ logger.addHandler(logConsoleHandler)
 # ============================== #
 logger.info("Starting patient extraction.")
 conf.init()  # Initialise the settings-like global variables.
-patient_extraction.main(fileInput, dirOutput, filePatientData, fileCodeDescriptions, filePatientSubset)
+if args.compile_only:
+    # Compile the case definitions without performing the extraction.
+    annotatedInputName = os.path.split(fileInput)[1]
+    annotatedInputName = annotatedInputName.split('.')[0] + "_Annotated." + annotatedInputName.split('.')[1]
+    plan = extraction_plan.compile_plan(fileInput, fileCodeDescriptions, os.path.join(dirOutput, annotatedInputName),
+                                        useCodeCache=not args.no_code_cache, prefixMatching=args.prefix_matching)
+    extraction_plan.save_plan(plan, os.path.join(dirOutput, "ExtractionPlan.json"))
+elif args.profile and not args.shards:
+    # Profile the extraction and save the profile alongside the run report.
+    profiler = cProfile.Profile()
+    profiler.runcall(patient_extraction.main, fileInput, dirOutput, filePatientData, fileCodeDescriptions,
+                     filePatientSubset, pipelined=args.pipelined, processes=processes, explain=args.explain,
+                     progressInterval=args.progress, traceMemory=args.trace_memory, maxRecordBytes=maxRecordBytes,
+                     useCodeCache=not args.no_code_cache, prefixMatching=args.prefix_matching, sink=args.sink,
+                     useCohortIndex=not args.no_cohort_index, timeStages=args.time_stages)
+    profiler.dump_stats(os.path.join(dirOutput, "PatientExtraction.prof"))
+elif args.shards:
+    sharding.extract_shards(fileInput, dirOutput, fileShards, fileCodeDescriptions, filePatientSubset,
+                            processes=processes, sink=args.sink, sortedOrder=args.sorted_merge,
+                            useCodeCache=not args.no_code_cache, prefixMatching=args.prefix_matching,
+                            pipelined=args.pipelined, explain=args.explain, progressInterval=args.progress,
+                            traceMemory=args.trace_memory, maxRecordBytes=maxRecordBytes,
+                            useCohortIndex=not args.no_cohort_index, timeStages=args.time_stages)
+else:
+    patient_extraction.main(fileInput, dirOutput, filePatientData, fileCodeDescriptions, filePatientSubset,
+                            pipelined=args.pipelined, processes=processes, explain=args.explain,
+                            progressInterval=args.progress, traceMemory=args.trace_memory,
+                            maxRecordBytes=maxRecordBytes, useCodeCache=not args.no_code_cache,
+                            prefixMatching=args.prefix_matching, sink=args.sink,
+                            useCohortIndex=not args.no_cohort_index, timeStages=args.time_stages)
@@ -0,0 +1,454 @@
+"""Compact representation of the associations between a patient and a code.
+
+Each association in the flat file is a JSON object with Date, Val1, Val2 and Text keys. Keeping these as dictionaries
+costs several hundred bytes per association, which dominates the memory used by patients with long histories. They are
+therefore converted into Association objects once decoded. These have a fixed set of slots (rather than a per-object
+dictionary), share repeated Text strings and store their date as a datetime object.
+
+Codes with many associations are instead stored as CodeColumns, which hold the fields of all of the code's associations
+in parallel columns (dates as ordinals and values as doubles in arrays, and text as a list of strings). This packs each
+association into 28 bytes (plus any text), and lets value restrictions, selections and outputs run over the arrays
+directly. A CodeColumns behaves as a sequence of Association objects, so code that only needs individual associations
+(e.g. the earliest one) can treat both representations alike. The helper functions field_values, filter_associations,
+bisect_left and bisect_right work with either representation, using the arrays when they are available.
+
+"""
+
+# Python imports.
+import array
+import bisect
+import datetime
+import functools
+import operator
+import sys
+
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional, and only used to view the columns of a CodeColumns as NumPy arrays.
+    numpy = None
+
+# Globals.
+FIELDS = ("Date", "Val1", "Val2", "Text")  # The fields of an association, in the order they are stored.
+COLUMNS_THRESHOLD = 64  # The number of associations a code must have to be stored as a CodeColumns.
+_COLUMN_TYPES = {"Date": 'i', "Val1": 'd', "Val2": 'd'}  # The array type code of each array column.
+
+
+class Association(object):
+    """A single association between a patient and a code."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, Date, Val1=0, Val2=0, Text=""):
+        """Initialise the association.
+
+        :param Date:    The date of the association.
+        :type Date:     datetime.datetime
+        :param Val1:    The first value recorded with the association.
+        :type Val1:     float
+        :param Val2:    The second value recorded with the association.
+        :type Val2:     float
+        :param Text:    The free text recorded with the association.
+        :type Text:     str
+
+        """
+
+        self.Date = Date
+        self.Val1 = Val1
+        self.Val2 = Val2
+        self.Text = Text
+
+    def __eq__(self, other):
+        if not isinstance(other, Association):
+            return NotImplemented
+        return (self.Date, self.Val1, self.Val2, self.Text) == (other.Date, other.Val1, other.Val2, other.Text)
+
+    __hash__ = None  # Associations are mutable, so are not hashable.
+
+    def __getstate__(self):
+        return self.Date, self.Val1, self.Val2, self.Text
+
+    def __setstate__(self, state):
+        self.Date, self.Val1, self.Val2, self.Text = state
+
+    def __repr__(self):
+        return "Association(Date={!r}, Val1={!r}, Val2={!r}, Text={!r})".format(
+            self.Date, self.Val1, self.Val2, self.Text
+        )
+
+    def to_dict(self):
+        """Convert the association back to the dictionary format used in the flat file (with a datetime date).
+
+        :return:    The association's fields.
+        :rtype:     dict
+
+        """
+
+        return {"Date": self.Date, "Val1": self.Val1, "Val2": self.Val2, "Text": self.Text}
+
+
+def from_dict(association):
+    """Create an association from its dictionary format.
+
+    The date may be either a YYYY-MM-DD string (as in the flat file) or a datetime object. Missing values default to 0
+    and missing text to an empty string.
+
+    :param association: The association's fields.
+    :type association:  dict
+    :return:            The association.
+    :rtype:             Association
+
+    """
+
+    date = association["Date"]
+    return Association(parse_date(date) if isinstance(date, str) else date, association.get("Val1", 0),
+                       association.get("Val2", 0), sys.intern(association.get("Text", "")))
+
+
+class CodeColumns(object):
+    """The associations between a patient and a single code stored as parallel arrays, one per field.
+
+    Indexing a CodeColumns with an integer (or iterating over it) gives Association objects, and slicing it gives a new
+    CodeColumns. The columns themselves are available through the attributes named after the fields, with the dates as
+    an array of the proleptic Gregorian ordinals of the days (the dates of associations have no time) and the text as a
+    list of strings. The text is held by each CodeColumns rather than in a table shared by the process, so that it is
+    freed along with the record it belongs to.
+
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, Date=None, Val1=None, Val2=None, Text=None):
+        """Initialise the columns.
+
+        :param Date:    The ordinals of the dates of the associations.
+        :type Date:     array.array | None
+        :param Val1:    The first value of each association.
+        :type Val1:     array.array | None
+        :param Val2:    The second value of each association.
+        :type Val2:     array.array | None
+        :param Text:    The text of each association.
+        :type Text:     list | None
+
+        """
+
+        self.Date = array.array(_COLUMN_TYPES["Date"]) if Date is None else Date
+        self.Val1 = array.array(_COLUMN_TYPES["Val1"]) if Val1 is None else Val1
+        self.Val2 = array.array(_COLUMN_TYPES["Val2"]) if Val2 is None else Val2
+        self.Text = [] if Text is None else Text
+
+    @classmethod
+    def from_dicts(cls, associations):
+        """Create the columns from associations in their dictionary format (see from_dict).
+
+        :param associations:    The associations, sorted by date.
+        :type associations:     list
+        :return:                The columns.
+        :rtype:                 CodeColumns
+
+        """
+
+        return cls(
+            array.array(_COLUMN_TYPES["Date"], [parse_ordinal(i["Date"]) if isinstance(i["Date"], str)
+                                                else i["Date"].toordinal() for i in associations]),
+            array.array(_COLUMN_TYPES["Val1"], [i.get("Val1", 0) for i in associations]),
+            array.array(_COLUMN_TYPES["Val2"], [i.get("Val2", 0) for i in associations]),
+            [sys.intern(i.get("Text", "")) for i in associations]
+        )
+
+    @classmethod
+    def from_columns(cls, dates, val1s=None, val2s=None):
+        """Create the columns from the dates and values of the associations given column by column.
+
+        :param dates:   The YYYY-MM-DD dates of the associations in chronological order.
+        :type dates:    list
+        :param val1s:   The first value of each association (None to set them all to 0).
+        :type val1s:    list | None
+        :param val2s:   The second value of each association (None to set them all to 0).
+        :type val2s:    list | None
+        :return:        The columns.
+        :rtype:         CodeColumns
+
+        """
+
+        zeros = [0] * len(dates)
+        return cls(
+            array.array(_COLUMN_TYPES["Date"], map(parse_ordinal, dates)),
+            array.array(_COLUMN_TYPES["Val1"], zeros if val1s is None else val1s),
+            array.array(_COLUMN_TYPES["Val2"], zeros if val2s is None else val2s),
+            [""] * len(dates)
+        )
+
+    def __len__(self):
+        return len(self.Date)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CodeColumns(self.Date[index], self.Val1[index], self.Val2[index], self.Text[index])
+        return Association(from_ordinal(self.Date[index]), self.Val1[index], self.Val2[index], self.Text[index])
+
+    def __iter__(self):
+        for date, val1, val2, text in zip(self.Date, self.Val1, self.Val2, self.Text):
+            yield Association(from_ordinal(date), val1, val2, text)
+
+    def __eq__(self, other):
+        if isinstance(other, CodeColumns):
+            return (self.Date, self.Val1, self.Val2, self.Text) == (other.Date, other.Val1, other.Val2, other.Text)
+        if isinstance(other, list):
+            return len(self) == len(other) and all(i == j for i, j in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None  # Columns are mutable, so are not hashable.
+
+    def __getstate__(self):
+        return self.Date, self.Val1, self.Val2, self.Text
+
+    def __setstate__(self, state):
+        self.Date, self.Val1, self.Val2, self.Text = state
+
+    def __repr__(self):
+        return "CodeColumns({!r})".format(list(self))
+
+    def column(self, field):
+        """Get the values of a field for every association.
+
+        :param field:   The field (one of FIELDS).
+        :type field:    str
+        :return:        The values of the field. The value and text columns are returned as they are stored, while the
+                            dates are converted to datetime objects.
+        :rtype:         array.array | list
+
+        """
+
+        if field == "Date":
+            return [from_ordinal(i) for i in self.Date]
+        return getattr(self, field)
+
+    def take(self, positions):
+        """Select the associations at a list of positions.
+
+        :param positions:   The positions of the associations to select, in increasing order.
+        :type positions:    list
+        :return:            The selected associations (the columns themselves if every association is selected).
+        :rtype:             CodeColumns
+
+        """
+
+        if len(positions) == len(self.Date):
+            return self
+        return CodeColumns(*[array.array(i.typecode, [i[j] for j in positions])
+                             for i in (self.Date, self.Val1, self.Val2)], [self.Text[i] for i in positions])
+
+    def as_numpy(self):
+        """View the columns as NumPy arrays without copying them.
+
+        :return:    The NumPy array of each array column (the text is a list, and so has none) indexed by field name,
+                    or None if NumPy is not installed.
+        :rtype:     dict | None
+
+        """
+
+        if numpy is None:
+            return None
+        return {i: numpy.frombuffer(getattr(self, i), dtype=numpy.dtype(j)) for i, j in _COLUMN_TYPES.items()}
+
+
+def bisect_left(associations, date, lo=0):
+    """Find the position of the first association with a date no earlier than a given date.
+
+    :param associations:    The associations of a code, sorted by date.
+    :type associations:     list | CodeColumns
+    :param date:            The date to find.
+    :type date:             datetime.datetime
+    :param lo:              The position to start searching from.
+    :type lo:               int
+    :return:                The position of the first association dated on or after date.
+    :rtype:                 int
+
+    """
+
+    if isinstance(associations, CodeColumns):
+        # The associations are at midnight, so a date later in the day falls before the next day's associations.
+        ordinal = date.toordinal()
+        ordinal += date != datetime.datetime.fromordinal(ordinal)
+        return bisect.bisect_left(associations.Date, ordinal, lo)
+    return _bisect_dates(associations, date, lo, operator.lt)
+
+
+def bisect_right(associations, date, lo=0):
+    """Find the position of the first association with a date later than a given date.
+
+    :param associations:    The associations of a code, sorted by date.
+    :type associations:     list | CodeColumns
+    :param date:            The date to find.
+    :type date:             datetime.datetime
+    :param lo:              The position to start searching from.
+    :type lo:               int
+    :return:                The position of the first association dated after date.
+    :rtype:                 int
+
+    """
+
+    if isinstance(associations, CodeColumns):
+        return bisect.bisect_right(associations.Date, date.toordinal(), lo)
+    return _bisect_dates(associations, date, lo, operator.le)
+
+
+def _bisect_dates(associations, date, lo, isBefore):
+    """Bisect a list of associations by date.
+
+    This is done by hand rather than with the bisect module, as its key argument is only available from Python 3.10.
+
+    :param associations:    The associations of a code, sorted by date.
+    :type associations:     list
+    :param date:            The date to find.
+    :type date:             datetime.datetime
+    :param lo:              The position to start searching from.
+    :type lo:               int
+    :param isBefore:        The comparison that is true for the dates of the associations before the position found
+                                (operator.lt to bisect left and operator.le to bisect right).
+    :type isBefore:         callable
+    :return:                The position of the first association whose date is not before date.
+    :rtype:                 int
+
+    """
+
+    hi = len(associations)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if isBefore(associations[mid].Date, date):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def convert_record(patientRecord):
+    """Convert the associations in a patient's record to Association objects or CodeColumns in place.
+
+    Codes with at least COLUMNS_THRESHOLD associations are stored as CodeColumns, and the rest as lists of Association
+    objects. Codes whose associations have already been converted are left unchanged. See from_dict for the conversion
+    of each association.
+
+    :param patientRecord:   A patient's medical record mapping each code to a list of its associations with the patient.
+    :type patientRecord:    dict
+
+    """
+
+    for code, associations in patientRecord.items():
+        if not associations or isinstance(associations, CodeColumns) or isinstance(associations[0], Association):
+            continue
+        elif len(associations) >= COLUMNS_THRESHOLD:
+            patientRecord[code] = CodeColumns.from_dicts(associations)
+        else:
+            patientRecord[code] = [
+                Association(parse_date(i["Date"]) if isinstance(i["Date"], str) else i["Date"], i.get("Val1", 0),
+                            i.get("Val2", 0), sys.intern(i.get("Text", "")))
+                for i in associations
+            ]
+
+
+def convert_columns(dates, val1s=None, val2s=None):
+    """Convert the associations of a code given column by column to Association objects or a CodeColumns.
+
+    As with convert_record, codes with at least COLUMNS_THRESHOLD associations are stored as CodeColumns. The
+    associations have no text.
+
+    :param dates:   The YYYY-MM-DD dates of the associations in chronological order.
+    :type dates:    list
+    :param val1s:   The first value of each association (None to set them all to 0).
+    :type val1s:    list | None
+    :param val2s:   The second value of each association (None to set them all to 0).
+    :type val2s:    list | None
+    :return:        The associations.
+    :rtype:         list | CodeColumns
+
+    """
+
+    if len(dates) >= COLUMNS_THRESHOLD:
+        return CodeColumns.from_columns(dates, val1s, val2s)
+    zeros = [0] * len(dates)
+    return list(map(Association, map(parse_date, dates), zeros if val1s is None else val1s,
+                    zeros if val2s is None else val2s))
+
+
+def field_values(associations, field):
+    """Get the values of a field for each of a code's associations.
+
+    :param associations:    The associations of a code.
+    :type associations:     list | CodeColumns
+    :param field:           The field (one of FIELDS).
+    :type field:            str
+    :return:                The values of the field, in the order of the associations.
+    :rtype:                 list | array.array
+
+    """
+
+    if isinstance(associations, CodeColumns):
+        return associations.column(field)
+    return list(map(operator.attrgetter(field), associations))
+
+
+def filter_associations(associations, field, predicate):
+    """Select the associations of a code whose value for a field meets a condition.
+
+    :param associations:    The associations of a code.
+    :type associations:     list | CodeColumns
+    :param field:           The field (one of FIELDS) to check.
+    :type field:            str
+    :param predicate:       The function checking the value of the field.
+    :type predicate:        function
+    :return:                The associations meeting the condition, in the same representation as the input.
+    :rtype:                 list | CodeColumns
+
+    """
+
+    if isinstance(associations, CodeColumns):
+        return associations.take([i for i, j in enumerate(associations.column(field)) if predicate(j)])
+    getField = operator.attrgetter(field)
+    return [i for i in associations if predicate(getField(i))]
+
+
+@functools.lru_cache(maxsize=65536)
+def from_ordinal(ordinal):
+    """Convert the ordinal of a date stored in a CodeColumns to a datetime.
+
+    :param ordinal: The ordinal of the date.
+    :type ordinal:  int
+    :return:        The date.
+    :rtype:         datetime.datetime
+
+    """
+
+    return datetime.datetime.fromordinal(ordinal)
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_date(date):
+    """Parse a YYYY-MM-DD date.
+
+    Most dates recur across many associations and patients, so parsed dates are cached.
+
+    :param date:    The date to parse.
+    :type date:     str
+    :return:        The parsed date.
+    :rtype:         datetime.datetime
+
+    """
+
+    return datetime.datetime.strptime(date, "%Y-%m-%d")
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_ordinal(date):
+    """Parse a YYYY-MM-DD date into the ordinal of the day.
+
+    :param date:    The date to parse.
+    :type date:     str
+    :return:        The ordinal of the date.
+    :rtype:         int
+
+    """
+
+    return parse_date(date).toordinal()
+
@@ -0,0 +1,141 @@
+"""Mapping from codes to their descriptions with an index for finding all codes beginning with a prefix."""
+
+# Python imports.
+import bisect
+import logging
+import os
+import pickle
+import tempfile
+
+# User imports.
+from . import conf
+
+# Globals.
+LOGGER = logging.getLogger(__name__)
+CACHE_VERSION = 1  # Increment whenever the format of the cached dictionary changes.
+
+
+class CodeDictionary(dict):
+    """Mapping from codes to their descriptions that can efficiently find all codes beginning with a given prefix.
+
+    The codes are kept in a sorted list, so that all codes beginning with a prefix form a contiguous run of the list
+    starting at the position the prefix would be inserted at. Finding them therefore takes time proportional to the
+    logarithm of the size of the dictionary plus the number of matching codes, rather than requiring a scan of every
+    code in the dictionary.
+
+    The sorted list is built when the dictionary is created. Codes added afterwards are only found by prefix once
+    reindex has been called.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Initialise the dictionary in the same way as a dict, and build the prefix index."""
+
+        super().__init__(*args, **kwargs)
+        self.sortedCodes = []
+        self.reindex()
+
+    def reindex(self):
+        """Rebuild the prefix index from the codes currently in the dictionary."""
+
+        self.sortedCodes = sorted(self)
+
+    def codes_with_prefix(self, prefix):
+        """Find all codes that begin with a given prefix.
+
+        :param prefix:  The prefix to find the codes for (an empty prefix matches all codes).
+        :type prefix:   str
+        :return:        The codes beginning with the prefix in sorted order.
+        :rtype:         list
+
+        """
+
+        sortedCodes = self.sortedCodes
+        start = bisect.bisect_left(sortedCodes, prefix)
+        end = start
+        numCodes = len(sortedCodes)
+        while end < numCodes and sortedCodes[end].startswith(prefix):
+            end += 1
+        return sortedCodes[start:end]
+
+
+def load(fileCodeDescriptions, fileCache=None, useCache=True):
+    """Load the mapping from codes to their descriptions, using a cached copy of the indexed mapping when possible.
+
+    The cache is a pickled CodeDictionary (with its prefix index) stored alongside the file of code descriptions. It is
+    reused as long as the file of code descriptions has the same size and modification time as when the cache was
+    created, and the cache was created by the current version of this module. Otherwise, the file of code
+    descriptions is read and the cache recreated. Failing to read or write the cache is not an error, as the
+    dictionary can always be loaded from the file of code descriptions.
+
+    :param fileCodeDescriptions:    The location of the file containing the mapping of codes to their descriptions.
+    :type fileCodeDescriptions:     str
+    :param fileCache:               The location of the cache. Defaults to the location of the file of code
+                                        descriptions with .index.pickle appended.
+    :type fileCache:                str | None
+    :param useCache:                Whether to use (and create) the cache.
+    :type useCache:                 bool
+    :return:                        The mapping from each code to its description.
+    :rtype:                         CodeDictionary
+
+    """
+
+    if not useCache:
+        return read_code_descriptions(fileCodeDescriptions)
+
+    fileCache = fileCache or fileCodeDescriptions + ".index.pickle"
+    sourceStats = os.stat(fileCodeDescriptions)
+    cacheKey = (CACHE_VERSION, sourceStats.st_size, sourceStats.st_mtime_ns)
+
+    # Attempt to load the cached dictionary. The key is pickled first so that a stale cache can be detected without
+    # unpickling the dictionary.
+    try:
+        with open(fileCache, 'rb') as fidCache:
+            if pickle.load(fidCache) == cacheKey:
+                mapCodeToDescription = pickle.load(fidCache)
+                if isinstance(mapCodeToDescription, CodeDictionary):
+                    return mapCodeToDescription
+    except FileNotFoundError:
+        pass
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, TypeError) as e:
+        if conf.isLogging:
+            LOGGER.warning("Could not read the code dictionary cache {:s} - {:s}".format(fileCache, str(e)))
+
+    # Load the dictionary from the file of code descriptions and recreate the cache. The cache is written to a
+    # temporary file that then replaces any existing cache, so that concurrent runs never see a partial cache.
+    mapCodeToDescription = read_code_descriptions(fileCodeDescriptions)
+    fileTemp = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(fileCache)), suffix=".tmp",
+                                         delete=False) as fidTemp:
+            fileTemp = fidTemp.name
+            pickle.dump(cacheKey, fidTemp, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(mapCodeToDescription, fidTemp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fileTemp, fileCache)
+    except OSError as e:
+        if conf.isLogging:
+            LOGGER.warning("Could not write the code dictionary cache {:s} - {:s}".format(fileCache, str(e)))
+        if fileTemp and os.path.exists(fileTemp):
+            os.remove(fileTemp)
+
+    return mapCodeToDescription
+
+
+def read_code_descriptions(fileCodeDescriptions):
+    """Read the mapping from codes to their descriptions from a file.
+
+    :param fileCodeDescriptions:    The location of the file containing the mapping of codes to their descriptions.
+    :type fileCodeDescriptions:     str
+    :return:                        The mapping from each code to its description.
+    :rtype:                         CodeDictionary
+
+    """
+
+    mapCodeToDescription = {}
+    with open(fileCodeDescriptions, 'r') as fidCodeDescriptions:
+        for line in fidCodeDescriptions:
+            line = line.strip()
+            chunks = line.split('\t')
+            mapCodeToDescription[chunks[0]] = chunks[1]
+
+    return CodeDictionary(mapCodeToDescription)
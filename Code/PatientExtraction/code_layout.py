@@ -0,0 +1,320 @@
+"""Write and read the patient data in a code layout, with the associations grouped by code rather than by patient.
+
+Case definitions usually refer to a few hundred codes out of the many thousands in the patient data. The code layout
+stores the flat file of patient data FlatPatientData.tsv as two files:
+    FlatPatientData.codes.tsv - The associations of each code in one contiguous block, ordered by code. Each line
+        of a block holds one association as "Position\tRank\tDate\tVal1\tVal2", where Position is the line of the
+        patient in the flat file, Rank is the position of the code in the patient's record and Date is in YYYY-MM-DD
+        format. The lines of a block are ordered by patient, and then chronologically.
+    FlatPatientData.codes.json - The directory of the layout, holding the IDs of the patients in the order of the flat
+        file and the byte range [start, end) of each code's block.
+The extraction is given the .codes.tsv file, and only reads the blocks of the codes that the case definitions use.
+These blocks are merged to regroup their associations by patient (see read_patients), so the amount read depends on
+the codes of interest rather than on the size of the whole data set. As with the split layout (see split_layout),
+the free text of the associations is not stored, as no output uses it.
+
+The layout is written by sorting the associations by code in runs of a bounded size that are spilled to temporary
+files, and then merging the runs (see CodeLayoutWriter).
+
+"""
+
+# Python imports.
+import argparse
+import heapq
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+# User imports.
+from . import association
+from . import code_matcher
+from . import parse_case_definitions
+
+# Globals.
+LAYOUT_VERSION = 1  # Increment whenever the format of the layout changes.
+FILE_SUFFIXES = {"Data": ".codes.tsv", "Directory": ".codes.json"}  # The suffix of each file.
+RUN_SIZE = 1000000  # The number of associations sorted in memory before being spilled to a temporary run file.
+READ_SIZE = 1 << 20  # The number of bytes of a code's block to read at a time.
+
+
+def layout_files(fileOutput):
+    """Determine the locations of the files of a code layout.
+
+    :param fileOutput:  The location of the flat file that the layout stores (e.g. FlatPatientData.tsv).
+    :type fileOutput:   str
+    :return:            The location of the data and directory files, indexed by Data and Directory.
+    :rtype:             dict
+
+    """
+
+    fileBase = fileOutput[:-len(".tsv")] if fileOutput.endswith(".tsv") else fileOutput
+    return {i: fileBase + j for i, j in FILE_SUFFIXES.items()}
+
+
+def is_code_layout(filePatientData):
+    """Determine whether a file of patient data is the data file of a code layout.
+
+    :param filePatientData: The location of the file of patient data.
+    :type filePatientData:  str
+    :return:                Whether the file is the data file of a code layout.
+    :rtype:                 bool
+
+    """
+
+    return filePatientData.endswith(FILE_SUFFIXES["Data"])
+
+
+class CodeLayoutWriter(object):
+    """Write patients to a code layout in the order of the flat file."""
+
+    def __init__(self, fileOutput, runSize=RUN_SIZE):
+        """Initialise the writer.
+
+        :param fileOutput:  The location used to name the files of the layout (see layout_files).
+        :type fileOutput:   str
+        :param runSize:     The number of associations to sort in memory before spilling them to a run file.
+        :type runSize:      int
+
+        """
+
+        self.files = layout_files(fileOutput)
+        self.runSize = runSize
+        self.patientIDs = []  # The ID of each patient added, in the order they were added.
+        self.rows = []  # The associations not yet spilled to a run file.
+        self.dirRuns = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(self.files["Data"])), suffix=".runs")
+        self.fileRuns = []  # The locations of the run files.
+
+    def add_patient(self, patientID, patientData):
+        """Add the next patient to the layout.
+
+        :param patientID:   The ID of the patient.
+        :type patientID:    str
+        :param patientData: The patient's medical history, mapping each code to its chronologically sorted associations
+                                in the format of the flat file (i.e. dictionaries with a YYYY-MM-DD date).
+        :type patientData:  dict
+
+        """
+
+        position = len(self.patientIDs)
+        self.patientIDs.append(patientID)
+        for rank, (code, associations) in enumerate(patientData.items()):
+            self.rows.extend(
+                "{:s}\t{:d}\t{:d}\t{:s}\t{:s}\t{:s}\n".format(code, position, rank, i["Date"],
+                                                             json.dumps(i.get("Val1", 0)), json.dumps(i.get("Val2", 0)))
+                for i in associations
+            )
+        if len(self.rows) >= self.runSize:
+            self._spill()
+
+    def finish(self):
+        """Merge the runs into the data file of the layout, and write its directory."""
+
+        try:
+            self._spill()
+            codeRanges = {}  # The byte range of each code's block.
+            fidRuns = [open(i, 'r') for i in self.fileRuns]
+            try:
+                # The runs were added in the order of the patients, so taking the rows with the same code from the runs
+                # in order keeps the rows of each code's block ordered by patient.
+                rows = heapq.merge(*fidRuns, key=lambda row: row.partition('\t')[0])
+                with open(self.files["Data"], 'wb') as fidData:
+                    for code, codeRows in itertools.groupby(rows, key=lambda row: row.partition('\t')[0]):
+                        start = fidData.tell()
+                        fidData.writelines(i.partition('\t')[2].encode("utf-8") for i in codeRows)
+                        codeRanges[code] = [start, fidData.tell()]
+            finally:
+                for i in fidRuns:
+                    i.close()
+            with open(self.files["Directory"], 'w') as fidDirectory:
+                json.dump({"Version": LAYOUT_VERSION, "Patients": self.patientIDs, "Codes": codeRanges}, fidDirectory)
+        finally:
+            shutil.rmtree(self.dirRuns, ignore_errors=True)
+
+    def _spill(self):
+        """Sort the associations not yet spilled by code and write them to a new run file."""
+
+        if not self.rows:
+            return
+        # The sort is stable, so each code's rows stay ordered by patient and then chronologically.
+        self.rows.sort(key=lambda row: row.partition('\t')[0])
+        fileRun = os.path.join(self.dirRuns, "Run{:d}.tsv".format(len(self.fileRuns)))
+        with open(fileRun, 'w') as fidRun:
+            fidRun.writelines(self.rows)
+        self.fileRuns.append(fileRun)
+        self.rows = []
+
+
+def build(filePatientData, fileOutput=None, runSize=RUN_SIZE):
+    """Write a flat file of patient data (with or without summaries) in the code layout.
+
+    :param filePatientData: The location of the flat file of patient data.
+    :type filePatientData:  str
+    :param fileOutput:      The location used to name the files of the layout (see layout_files). Defaults to the
+                                location of the flat file.
+    :type fileOutput:       str | None
+    :param runSize:         The number of associations to sort in memory before spilling them to a run file.
+    :type runSize:          int
+    :return:                The locations of the files of the layout.
+    :rtype:                 dict
+
+    """
+
+    writer = CodeLayoutWriter(fileOutput or filePatientData, runSize)
+    decoder = json.JSONDecoder()
+    with open(filePatientData, 'r') as fidPatientData:
+        for line in fidPatientData:
+            patientID, _, recordText = line.partition('\t')
+            # Any summaries after the record are ignored.
+            writer.add_patient(patientID, decoder.raw_decode(recordText)[0])
+    writer.finish()
+    return writer.files
+
+
+def load_directory(fileData):
+    """Load the directory of a code layout.
+
+    :param fileData:    The location of the data file of the layout.
+    :type fileData:     str
+    :return:            The directory, with the IDs of the patients under Patients and the byte range of each code's
+                            block under Codes.
+    :rtype:             dict
+
+    """
+
+    fileDirectory = fileData[:-len(FILE_SUFFIXES["Data"])] + FILE_SUFFIXES["Directory"]
+    with open(fileDirectory, 'r') as fidDirectory:
+        directory = json.load(fidDirectory)
+    if directory.get("Version") != LAYOUT_VERSION:
+        raise ValueError("The code layout directory {:s} has version {} where version {:d} was expected.".format(
+            fileDirectory, directory.get("Version"), LAYOUT_VERSION))
+    return directory
+
+
+def needed_codes(directory, caseDefinitions, caseNames):
+    """Determine the codes of a code layout whose blocks are needed to extract a set of case definitions.
+
+    :param directory:       The directory of the layout.
+    :type directory:        dict
+    :param caseDefinitions: The case definitions.
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions to extract.
+    :type caseNames:        list
+    :return:                The codes in the layout used by any case (or by a case referred to by their relative date
+                                restrictions), in the order of the layout.
+    :rtype:                 list
+
+    """
+
+    caseCodes = code_matcher.combine(caseDefinitions,
+                                     parse_case_definitions.evaluation_order(caseDefinitions, caseNames))
+    return [i for i in directory["Codes"] if i in caseCodes]
+
+
+def read_patients(fileData, codes, directory=None, progressReporter=None):
+    """Generate the records of every patient in a code layout, restricted to a set of codes.
+
+    The blocks of the codes are each read in order and merged by patient, so that only one patient's associations
+    need to be held in memory at a time. Patients are generated in the order of the flat file, including those without
+    any of the codes (who have empty records).
+
+    :param fileData:            The location of the data file of the layout.
+    :type fileData:             str
+    :param codes:               The codes to read the blocks of.
+    :type codes:                iterable
+    :param directory:           The directory of the layout (loaded if not supplied).
+    :type directory:            dict | None
+    :param progressReporter:    The reporter to record the number of bytes read and patients generated with (None to
+                                    not report progress).
+    :type progressReporter:     progress.ProgressReporter | None
+    :return:                    A generator of (patientID, record) tuples, where the codes in each record are in the
+                                    order they were in the patient's record in the flat file.
+    :rtype:                     generator
+
+    """
+
+    directory = directory or load_directory(fileData)
+    patientIDs = directory["Patients"]
+    codeRanges = directory["Codes"]
+    bytesRead = [0]  # The number of bytes read since the progress was last updated.
+    with open(fileData, 'rb') as fidData:
+        blocks = [_read_block(fidData, i, *codeRanges[i], bytesRead=bytesRead) for i in codes if i in codeRanges]
+        rows = heapq.merge(*blocks, key=lambda row: row[:2])
+        patientRows = itertools.groupby(rows, key=lambda row: row[0])
+        nextPosition, nextRows = next(patientRows, (len(patientIDs), None))
+        for position, patientID in enumerate(patientIDs):
+            record = {}
+            if position == nextPosition:
+                for (_, code), codeRows in itertools.groupby(nextRows, key=lambda row: row[1:3]):
+                    codeRows = list(codeRows)
+                    record[code] = association.convert_columns([i[3] for i in codeRows], [i[4] for i in codeRows],
+                                                               [i[5] for i in codeRows])
+                nextPosition, nextRows = next(patientRows, (len(patientIDs), None))
+            if progressReporter and (position + 1) % progressReporter.checkEvery == 0:
+                progressReporter.update(bytesRead[0], progressReporter.checkEvery)
+                bytesRead[0] = 0
+            yield patientID, record
+        if progressReporter:
+            progressReporter.update(bytesRead[0], len(patientIDs) % progressReporter.checkEvery)
+
+
+def blocks_size(directory, codes):
+    """Determine the number of bytes in the blocks of a set of codes.
+
+    :param directory:   The directory of the layout.
+    :type directory:    dict
+    :param codes:       The codes.
+    :type codes:        iterable
+    :return:            The total size of the blocks of the codes.
+    :rtype:             int
+
+    """
+
+    return sum(directory["Codes"][i][1] - directory["Codes"][i][0] for i in codes if i in directory["Codes"])
+
+
+def _read_block(fidData, code, start, end, bytesRead=None):
+    """Generate the associations in a code's block.
+
+    The block is read a chunk at a time, seeking to the next chunk before each read so that the blocks of multiple
+    codes can be read from the same file at once.
+
+    :param fidData:     The data file of the layout, opened in binary mode.
+    :type fidData:      file
+    :param code:        The code.
+    :type code:         str
+    :param start:       The offset of the start of the block.
+    :type start:        int
+    :param end:         The offset of the end of the block.
+    :type end:          int
+    :param bytesRead:   A list holding a count of the bytes read to add to (None to not count the bytes read).
+    :type bytesRead:    list | None
+    :return:            A generator of (position, rank, code, date, Val1, Val2) tuples, ordered by patient and then
+                            chronologically.
+    :rtype:             generator
+
+    """
+
+    remainder = b''
+    while start < end:
+        fidData.seek(start)
+        chunk = fidData.read(min(READ_SIZE, end - start))
+        if not chunk:
+            raise ValueError("The block of code {:s} ends beyond the end of the data file.".format(code))
+        start += len(chunk)
+        if bytesRead is not None:
+            bytesRead[0] += len(chunk)
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            position, rank, date, val1, val2 = line.decode("utf-8").split('\t')
+            yield int(position), int(rank), code, date, float(val1), float(val2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a flat file of patient data in the code layout, with the "
+                                                 "associations grouped by code.")
+    parser.add_argument("input", help="The location of the flat file of patient data.", type=str)
+    args = parser.parse_args()
+    build(args.input)
@@ -0,0 +1,127 @@
+"""Match the codes in patients' records against the codes and code prefixes of case definitions."""
+
+
+class CodeMatcher(object):
+    """Determine whether codes match a set of codes and code prefixes, excluding negated codes and prefixes.
+
+    A code matches if it is one of the codes or begins with one of the prefixes, and is neither one of the negated
+    codes nor begins with one of the negated prefixes. Prefixes are stored in a set and a code is checked by looking up
+    its leading characters for each distinct prefix length, so the cost of checking a code depends on the number of
+    distinct prefix lengths rather than the number of prefixes or of codes that the prefixes would expand to. As the
+    same codes are seen in many patients' records, the result for each code is also cached.
+
+    """
+
+    def __init__(self, codes=(), prefixes=(), negativeCodes=(), negativePrefixes=()):
+        """Initialise the matcher.
+
+        :param codes:               The codes to match exactly.
+        :type codes:                iterable
+        :param prefixes:            The prefixes of the codes to match.
+        :type prefixes:             iterable
+        :param negativeCodes:       The codes that never match.
+        :type negativeCodes:        iterable
+        :param negativePrefixes:    The prefixes of the codes that never match.
+        :type negativePrefixes:     iterable
+
+        """
+
+        self.codes = frozenset(codes)
+        self.prefixes = frozenset(prefixes)
+        self.negativeCodes = frozenset(negativeCodes)
+        self.negativePrefixes = frozenset(negativePrefixes)
+        self.prefixLengths = sorted({len(i) for i in self.prefixes})
+        self.negativePrefixLengths = sorted({len(i) for i in self.negativePrefixes})
+        self.cache = {}  # Whether each code checked so far matches.
+
+    def __contains__(self, code):
+        """Determine whether a code matches.
+
+        :param code:    The code to check.
+        :type code:     str
+        :return:        Whether the code matches.
+        :rtype:         bool
+
+        """
+
+        try:
+            return self.cache[code]
+        except KeyError:
+            isMatch = self.cache[code] = self._match(code)
+            return isMatch
+
+    def _match(self, code):
+        """Determine whether a code matches without using the cache.
+
+        :param code:    The code to check.
+        :type code:     str
+        :return:        Whether the code matches.
+        :rtype:         bool
+
+        """
+
+        if code in self.negativeCodes:
+            return False
+        for i in self.negativePrefixLengths:
+            if i > len(code):
+                break
+            if code[:i] in self.negativePrefixes:
+                return False
+        if code in self.codes:
+            return True
+        for i in self.prefixLengths:
+            if i > len(code):
+                break
+            if code[:i] in self.prefixes:
+                return True
+        return False
+
+    def select(self, patientRecord):
+        """Select the associations with matching codes from a patient's record.
+
+        :param patientRecord:   A patient's medical record. See patient_extraction.apply_restrictions for its format.
+        :type patientRecord:    dict
+        :return:                The patient's record restricted to the matching codes.
+        :rtype:                 dict
+
+        """
+
+        return {i: j for i, j in patientRecord.items() if i in self}
+
+
+def create(caseDefinition):
+    """Create the matcher for a case definition's codes if it uses code prefixes or negated codes.
+
+    :param caseDefinition:  The case definition. The codes and prefixes are taken from its "Codes", "Prefixes",
+                                "NegativeCodes" and "NegativePrefixes" entries.
+    :type caseDefinition:   dict
+    :return:                The matcher, or None if the case's codes are all positive and exact (in which case they
+                                can be looked up directly).
+    :rtype:                 CodeMatcher | None
+
+    """
+
+    if not (caseDefinition.get("Prefixes") or caseDefinition.get("NegativeCodes") or
+            caseDefinition.get("NegativePrefixes")):
+        return None
+    return CodeMatcher(caseDefinition["Codes"], caseDefinition.get("Prefixes", ()),
+                       caseDefinition.get("NegativeCodes", ()), caseDefinition.get("NegativePrefixes", ()))
+
+
+def combine(caseDefinitions, caseNames):
+    """Combine the codes of multiple case definitions into a container of every code matched by any of them.
+
+    Negated codes and prefixes are ignored, and so the container may include codes that no case definition matches.
+
+    :param caseDefinitions: The case definitions.
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions to combine.
+    :type caseNames:        list
+    :return:                The set of codes if no case definition uses code prefixes, otherwise a matcher.
+    :rtype:                 set | CodeMatcher
+
+    """
+
+    codes = set().union(*[caseDefinitions[i]["Codes"] for i in caseNames])
+    prefixes = set().union(*[caseDefinitions[i].get("Prefixes", ()) for i in caseNames])
+    return CodeMatcher(codes, prefixes) if prefixes else codes
@@ -0,0 +1,235 @@
+"""Index of the patients in a flat file of patient data that have each code.
+
+The index records, for each code, a bitmap of the patients with at least one association with the code (bit i being
+set when the patient on line i of the flat file has the code), along with the number of associations each of these
+patients has with the code. Case definitions that only ask whether a patient has any of their codes, or how many
+associations they have with them, can then be extracted for the whole cohort from the index alone (see
+is_indexable), with each case's patients found by taking the union of the bitmaps of its codes.
+
+The index is stored as a pickle alongside the flat file. It is only used while the flat file has the same size and
+modification time as when the index was created, and the index was created by the current version of this module.
+
+"""
+
+# Python imports.
+from array import array
+import argparse
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+# User imports.
+from . import conf
+
+# Globals.
+LOGGER = logging.getLogger(__name__)
+INDEX_VERSION = 1  # Increment whenever the format of the stored index changes.
+INDEXABLE_MODES = {"all", "earliest", "latest", "max1", "max2", "min1", "min2"}  # Modes selecting from every patient.
+INDEXABLE_OUTPUTS = {"count", "exists"}
+
+
+class CohortIndex(object):
+    """Bitmaps of the patients with each code, along with their number of associations with the code."""
+
+    def __init__(self):
+        """Initialise an empty index."""
+
+        self.patientIDs = []  # The ID of the patient on each line of the flat file.
+        self.bitmaps = {}  # The bitmap of the patients with each code.
+        self.counts = {}  # The association counts of the patients with each code, in the order of their lines.
+        self._positions = {}  # The lines of the patients with each code, while the index is being built.
+
+    def __getstate__(self):
+        self.finish()
+        return {"patientIDs": self.patientIDs, "bitmaps": self.bitmaps, "counts": self.counts}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._positions = {}
+
+    def add_patient(self, patientID, patientRecord):
+        """Add the next patient in the flat file to the index.
+
+        :param patientID:       The ID of the patient.
+        :type patientID:        str
+        :param patientRecord:   The patient's medical record, mapping each code to its associations with the patient.
+        :type patientRecord:    dict
+
+        """
+
+        position = len(self.patientIDs)
+        self.patientIDs.append(patientID)
+        for code, associations in patientRecord.items():
+            if associations:
+                if code not in self._positions:
+                    self._positions[code] = array('I')
+                    self.counts.setdefault(code, array('I'))
+                self._positions[code].append(position)
+                self.counts[code].append(len(associations))
+
+    def finish(self):
+        """Create the bitmaps of the codes added since the index was last finished.
+
+        Setting one bit at a time in a Python integer would copy the integer each time, so the bits are set in a byte
+        array that is only converted to an integer once all the patients have been added.
+
+        """
+
+        for code, positions in self._positions.items():
+            bits = bytearray((positions[-1] >> 3) + 1)
+            for i in positions:
+                bits[i >> 3] |= 1 << (i & 7)
+            self.bitmaps[code] = self.bitmaps.get(code, 0) | int.from_bytes(bits, "little")
+        self._positions = {}
+
+    def patient_flags(self, codes):
+        """Determine which patients have any of a set of codes.
+
+        :param codes:   The codes.
+        :type codes:    iterable
+        :return:        A string with a '1' for each patient (in the order of their lines) that has any of the codes,
+                            and a '0' for each patient that doesn't.
+        :rtype:         str
+
+        """
+
+        bitmap = 0
+        for i in codes:
+            bitmap |= self.bitmaps[i]
+        return bin(bitmap)[:1:-1].ljust(len(self.patientIDs), '0')  # The bits lowest first.
+
+    def patient_counts(self, codes):
+        """Determine the number of associations each patient has with a set of codes.
+
+        :param codes:   The codes.
+        :type codes:    iterable
+        :return:        The number of associations with the codes of each patient (in the order of their lines).
+        :rtype:         array
+
+        """
+
+        patientCounts = array('L', [0]) * len(self.patientIDs)
+        for i in codes:
+            bits = bin(self.bitmaps[i])[:1:-1]
+            position = bits.find('1')
+            for count in self.counts[i]:
+                patientCounts[position] += count
+                position = bits.find('1', position + 1)
+        return patientCounts
+
+
+def is_indexable(caseDefinition):
+    """Determine whether a case definition can be extracted for the whole cohort from the index.
+
+    :param caseDefinition:  The case definition.
+    :type caseDefinition:   dict
+    :return:                Whether the case has no restrictions, windows or relative date restrictions, only uses
+                                modes that select associations from every patient with the case's codes, and only
+                                uses the count and exists outputs.
+    :rtype:                 bool
+
+    """
+
+    return (not any(caseDefinition["Restrictions"].values()) and not caseDefinition.get("DateRange") and
+            not caseDefinition.get("Windows") and not caseDefinition.get("Relative") and
+            INDEXABLE_MODES.issuperset(caseDefinition["Modes"]) and
+            INDEXABLE_OUTPUTS.issuperset(caseDefinition["Outputs"]))
+
+
+def build(filePatientData):
+    """Build the index of a flat file of patient data.
+
+    :param filePatientData: The location of the flat file of patient data.
+    :type filePatientData:  str
+    :return:                The index.
+    :rtype:                 CohortIndex
+
+    """
+
+    cohortIndex = CohortIndex()
+    decoder = json.JSONDecoder()
+    with open(filePatientData, 'r') as fidPatientData:
+        for line in fidPatientData:
+            patientID, _, recordText = line.partition('\t')
+            # Any summaries after the record are ignored.
+            cohortIndex.add_patient(patientID, decoder.raw_decode(recordText)[0])
+    cohortIndex.finish()
+    return cohortIndex
+
+
+def save(cohortIndex, filePatientData, fileIndex=None):
+    """Save the index of a flat file of patient data alongside it.
+
+    The index is written to a temporary file that then replaces any existing index, so that concurrent runs never see a
+    partial index.
+
+    :param cohortIndex:     The index.
+    :type cohortIndex:      CohortIndex
+    :param filePatientData: The location of the flat file of patient data that the index was built from.
+    :type filePatientData:  str
+    :param fileIndex:       The location to save the index to. Defaults to the location of the flat file with
+                                .cohort.pickle appended.
+    :type fileIndex:        str | None
+
+    """
+
+    fileIndex = fileIndex or filePatientData + ".cohort.pickle"
+    sourceStats = os.stat(filePatientData)
+    indexKey = (INDEX_VERSION, sourceStats.st_size, sourceStats.st_mtime_ns)
+    fileTemp = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(fileIndex)), suffix=".tmp",
+                                         delete=False) as fidTemp:
+            fileTemp = fidTemp.name
+            pickle.dump(indexKey, fidTemp, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(cohortIndex, fidTemp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fileTemp, fileIndex)
+    finally:
+        if fileTemp and os.path.exists(fileTemp):
+            os.remove(fileTemp)
+
+
+def load(filePatientData, fileIndex=None):
+    """Load the index of a flat file of patient data if it exists and is up to date.
+
+    Failing to read the index is not an error, as the data can always be extracted from the flat file.
+
+    :param filePatientData: The location of the flat file of patient data.
+    :type filePatientData:  str
+    :param fileIndex:       The location of the index. Defaults to the location of the flat file with .cohort.pickle
+                                appended.
+    :type fileIndex:        str | None
+    :return:                The index, or None if there is no up to date index.
+    :rtype:                 CohortIndex | None
+
+    """
+
+    fileIndex = fileIndex or filePatientData + ".cohort.pickle"
+    sourceStats = os.stat(filePatientData)
+    indexKey = (INDEX_VERSION, sourceStats.st_size, sourceStats.st_mtime_ns)
+
+    # The key is pickled first so that a stale index can be detected without unpickling the index.
+    try:
+        with open(fileIndex, 'rb') as fidIndex:
+            if pickle.load(fidIndex) == indexKey:
+                cohortIndex = pickle.load(fidIndex)
+                if isinstance(cohortIndex, CohortIndex):
+                    return cohortIndex
+            elif conf.isLogging:
+                LOGGER.warning("The cohort index {:s} is out of date and will not be used.".format(fileIndex))
+    except FileNotFoundError:
+        pass
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, TypeError) as e:
+        if conf.isLogging:
+            LOGGER.warning("Could not read the cohort index {:s} - {:s}".format(fileIndex, str(e)))
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the cohort index of a flat file of patient data, and save it "
+                                                 "alongside the flat file.")
+    parser.add_argument("input", help="The location of the flat file of patient data.", type=str)
+    args = parser.parse_args()
+    save(build(args.input), args.input)
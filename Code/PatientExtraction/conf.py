@@ -16,13 +16,13 @@ def init():
     """Initialise the settings-like variables."""
 
     # Initialise the dictionary of valid modes, outputs and operators that can appear in a case definition file.
-    validModes = {"all": record_selector.all_selector,
-                  "earliest": record_selector.earliest_selector,
-                  "latest": record_selector.latest_selector,
-                  "max1": record_selector.max_selector("Val1"),
-                  "max2": record_selector.max_selector("Val2"),
-                  "min1": record_selector.min_selector("Val1"),
-                  "min2": record_selector.min_selector("Val2")}  # The valid code selection modes.
+    validModes = ModeChoices({"all": record_selector.all_selector,
+                              "earliest": record_selector.earliest_selector,
+                              "latest": record_selector.latest_selector,
+                              "max1": record_selector.max_selector("Val1"),
+                              "max2": record_selector.max_selector("Val2"),
+                              "min1": record_selector.min_selector("Val1"),
+                              "min2": record_selector.min_selector("Val2")})  # The valid code selection modes.
     validOutputs = {"code": record_outputter.code_outputter,
                     "count": record_outputter.count_outputter,
                     "date": record_outputter.date_outputter,
@@ -43,6 +43,43 @@ def init():
     validChoices = {"Modes": validModes, "Operators": validOperators, "Outputs": validOutputs}
 
 
+class ModeChoices(dict):
+    """Mapping from the names of valid modes to their selectors, including modes that select a number of associations.
+
+    Modes that select a number of associations (e.g. first3 or top5_val1) can not all be listed, and so their selectors
+    are created (see record_selector.create_selector) and added to the mapping the first time they are looked up.
+
+    """
+
+    def __missing__(self, mode):
+        """Create the selector for a mode that selects a number of associations.
+
+        :param mode:    The name of the mode.
+        :type mode:     str
+        :return:        The selector for the mode.
+        :rtype:         function
+
+        """
+
+        selector = record_selector.create_selector(mode)
+        if selector is None:
+            raise KeyError(mode)
+        self[mode] = selector
+        return selector
+
+    def __contains__(self, mode):
+        """Determine whether a mode is valid.
+
+        :param mode:    The name of the mode.
+        :type mode:     str
+        :return:        Whether the mode is valid.
+        :rtype:         bool
+
+        """
+
+        return super().__contains__(mode) or record_selector.PARAMETERISED_MODE.match(mode) is not None
+
+
 def control_logging(isOn=True):
     """Turn the logging on or off.
 
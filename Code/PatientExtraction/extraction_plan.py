@@ -0,0 +1,210 @@
+"""Compile case definitions into a serialisable extraction plan that can be reused across extraction runs.
+
+An extraction plan contains everything needed to perform an extraction once the case definitions have been annotated
+and parsed: the expanded code set, modes, outputs and normalised restrictions of each case definition. It has the
+format:
+    {
+        "Version": 1,
+        "Cases": [
+            {
+                "Name": "Case_Name",
+                "Codes": ["Code1", "Code2", ...],
+                "Prefixes": ["Prefix1", ...],
+                "NegativeCodes": ["Code3", ...],
+                "NegativePrefixes": ["Prefix2", ...],
+                "Modes": ["all", ...],
+                "Outputs": ["count", ...],
+                "Restrictions": {
+                    "Date": [["YYYY-MM-DD", "YYYY-MM-DD" or null], ...],
+                    "Val1": [[">", 5.0], ...],
+                    "Val2": [...]
+                },
+                "Windows": ["YYYY-MM-DD", "YYYY-MM-DD", "1y"] or null,
+                "Relative": [["Anchor_Case_Name", "earliest", 0, 90], ...]
+            },
+            ...
+        ]
+    }
+with the case definitions in the order they are output in. The prefixes and negated codes are only non-empty when the
+case definitions were compiled with prefix matching (see annotate_case_definitions.annotate). See
+parse_case_definitions.create_restriction for the meaning of the restrictions, create_windows for the meaning of the
+window series and resolve_relative_restrictions for the meaning of the relative date restrictions.
+
+"""
+
+# Python imports.
+import io
+import json
+import time
+
+# User imports.
+from . import annotate_case_definitions
+from . import code_matcher
+from . import parse_case_definitions
+
+# Globals.
+PLAN_VERSION = 1  # Increment whenever the format of the plan changes.
+
+
+def compile_plan(fileCaseDefs, fileCodeDescriptions, fileAnnotatedCaseDefs=None, useCodeCache=True, runStats=None,
+                 prefixMatching=False):
+    """Compile a file of case definitions into an extraction plan.
+
+    :param fileCaseDefs:            The location of the file containing the case definitions.
+    :type fileCaseDefs:             str
+    :param fileCodeDescriptions:    The location of the file containing the mapping from codes to their descriptions.
+    :type fileCodeDescriptions:     str
+    :param fileAnnotatedCaseDefs:   The location to write the annotated case definitions to (None to not write them).
+    :type fileAnnotatedCaseDefs:    str | None
+    :param useCodeCache:            Whether to use a cached and indexed copy of the mapping from codes to their
+                                        descriptions (see code_dictionary.load).
+    :type useCodeCache:             bool
+    :param runStats:                The statistics to record the time spent annotating and parsing in (None to record
+                                        nothing).
+    :type runStats:                 run_statistics.RunStatistics | None
+    :param prefixMatching:          Whether wildcard codes should be kept as prefixes to match against the codes in
+                                        patients' records, rather than being expanded using the code descriptions.
+    :type prefixMatching:           bool
+    :return:                        The extraction plan.
+    :rtype:                         dict
+
+    """
+
+    # Annotate the case definitions in memory, writing them out only so that the user can check them.
+    startTime = time.perf_counter()
+    mapCodeToDescription = annotate_case_definitions.load_code_descriptions(fileCodeDescriptions, useCodeCache)
+    annotatedCaseDefs = io.StringIO()
+    with open(fileCaseDefs, 'r') as fidCaseDefs:
+        annotate_case_definitions.annotate(fidCaseDefs, mapCodeToDescription, annotatedCaseDefs, prefixMatching)
+    if fileAnnotatedCaseDefs:
+        with open(fileAnnotatedCaseDefs, 'w') as fidAnnotatedCaseDefs:
+            fidAnnotatedCaseDefs.write(annotatedCaseDefs.getvalue())
+    if runStats is not None:
+        runStats.add_time("Annotation", time.perf_counter() - startTime)
+        if runStats.memory:
+            runStats.memory.end_stage("Annotation")
+
+    # Parse the annotated case definitions.
+    startTime = time.perf_counter()
+    caseDefinitions, caseNames = parse_case_definitions.parse(annotatedCaseDefs.getvalue().splitlines())
+    plan = create_plan(caseDefinitions, caseNames)
+    if runStats is not None:
+        runStats.add_time("Parsing", time.perf_counter() - startTime)
+        if runStats.memory:
+            runStats.memory.end_stage("Parsing")
+
+    return plan
+
+
+def create_plan(caseDefinitions, caseNames):
+    """Create an extraction plan from parsed case definitions.
+
+    :param caseDefinitions: The case definitions returned by parse_case_definitions.parse.
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions in the order they should be output.
+    :type caseNames:        list
+    :return:                The extraction plan.
+    :rtype:                 dict
+
+    """
+
+    return {
+        "Version": PLAN_VERSION,
+        "Cases": [
+            {"Name": i, "Codes": sorted(caseDefinitions[i]["Codes"]),
+             "Prefixes": sorted(caseDefinitions[i].get("Prefixes", ())),
+             "NegativeCodes": sorted(caseDefinitions[i].get("NegativeCodes", ())),
+             "NegativePrefixes": sorted(caseDefinitions[i].get("NegativePrefixes", ())),
+             "Modes": list(caseDefinitions[i]["Modes"]), "Outputs": list(caseDefinitions[i]["Outputs"]),
+             "Restrictions": caseDefinitions[i]["RestrictionSpecs"], "Windows": caseDefinitions[i].get("WindowSpec"),
+             "Relative": caseDefinitions[i].get("Relative", [])}
+            for i in caseNames
+        ]
+    }
+
+
+def build_case_definitions(plan):
+    """Create the case definitions described by an extraction plan.
+
+    :param plan:    The extraction plan.
+    :type plan:     dict
+    :return:        The case definitions and the names of the case definitions in the order they should be output, in
+                        the format returned by parse_case_definitions.parse.
+    :rtype:         dict, list
+
+    """
+
+    if plan.get("Version") != PLAN_VERSION:
+        raise ValueError("The extraction plan has version {0}, but version {1:d} is required. Recompile the plan from "
+                         "the case definitions.".format(plan.get("Version"), PLAN_VERSION))
+
+    caseDefinitions = {}
+    caseNames = []
+    for case in plan["Cases"]:
+        caseDefinition = {"Codes": set(case["Codes"]), "Prefixes": set(case["Prefixes"]),
+                          "NegativeCodes": set(case["NegativeCodes"]),
+                          "NegativePrefixes": set(case["NegativePrefixes"]), "Modes": list(case["Modes"]),
+                          "Outputs": list(case["Outputs"]), "Restrictions": {"Date": [], "Val1": [], "Val2": []},
+                          "RestrictionSpecs": {"Date": [], "Val1": [], "Val2": []}}
+        caseDefinition["Matcher"] = code_matcher.create(caseDefinition)
+        for i in caseDefinition["Restrictions"]:
+            for j in case["Restrictions"].get(i, []):
+                parse_case_definitions.add_restriction(caseDefinition, i, j)
+        caseDefinition["WindowSpec"] = case["Windows"]
+        parse_case_definitions.add_date_intervals(caseDefinition)
+        caseDefinition["Relative"] = [list(i) for i in case["Relative"]]
+        caseDefinitions[case["Name"]] = caseDefinition
+        caseNames.append(case["Name"])
+    parse_case_definitions.resolve_relative_restrictions(caseDefinitions, caseNames)
+
+    return caseDefinitions, caseNames
+
+
+def save_plan(plan, filePlan):
+    """Save an extraction plan.
+
+    :param plan:        The extraction plan.
+    :type plan:         dict
+    :param filePlan:    The location to save the plan to.
+    :type filePlan:     str
+
+    """
+
+    with open(filePlan, 'w') as fidPlan:
+        json.dump(plan, fidPlan, indent=4)
+        fidPlan.write('\n')
+
+
+def load_plan(filePlan):
+    """Load an extraction plan.
+
+    :param filePlan:    The location of the plan.
+    :type filePlan:     str
+    :return:            The extraction plan.
+    :rtype:             dict
+
+    """
+
+    with open(filePlan, 'r') as fidPlan:
+        return json.load(fidPlan)
+
+
+def is_plan_file(fileInput):
+    """Determine whether a file contains an extraction plan rather than case definitions.
+
+    Case definition files can only start with a case name (#), a control line (>), a code or a blank line, and so a
+    file whose first non-whitespace character starts a JSON object is taken to be an extraction plan.
+
+    :param fileInput:   The location of the file.
+    :type fileInput:    str
+    :return:            Whether the file contains an extraction plan.
+    :rtype:             bool
+
+    """
+
+    with open(fileInput, 'r') as fidInput:
+        for line in fidInput:
+            line = line.strip()
+            if line:
+                return line[0] == '{'
+    return False
@@ -0,0 +1,269 @@
+"""Track the memory used by an extraction run and decode oversized patient records one code at a time."""
+
+# Python imports.
+import heapq
+import json
+import json.decoder
+import os
+import re
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows.
+    resource = None
+
+# Globals.
+_STRUCTURE_CHARS = re.compile(r'["\[\]{}]')  # Characters that open or close a string, list or object in JSON.
+_WHITESPACE = re.compile(r"\s*")
+
+
+class MemoryMonitor(object):
+    """Record the memory high-water mark of each stage of a run, along with the largest patient records.
+
+    Memory is measured in two ways. If allocation tracing is on, then tracemalloc is used to record the current and
+    peak memory allocated by Python at the end of each stage (the peak is reset at the start of each stage). The
+    resident set size of the process is also sampled at the end of each stage and after every sampleEvery patients.
+
+    """
+
+    def __init__(self, traceAllocations=True, numLargestPatients=10, sampleEvery=1000):
+        """Initialise the monitor.
+
+        :param traceAllocations:    Whether tracemalloc should be used to trace the memory allocated by Python.
+        :type traceAllocations:     bool
+        :param numLargestPatients:  The number of largest patient records to keep a record of.
+        :type numLargestPatients:   int
+        :param sampleEvery:         The number of patients between samples of the resident set size.
+        :type sampleEvery:          int
+
+        """
+
+        self.traceAllocations = traceAllocations
+        self.numLargestPatients = numLargestPatients
+        self.sampleEvery = sampleEvery
+        self.stages = {}  # The memory usage at the end of each stage.
+        self.largestPatients = []  # Min heap of (size, patientID, associations, decodedBytes) for the largest records.
+        self.peakRSS = 0  # The largest resident set size sampled.
+        self.patientsSinceSample = 0
+
+    def start(self):
+        """Start tracing memory allocations (if allocation tracing is on)."""
+
+        if self.traceAllocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.sample_rss()
+
+    def stop(self):
+        """Stop tracing memory allocations."""
+
+        self.sample_rss()
+        if self.traceAllocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def end_stage(self, stage):
+        """Record the memory usage at the end of a stage, and reset the peak memory for the next stage.
+
+        :param stage:   The name of the stage that has ended.
+        :type stage:    str
+
+        """
+
+        stageMemory = {"RSS": self.sample_rss()}
+        if self.traceAllocations and tracemalloc.is_tracing():
+            stageMemory["Current"], stageMemory["Peak"] = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        self.stages[stage] = stageMemory
+
+    def traced_memory(self):
+        """Get the memory currently allocated by Python.
+
+        :return:    The number of bytes currently allocated, or None if allocations are not being traced.
+        :rtype:     int | None
+
+        """
+
+        return tracemalloc.get_traced_memory()[0] if self.traceAllocations and tracemalloc.is_tracing() else None
+
+    def record_patient(self, patientID, recordBytes, numAssociations, decodedBytes=None):
+        """Record the size of a patient's record, and periodically sample the resident set size.
+
+        :param patientID:       The ID of the patient.
+        :type patientID:        str
+        :param recordBytes:     The size of the patient's record in the flat file.
+        :type recordBytes:      int
+        :param numAssociations: The number of associations decoded from the patient's record.
+        :type numAssociations:  int
+        :param decodedBytes:    The memory allocated when decoding the record (None if not traced).
+        :type decodedBytes:     int | None
+
+        """
+
+        entry = (recordBytes, patientID, numAssociations, decodedBytes)
+        if len(self.largestPatients) < self.numLargestPatients:
+            heapq.heappush(self.largestPatients, entry)
+        elif recordBytes > self.largestPatients[0][0]:
+            heapq.heapreplace(self.largestPatients, entry)
+
+        self.patientsSinceSample += 1
+        if self.patientsSinceSample >= self.sampleEvery:
+            self.sample_rss()
+            self.patientsSinceSample = 0
+
+    def sample_rss(self):
+        """Sample the resident set size of the process, and update the peak resident set size.
+
+        :return:    The resident set size in bytes (0 if it can not be determined).
+        :rtype:     int
+
+        """
+
+        rss = get_rss()
+        self.peakRSS = max(self.peakRSS, rss)
+        return rss
+
+    def merge(self, other):
+        """Add the memory usage recorded by another monitor (e.g. in a worker process) to this one.
+
+        :param other:   The output of the to_dict method of the other monitor.
+        :type other:    dict
+
+        """
+
+        self.peakRSS = max(self.peakRSS, other["PeakRSS"])
+        for i in other["LargestPatients"]:
+            self.record_patient(i["PatientID"], i["RecordBytes"], i["Associations"], i["DecodedBytes"])
+        for i, j in other["Stages"].items():
+            if i in self.stages:
+                self.stages[i] = {k: max(l, self.stages[i].get(k, 0)) for k, l in j.items()}
+            else:
+                self.stages[i] = j
+
+    def to_dict(self):
+        """Convert the memory usage to a JSON serialisable dictionary.
+
+        :return:    The memory usage in the format:
+                        {
+                            "PeakRSS": 0,
+                            "Stages": {"Stage1": {"RSS": 0, "Current": 0, "Peak": 0}, ...},
+                            "LargestPatients": [
+                                {"PatientID": "ID", "RecordBytes": 0, "Associations": 0, "DecodedBytes": 0}, ...
+                            ]
+                        }
+                    where the largest patients are ordered from largest to smallest, and the traced memory is only
+                    present when allocations are traced.
+        :rtype:     dict
+
+        """
+
+        return {
+            "PeakRSS": max(self.peakRSS, get_peak_rss()),
+            "Stages": self.stages,
+            "LargestPatients": [{"PatientID": i[1], "RecordBytes": i[0], "Associations": i[2], "DecodedBytes": i[3]}
+                                for i in sorted(self.largestPatients, reverse=True)]
+        }
+
+
+def get_rss():
+    """Get the current resident set size of the process.
+
+    :return:    The resident set size in bytes, or 0 if it can not be determined.
+    :rtype:     int
+
+    """
+
+    try:
+        with open("/proc/self/statm", 'r') as fidStatm:
+            return int(fidStatm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # Not on Linux, so fall back to the peak resident set size.
+        return get_peak_rss()
+
+
+def get_peak_rss():
+    """Get the peak resident set size of the process.
+
+    :return:    The peak resident set size in bytes, or 0 if it can not be determined.
+    :rtype:     int
+
+    """
+
+    if resource is None:
+        return 0
+    # The maximum resident set size is reported in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def decode_codes(recordText, codes):
+    """Decode only the associations for a given set of codes from a patient's JSON encoded record.
+
+    The record is scanned one code at a time. The associations of codes that are not wanted are skipped over without
+    being decoded, meaning that only the wanted associations are ever held in memory as Python objects.
+
+    :param recordText:  The JSON encoded patient record (i.e. an object mapping codes to lists of associations).
+    :type recordText:   str
+    :param codes:       The codes to decode the associations of.
+    :type codes:        set
+    :return:            The patient's record restricted to the wanted codes.
+    :rtype:             dict
+
+    """
+
+    decoder = json.JSONDecoder()
+    record = {}
+    pos = _WHITESPACE.match(recordText, 0).end()
+    if recordText[pos] != '{':
+        raise ValueError("Expected a JSON object at position {:d}.".format(pos))
+    pos = _WHITESPACE.match(recordText, pos + 1).end()
+    while recordText[pos] != '}':
+        # Read the code.
+        if recordText[pos] != '"':
+            raise ValueError("Expected a code at position {:d}.".format(pos))
+        code, pos = json.decoder.scanstring(recordText, pos + 1)
+        pos = _WHITESPACE.match(recordText, pos).end()
+        if recordText[pos] != ':':
+            raise ValueError("Expected ':' at position {:d}.".format(pos))
+        pos = _WHITESPACE.match(recordText, pos + 1).end()
+
+        # Decode or skip the code's associations.
+        if code in codes:
+            record[code], pos = decoder.raw_decode(recordText, pos)
+        else:
+            pos = _skip_value(recordText, pos)
+
+        # Move on to the next code.
+        pos = _WHITESPACE.match(recordText, pos).end()
+        if recordText[pos] == ',':
+            pos = _WHITESPACE.match(recordText, pos + 1).end()
+    return record
+
+
+def _skip_value(text, pos):
+    """Find the end of the JSON list or object starting at a given position without decoding it.
+
+    :param text:    The JSON text.
+    :type text:     str
+    :param pos:     The position of the opening bracket of the list or object.
+    :type pos:      int
+    :return:        The position immediately after the closing bracket of the list or object.
+    :rtype:         int
+
+    """
+
+    depth = 0
+    while True:
+        match = _STRUCTURE_CHARS.search(text, pos)
+        if not match:
+            raise ValueError("Unterminated JSON value.")
+        char = match.group()
+        pos = match.end()
+        if char == '"':
+            # Skip over the string (handling any escaped quotes and brackets inside it).
+            pos = json.decoder.scanstring(text, pos)[1]
+        elif char in "[{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
@@ -0,0 +1,282 @@
+"""Sinks that write the extracted data to the output directory in different formats.
+
+Writing is split into two steps so that the expensive formatting can be done alongside the extraction (e.g. in the
+worker processes of a pipelined extraction), leaving only the writing of whole batches to the sink itself:
+    1) The function returned by the sink class's formatter method turns the extracted values of a patient into an
+        entry in the sink's format (e.g. a line of text or a database row).
+    2) The sink's writelines method writes a batch of these entries out.
+As sinks have writelines and flush methods, they can be used in place of an output file by pipeline.run.
+
+The available sinks are listed in SINKS, and created by name with create_sink.
+
+"""
+
+# Python imports.
+import gzip
+import json
+import lzma
+import os
+import sqlite3
+
+# User imports.
+from . import sparse_output
+
+
+class OutputSink(object):
+    """Base class for the sinks."""
+
+    def __init__(self, dirOutput, header, emptyRow):
+        """Initialise the sink, and write out the header of the extraction.
+
+        :param dirOutput:   The directory to write the output to.
+        :type dirOutput:    str
+        :param header:      The header of the extraction (i.e. "PatientID" followed by the name of each column).
+        :type header:       list
+        :param emptyRow:    The value of each column (excluding the patient ID column) for a patient without any
+                                associations extracted.
+        :type emptyRow:     list
+
+        """
+
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    @classmethod
+    def formatter(cls, header, emptyRow):
+        """Create the function that formats a patient's extracted values as an entry for the sink.
+
+        :param header:      The header of the extraction.
+        :type header:       list
+        :param emptyRow:    The value of each column for a patient without any associations extracted.
+        :type emptyRow:     list
+        :return:            A function taking a patient's ID and list of extracted values, and returning the entry.
+        :rtype:             function
+
+        """
+
+        raise NotImplementedError
+
+    def writelines(self, entries):
+        """Write out a batch of entries created by the sink's formatter.
+
+        :param entries: The entries to write.
+        :type entries:  list
+
+        """
+
+        raise NotImplementedError
+
+    def flush(self):
+        """Make sure that all entries written so far have been passed to the underlying storage."""
+
+        pass
+
+    def close(self):
+        """Finish writing the output."""
+
+        pass
+
+
+class TsvSink(OutputSink):
+    """Write the extracted data as a tab separated file, DataExtraction.tsv."""
+
+    fileName = "DataExtraction.tsv"
+
+    def __init__(self, dirOutput, header, emptyRow):
+        super().__init__(dirOutput, header, emptyRow)
+        self.fidOutput = self._open(os.path.join(dirOutput, self.fileName))
+        self.fidOutput.write("{:s}\n".format('\t'.join(header)))
+
+    @staticmethod
+    def _open(fileOutput):
+        """Open the file to write the output to.
+
+        :param fileOutput:  The location of the file.
+        :type fileOutput:   str
+        :return:            The file opened for writing text.
+        :rtype:             file
+
+        """
+
+        return open(fileOutput, 'w')
+
+    @classmethod
+    def formatter(cls, header, emptyRow):
+        return _format_tsv_line
+
+    def writelines(self, entries):
+        self.fidOutput.writelines(entries)
+
+    def flush(self):
+        self.fidOutput.flush()
+
+    def close(self):
+        self.fidOutput.close()
+
+
+class GzipTsvSink(TsvSink):
+    """Write the extracted data as a gzip compressed tab separated file, DataExtraction.tsv.gz."""
+
+    fileName = "DataExtraction.tsv.gz"
+
+    @staticmethod
+    def _open(fileOutput):
+        return gzip.open(fileOutput, 'wt', compresslevel=6)
+
+
+class LzmaTsvSink(TsvSink):
+    """Write the extracted data as an xz compressed tab separated file, DataExtraction.tsv.xz."""
+
+    fileName = "DataExtraction.tsv.xz"
+
+    @staticmethod
+    def _open(fileOutput):
+        return lzma.open(fileOutput, 'wt')
+
+
+class NdjsonSink(TsvSink):
+    """Write the extracted data as newline delimited JSON, DataExtraction.ndjson.
+
+    Each line is a JSON object mapping "PatientID" and the name of each column to the patient's value for it. There is
+    no header line, as the column names are in every object.
+
+    """
+
+    fileName = "DataExtraction.ndjson"
+
+    def __init__(self, dirOutput, header, emptyRow):
+        OutputSink.__init__(self, dirOutput, header, emptyRow)
+        self.fidOutput = self._open(os.path.join(dirOutput, self.fileName))
+
+    @classmethod
+    def formatter(cls, header, emptyRow):
+        encoder = json.JSONEncoder(ensure_ascii=False)
+
+        def format_patient(patientID, values):
+            """Format a patient's values as a line of newline delimited JSON."""
+
+            return encoder.encode(dict(zip(header, [patientID] + values))) + '\n'
+
+        return format_patient
+
+
+class SqliteSink(OutputSink):
+    """Write the extracted data to the DataExtraction table of an SQLite database, DataExtraction.sqlite.
+
+    The table has a PatientID column followed by one text column per column of the extraction. Each batch is inserted
+    with a single executemany call inside its own transaction. The database keeps SQLite's default rollback journal, so
+    an interrupted extraction leaves whole batches in the table, while synchronous = NORMAL avoids waiting on the disk
+    more than once per batch.
+
+    """
+
+    fileName = "DataExtraction.sqlite"
+    tableName = "DataExtraction"
+
+    def __init__(self, dirOutput, header, emptyRow):
+        super().__init__(dirOutput, header, emptyRow)
+        fileOutput = os.path.join(dirOutput, self.fileName)
+        for i in [fileOutput, fileOutput + "-journal"]:
+            # A journal left by an interrupted run would otherwise be rolled back into the new database.
+            if os.path.exists(i):
+                os.remove(i)
+        self.connection = sqlite3.connect(fileOutput, check_same_thread=False)  # Batches are written by a thread.
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        columns = [_quote_identifier(i) for i in header]
+        with self.connection:
+            self.connection.execute("CREATE TABLE {:s} ({:s})".format(
+                _quote_identifier(self.tableName), ', '.join("{:s} TEXT".format(i) for i in columns)
+            ))
+        self.insertStatement = "INSERT INTO {:s} VALUES ({:s})".format(_quote_identifier(self.tableName),
+                                                                     ', '.join('?' * len(header)))
+
+    @classmethod
+    def formatter(cls, header, emptyRow):
+        return _format_row
+
+    def writelines(self, entries):
+        with self.connection:
+            self.connection.executemany(self.insertStatement, entries)
+
+    def close(self):
+        self.connection.close()
+
+
+class SparseSink(OutputSink):
+    """Write the extracted data in the sparse format (see sparse_output)."""
+
+    def __init__(self, dirOutput, header, emptyRow):
+        super().__init__(dirOutput, header, emptyRow)
+        self.writer = sparse_output.SparseWriter(dirOutput, header, emptyRow)
+
+    @classmethod
+    def formatter(cls, header, emptyRow):
+        def format_patient(patientID, values):
+            """Format a patient's values as the lines of the sparse values file."""
+
+            return sparse_output.format_patient(patientID, values, emptyRow)
+
+        return format_patient
+
+    def writelines(self, entries):
+        self.writer.writelines(entries)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+# The sinks that can be chosen, indexed by name.
+SINKS = {"tsv": TsvSink, "tsv.gz": GzipTsvSink, "tsv.xz": LzmaTsvSink, "ndjson": NdjsonSink, "sqlite": SqliteSink,
+         "sparse": SparseSink}
+
+
+def create_sink(sinkName, dirOutput, header, emptyRow):
+    """Create a sink by name.
+
+    :param sinkName:    The name of the sink (one of the keys of SINKS).
+    :type sinkName:     str
+    :param dirOutput:   The directory to write the output to.
+    :type dirOutput:    str
+    :param header:      The header of the extraction (i.e. "PatientID" followed by the name of each column).
+    :type header:       list
+    :param emptyRow:    The value of each column for a patient without any associations extracted.
+    :type emptyRow:     list
+    :return:            The sink.
+    :rtype:             OutputSink
+
+    """
+
+    return SINKS[sinkName](dirOutput, header, emptyRow)
+
+
+def _format_tsv_line(patientID, values):
+    """Format a patient's values as a line of a tab separated file."""
+
+    return "{:s}\t{:s}\n".format(patientID, '\t'.join(values))
+
+
+def _format_row(patientID, values):
+    """Format a patient's values as a database row."""
+
+    return (patientID, *values)
+
+
+def _quote_identifier(identifier):
+    """Quote the name of an SQL table or column.
+
+    :param identifier:  The name.
+    :type identifier:   str
+    :return:            The quoted name.
+    :rtype:             str
+
+    """
+
+    return '"{:s}"'.format(identifier.replace('"', '""'))
@@ -2,11 +2,13 @@
 
 # Python imports.
 from collections import defaultdict
+import calendar
 import datetime
 import logging
 import re
 
 # User imports.
+from . import code_matcher
 from . import conf
 from . import restriction_comparator_generators
 
@@ -34,84 +36,136 @@ def main(fileCaseDefs):
                                         definition is indexed by its name and has as its associated value a mapping
                                         containing keys:
                                         "Codes" - The set of codes that are used to identify cases.
+                                        "Prefixes" - The set of code prefixes that are used to identify cases (only
+                                            present when the case definitions were annotated with prefix matching).
+                                        "NegativeCodes" - The set of codes that never identify cases (when prefix
+                                            matching).
+                                        "NegativePrefixes" - The set of code prefixes that never identify cases (when
+                                            prefix matching).
+                                        "Matcher" - The code_matcher.CodeMatcher for the case's codes and prefixes, or
+                                            None if the case only has positive codes.
                                         "Modes" - A set of the modes to use when extracting case information.
                                         "Outputs" - A set of the output methods to use when outputting case information.
                                         "Restrictions" - The restrictions in place on the patients selected. A
                                             restriction is represented by a function that takes a value and returns
                                             whether the patient-code association meets the restriction.
+                                        "RestrictionSpecs" - The restrictions in a serialisable form, with each
+                                            restriction given by the arguments needed to create its function with
+                                            create_restriction.
+                                        "WindowSpec" - The [start, end, step] of the case's window series, or None
+                                            if the case is not extracted in windows (see create_windows).
+                                        "Windows" - The (start, end) datetimes of each window in the case's window
+                                            series, or None if the case is not extracted in windows.
+                                        "Relative" - The case's relative date restrictions, each given as
+                                            [anchor case name, "earliest" or "latest", from days, to days] (see
+                                            resolve_relative_restrictions).
+                                        "IsAnchor" - Whether another case's relative date restrictions refer to
+                                            this case.
+                                        "DateRange" - The intersection of the case's date restrictions (and its
+                                            window series) as a (start, end) pair of datetimes, or None if the case
+                                            has no date restrictions (see create_date_range).
                                     2) The conditions that the user has requested patient data for in the order that
                                         they appear in the input file.
     :rtype:                         dict, list
 
     """
 
+    with open(fileCaseDefs, 'r') as fidCaseDefs:
+        return parse(fidCaseDefs)
+
+
+def parse(caseDefLines):
+    """Extract the codes, modes, outputs and restrictions that make up case definitions from annotated lines.
+
+    :param caseDefLines:            The lines of the annotated case definitions (e.g. an open file or a list of
+                                        strings). See main for the details of the expected format.
+    :type caseDefLines:             iterable
+    :return:                        The case definitions and the order of the case names. See main for the details.
+    :rtype:                         dict, list
+
+    """
+
     # Define the variable needed for parsing.
     caseDefinitions = defaultdict(  # The mapping containing the case definitions in easily accessible format.
-        lambda: {"Codes": set(), "Modes": set(), "Outputs": set(), "Restrictions": {"Date": [], "Val1": [], "Val2": []}}
+        lambda: {"Codes": set(), "Prefixes": set(), "NegativeCodes": set(), "NegativePrefixes": set(), "Modes": set(),
+                 "Outputs": set(), "Restrictions": {"Date": [], "Val1": [], "Val2": []},
+                 "RestrictionSpecs": {"Date": [], "Val1": [], "Val2": []}, "WindowSpec": None,
+                 "Relative": []}
     )
     caseDefsOrder = []  # The case definitions in the order they appear in the user's input file.
     currentCaseDef = ""  # The current case definition being parsed.
 
     # Perform the parsing.
-    with open(fileCaseDefs, 'r') as fidCaseDefs:
-        for lineNum, line in enumerate(fidCaseDefs):
-            line = line.strip()
-            if line[0] == '#':
-                # Found the start of a case definition.
-                line = line[2:]
-                currentCaseDef = re.sub("\s+", '_', line)
-                if currentCaseDef not in caseDefinitions:
-                    # A case definition with the same name has not already been seen.
-                    caseDefsOrder.append(currentCaseDef)
-            elif line[0] == '>':
-                # Found the start of mode, output or restriction information.
-                controlInfo = line[1:]
-                chunks = controlInfo.split()
-                if chunks[0] == "mode":
-                    # Found a line recording modes to use for this case definition.
-                    modeChoices = [i for i in chunks[1:]]
-                    caseDefinitions[currentCaseDef]["Modes"].update(modeChoices)
-                elif chunks[0] == "out":
-                    # Found a line recording output methods to use for this case definition.
-                    outChoices = [i for i in chunks[1:]]
-                    caseDefinitions[currentCaseDef]["Outputs"].update(outChoices)
-                elif chunks[0] == "from":
-                    # Found a line recording a date range restriction to use for this case definition.
-                    startDate = datetime.datetime.strptime(chunks[1], "%Y-%m-%d")
-                    if len(chunks) == 2:
-                        # The restriction only has a start date.
-                        comparisonFunc = restriction_comparator_generators.date_generator(startDate)
-                    else:
-                        # The restriction has both start and end dates.
-                        endDate = datetime.datetime.strptime(chunks[3], "%Y-%m-%d")
-                        comparisonFunc = restriction_comparator_generators.date_generator(startDate, endDate)
-                    caseDefinitions[currentCaseDef]["Restrictions"]["Date"].append(comparisonFunc)
-                elif chunks[0].isdigit():
-                    # Found a line recording a value-based restriction starting with a number.
-                    comparisonFunc = restriction_comparator_generators.value_generator(
-                        float(chunks[0]), conf.validChoices["Operators"][chunks[1]]
-                    )
-                    caseDefinitions[currentCaseDef]["Restrictions"][chunks[2]].append(comparisonFunc)
-                elif chunks[0] in ["Val1", "Val2"]:
-                    # Found a line recording a value-based restriction starting with Val1 or Val2.
-                    comparisonFunc = restriction_comparator_generators.value_generator(
-                        float(chunks[2]), conf.validChoices["Operators"][chunks[1]]
-                    )
-                    caseDefinitions[currentCaseDef]["Restrictions"][chunks[0]].append(comparisonFunc)
-                else:
-                    # The line was not correctly formatted, and will be ignored.
-                    if conf.isLogging:
-                        LOGGER.warning("Line {:d} contains an incorrectly formatted control line.".format(lineNum + 1))
+    for lineNum, line in enumerate(caseDefLines):
+        line = line.strip()
+        if not line:
+            # Skip blank lines.
+            continue
+        if line[0] == '#':
+            # Found the start of a case definition.
+            line = line[2:]
+            currentCaseDef = re.sub("\s+", '_', line)
+            if currentCaseDef not in caseDefinitions:
+                # A case definition with the same name has not already been seen.
+                caseDefsOrder.append(currentCaseDef)
+        elif line[0] == '>':
+            # Found the start of mode, output or restriction information.
+            controlInfo = line[1:]
+            chunks = controlInfo.split()
+            if chunks[0] == "mode":
+                # Found a line recording modes to use for this case definition.
+                modeChoices = [i for i in chunks[1:]]
+                caseDefinitions[currentCaseDef]["Modes"].update(modeChoices)
+            elif chunks[0] == "out":
+                # Found a line recording output methods to use for this case definition.
+                outChoices = [i for i in chunks[1:]]
+                caseDefinitions[currentCaseDef]["Outputs"].update(outChoices)
+            elif chunks[0] == "from":
+                # Found a line recording a date range restriction to use for this case definition. The restriction
+                # either only has a start date or has both start and end dates.
+                add_restriction(caseDefinitions[currentCaseDef], "Date",
+                                [chunks[1], chunks[3] if len(chunks) == 4 else None])
+            elif chunks[0] == "windows":
+                # Found a line recording the series of date windows that the case should be extracted in. Only the
+                # last series given for a case definition is used.
+                caseDefinitions[currentCaseDef]["WindowSpec"] = chunks[1:4]
+            elif chunks[0] == "relative":
+                # Found a line recording a date restriction relative to the earliest or latest association of another
+                # case definition. The name of the other case is resolved once all case definitions are parsed.
+                caseDefinitions[currentCaseDef]["Relative"].append(
+                    [chunks[1], chunks[2], int(chunks[3]), int(chunks[4])]
+                )
+            elif chunks[0].isdigit():
+                # Found a line recording a value-based restriction starting with a number.
+                add_restriction(caseDefinitions[currentCaseDef], chunks[2], [chunks[1], float(chunks[0])])
+            elif chunks[0] in ["Val1", "Val2"]:
+                # Found a line recording a value-based restriction starting with Val1 or Val2.
+                add_restriction(caseDefinitions[currentCaseDef], chunks[0], [chunks[1], float(chunks[2])])
             else:
-                # Found a code for the current case definition.
-                line = line.replace('.', '')
-                code = (line.split('\t'))[0]
+                # The line was not correctly formatted, and will be ignored.
+                if conf.isLogging:
+                    LOGGER.warning("Line {:d} contains an incorrectly formatted control line.".format(lineNum + 1))
+        else:
+            # Found a code for the current case definition.
+            line = line.replace('.', '')
+            code = (line.split('\t'))[0]
 
-                # Add the code as an indicator for the case definition.
+            # Add the code as an indicator for the case definition. Negated codes and prefixes (ending with %) only
+            # appear when the case definitions were annotated with prefix matching.
+            if code[:1] == '-' and code[-1:] == '%':
+                caseDefinitions[currentCaseDef]["NegativePrefixes"].add(code[1:-1])
+            elif code[:1] == '-':
+                caseDefinitions[currentCaseDef]["NegativeCodes"].add(code[1:])
+            elif code[-1:] == '%':
+                caseDefinitions[currentCaseDef]["Prefixes"].add(code[:-1])
+            else:
                 caseDefinitions[currentCaseDef]["Codes"].add(code)
 
-    # Make sure each case definition has a mode and output method.
+    # Make sure each case definition has a mode and output method, and create the matchers for any prefixes and the
+    # intervals covered by the date restrictions and windows.
     for i in caseDefsOrder:
+        caseDefinitions[i]["Matcher"] = code_matcher.create(caseDefinitions[i])
+        add_date_intervals(caseDefinitions[i])
         if not caseDefinitions[i]["Modes"]:
             caseDefinitions[i]["Modes"] = ["all"]
         else:
@@ -120,5 +174,241 @@ def main(fileCaseDefs):
             caseDefinitions[i]["Outputs"] = ["count"]
         else:
             caseDefinitions[i]["Outputs"] = sorted(caseDefinitions[i]["Outputs"])
+    resolve_relative_restrictions(caseDefinitions, caseDefsOrder)
 
     return caseDefinitions, caseDefsOrder
+
+
+def add_restriction(caseDefinition, restrictionType, restrictionSpec):
+    """Add a restriction to a case definition.
+
+    :param caseDefinition:  The case definition to add the restriction to.
+    :type caseDefinition:   dict
+    :param restrictionType: The type of the restriction (Date, Val1 or Val2).
+    :type restrictionType:  str
+    :param restrictionSpec: The specification of the restriction. See create_restriction for its format.
+    :type restrictionSpec:  list
+
+    """
+
+    caseDefinition["Restrictions"][restrictionType].append(create_restriction(restrictionType, restrictionSpec))
+    caseDefinition["RestrictionSpecs"][restrictionType].append(restrictionSpec)
+
+
+def create_restriction(restrictionType, restrictionSpec):
+    """Create the function implementing a restriction from its specification.
+
+    :param restrictionType: The type of the restriction (Date, Val1 or Val2).
+    :type restrictionType:  str
+    :param restrictionSpec: The specification of the restriction. For date restrictions this is
+                                ["YYYY-MM-DD", "YYYY-MM-DD"] containing the start and end dates (with an end date of
+                                None meaning there is no end date), and for value restrictions this is [OP, value]
+                                where OP is one of the operators in conf.validChoices["Operators"].
+    :type restrictionSpec:  list
+    :return:                A function that takes a date or value and returns whether it meets the restriction.
+    :rtype:                 function
+
+    """
+
+    if restrictionType == "Date":
+        startDate = datetime.datetime.strptime(restrictionSpec[0], "%Y-%m-%d")
+        if restrictionSpec[1] is None:
+            # The restriction only has a start date.
+            return restriction_comparator_generators.date_generator(startDate)
+        # The restriction has both start and end dates.
+        endDate = datetime.datetime.strptime(restrictionSpec[1], "%Y-%m-%d")
+        return restriction_comparator_generators.date_generator(startDate, endDate)
+    return restriction_comparator_generators.value_generator(
+        restrictionSpec[1], conf.validChoices["Operators"][restrictionSpec[0]]
+    )
+
+
+def add_date_intervals(caseDefinition):
+    """Add the date range and windows of a case definition from its date restrictions and window series.
+
+    The window series also restricts the case to the dates that it covers, so that associations outside every window
+    are removed along with those failing the date restrictions.
+
+    :param caseDefinition:  The case definition. The "DateRange" and "Windows" entries are set from its
+                                "RestrictionSpecs" and "WindowSpec" entries.
+    :type caseDefinition:   dict
+
+    """
+
+    windowSpec = caseDefinition.get("WindowSpec")
+    caseDefinition["WindowSpec"] = windowSpec
+    caseDefinition["Windows"] = create_windows(windowSpec)
+    dateSpecs = caseDefinition["RestrictionSpecs"]["Date"]
+    caseDefinition["DateRange"] = create_date_range(dateSpecs + [windowSpec[:2]] if windowSpec else dateSpecs)
+
+
+def create_date_range(dateSpecs):
+    """Intersect the date restrictions of a case definition into a single interval of dates.
+
+    An association meets every date restriction exactly when its date lies in the intersection of the restrictions'
+    ranges, i.e. between the latest start date and the earliest end date. As the associations of each code in a
+    patient's record are sorted by date, the associations in the interval can then be found by bisection (see
+    patient_extraction.apply_restrictions). If the ranges do not overlap, then the start of the interval is after its
+    end and no association meets the restrictions.
+
+    :param dateSpecs:   The specifications of the date restrictions. See create_restriction for their format.
+    :type dateSpecs:    list
+    :return:            The start and end dates of the interval, or None if there are no date restrictions.
+    :rtype:             tuple | None
+
+    """
+
+    if not dateSpecs:
+        return None
+    startDate = max(datetime.datetime.strptime(i[0], "%Y-%m-%d") for i in dateSpecs)
+    endDates = [datetime.datetime.strptime(i[1], "%Y-%m-%d") for i in dateSpecs if i[1] is not None]
+    if len(endDates) < len(dateSpecs):
+        # A restriction without an end date ends today (see restriction_comparator_generators.date_generator).
+        endDates.append(datetime.datetime.now())
+    return startDate, min(endDates)
+
+
+def create_windows(windowSpec):
+    """Create the windows of a window series.
+
+    The windows are consecutive and each starts a whole number of steps after the start of the series, with the last
+    window ending at the end of the series. Each window contains the dates from its start up to, but not including, its
+    end, so that every date in the series falls in exactly one window. Steps are given as a positive number of years
+    (e.g. 1y), months (e.g. 6m) or days (e.g. 30d). Adding years or months to the end of a month that is longer than
+    the resulting month gives the last day of the resulting month.
+
+    :param windowSpec:  The ["YYYY-MM-DD", "YYYY-MM-DD", step] giving the first and last dates (inclusive) of the
+                            series and the length of each window, or None if there is no window series.
+    :type windowSpec:   list | None
+    :return:            The (start, end) dates of each window in chronological order, or None if there is no window
+                            series.
+    :rtype:             list | None
+
+    """
+
+    if not windowSpec:
+        return None
+    seriesStart = datetime.datetime.strptime(windowSpec[0], "%Y-%m-%d")
+    seriesEnd = datetime.datetime.strptime(windowSpec[1], "%Y-%m-%d") + datetime.timedelta(days=1)
+    stepSize, stepUnit = int(windowSpec[2][:-1]), windowSpec[2][-1]
+
+    windows = []
+    windowStart = seriesStart
+    while windowStart < seriesEnd:
+        windowEnd = min(_add_step(seriesStart, stepSize * (len(windows) + 1), stepUnit), seriesEnd)
+        windows.append((windowStart, windowEnd))
+        windowStart = windowEnd
+    return windows
+
+
+def _add_step(date, numSteps, stepUnit):
+    """Add a number of years, months or days to a date.
+
+    :param date:        The date to add to.
+    :type date:         datetime.datetime
+    :param numSteps:    The number of years, months or days to add.
+    :type numSteps:     int
+    :param stepUnit:    The unit of the steps (y for years, m for months and d for days).
+    :type stepUnit:     str
+    :return:            The date the steps after the input date.
+    :rtype:             datetime.datetime
+
+    """
+
+    if stepUnit == 'd':
+        return date + datetime.timedelta(days=numSteps)
+    numMonths = date.month - 1 + (numSteps * 12 if stepUnit == 'y' else numSteps)
+    year = date.year + numMonths // 12
+    month = numMonths % 12 + 1
+    return date.replace(year=year, month=month, day=min(date.day, calendar.monthrange(year, month)[1]))
+
+
+def resolve_relative_restrictions(caseDefinitions, caseNames):
+    """Resolve the case definitions that relative date restrictions refer to, removing any that can not be evaluated.
+
+    A relative date restriction [anchor case name, anchor, from days, to days] keeps only the associations dated from
+    the given number of days after the earliest or latest (the anchor) association of the anchor case up to the given
+    number of days after it (inclusive). Negative numbers of days are before the anchor. The anchor case must
+    therefore be evaluated first. As control lines are lower cased when the case definitions are annotated, anchor
+    case names are matched to case definitions without regard to case. Restrictions referring to unknown case
+    definitions, or that would make a case depend on itself (directly or through other cases), are removed.
+
+    :param caseDefinitions: The case definitions. The "Relative" entries are updated with the resolved case names, and
+                                the "IsAnchor" entries are set.
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions in the order they appear in the case definitions.
+    :type caseNames:        list
+
+    """
+
+    # Resolve the case names.
+    mapNameToCase = {i.lower(): i for i in caseNames}
+    for i in caseNames:
+        caseDefinitions[i]["IsAnchor"] = False
+        resolvedRestrictions = []
+        for j in caseDefinitions[i].get("Relative", []):
+            if j[0].lower() in mapNameToCase:
+                resolvedRestrictions.append([mapNameToCase[j[0].lower()]] + list(j[1:]))
+            elif conf.isLogging:
+                LOGGER.warning("Case {:s} has a relative date restriction on an unknown case {:s} that will be "
+                               "ignored.".format(i, j[0]))
+        caseDefinitions[i]["Relative"] = resolvedRestrictions
+
+    # Remove the restrictions that lead to cycles of dependencies. This is done with a depth first search that removes
+    # any restriction on a case that is still being visited.
+    caseStates = {}  # Whether each case is being visited (False) or has been visited (True).
+
+    def visit(caseName):
+        caseStates[caseName] = False
+        keptRestrictions = []
+        for restriction in caseDefinitions[caseName]["Relative"]:
+            if caseStates.get(restriction[0]) is False:
+                if conf.isLogging:
+                    LOGGER.warning("Case {:s} has a relative date restriction on case {:s} that depends on case {:s}, "
+                                   "and will be ignored.".format(caseName, restriction[0], caseName))
+                continue
+            if restriction[0] not in caseStates:
+                visit(restriction[0])
+            keptRestrictions.append(restriction)
+        caseDefinitions[caseName]["Relative"] = keptRestrictions
+        caseStates[caseName] = True
+
+    for i in caseNames:
+        if i not in caseStates:
+            visit(i)
+    for i in caseNames:
+        for j in caseDefinitions[i]["Relative"]:
+            caseDefinitions[j[0]]["IsAnchor"] = True
+
+
+def evaluation_order(caseDefinitions, caseNames):
+    """Determine an order to evaluate case definitions in so that each case is evaluated after the cases it refers to.
+
+    :param caseDefinitions: The case definitions, with their relative date restrictions resolved (see
+                                resolve_relative_restrictions).
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions that need evaluating.
+    :type caseNames:        list
+    :return:                The names of the cases to evaluate, including any cases that are not in caseNames but
+                                are referred to by them. The order of caseNames is kept where possible.
+    :rtype:                 list
+
+    """
+
+    if not any(caseDefinitions[i].get("Relative") for i in caseNames):
+        return caseNames
+
+    orderedCases = []
+    visitedCases = set()
+
+    def visit(caseName):
+        visitedCases.add(caseName)
+        for restriction in caseDefinitions[caseName].get("Relative", []):
+            if restriction[0] not in visitedCases:
+                visit(restriction[0])
+        orderedCases.append(caseName)
+
+    for i in caseNames:
+        if i not in visitedCases:
+            visit(i)
+    return orderedCases
@@ -1,45 +1,131 @@
 """Perform the extraction of patients according to supplied case definitions."""
 
 # Python imports.
+import copy
 import datetime
+import functools
+import io
 import json
 import logging
 import os
+import time
 
 # User imports.
 from . import annotate_case_definitions
+from . import association
+from . import code_layout
+from . import code_matcher
+from . import cohort_index
 from . import conf
+from . import extraction_plan
+from . import memory_usage
 from . import parse_case_definitions
+from . import pipeline
+from . import progress
+from . import record_summary
+from . import run_statistics
+from . import split_layout
+from . import output_sinks
 
 # Globals.
 LOGGER = logging.getLogger(__name__)
+EMPTY_DATE_RANGE = (datetime.datetime.max, datetime.datetime.min)  # A date range that no date falls in.
+OUTPUT_BATCH_SIZE = 1000  # The number of patients to write to the output at once when not pipelining.
+_WORKER_STATE = {}  # The case definitions and patient subset used by a worker process in a pipelined extraction.
 
 
-def main(fileCaseDefs, dirOutput, filePatientData, fileCodeDescriptions, filePatientSubset):
+def main(fileCaseDefs, dirOutput, filePatientData, fileCodeDescriptions, filePatientSubset, pipelined=False,
+         processes=1, explain=False, progressInterval=None, traceMemory=False, maxRecordBytes=None,
+         useCodeCache=True, prefixMatching=False, sink="tsv", useCohortIndex=True, timeStages=False):
     """Run the patient extraction.
 
-    :param fileCaseDefs:            The location of the input file containing the case definitions.
+    Along with the extracted data, a JSON report of the time spent in each stage of the extraction and the number of
+    patients and associations processed is written to RunReport.json in the output directory. The stages run for every
+    patient or case are only timed when timeStages is set.
+
+    When the input is a file of case definitions, it is compiled into an extraction plan that is saved to
+    ExtractionPlan.json in the output directory. This plan can be supplied as the input to later runs in order to
+    skip the annotation and parsing of the case definitions.
+
+    :param fileCaseDefs:            The location of the input file containing the case definitions, or of an
+                                        extraction plan compiled from them (see extraction_plan).
     :type fileCaseDefs:             str
     :param dirOutput:               The location of the directory to write the program output to.
     :type dirOutput:                str
-    :param filePatientData:         The location of the file containing the patient data.
+    :param filePatientData:         The location of the file containing the patient data (a flat file, the dates file
+                                        of a split layout or the data file of a code layout).
     :type filePatientData:          str
     :param fileCodeDescriptions:    The location of the file containing the mapping from codes to their descriptions.
     :type fileCodeDescriptions:     str
     :param filePatientSubset:       The location of the file containing the IDs of the subset of patients to use
                                         in the extraction.
     :type filePatientSubset:        str
+    :param pipelined:               Whether to read, compute and write the extracted data in separate pipelined stages.
+    :type pipelined:                bool
+    :param processes:               The number of worker processes to use for the computation when pipelining. Using
+                                        more than one process implies pipelining.
+    :type processes:                int
+    :param explain:                 Whether to write out a report of the cost and selectivity of each case definition
+                                        to ExplainReport.json in the output directory.
+    :type explain:                  bool
+    :param progressInterval:        The number of seconds between reports of the progress through the patient data.
+                                        Progress is not reported when this is None or 0.
+    :type progressInterval:         float | None
+    :param traceMemory:             Whether to record the memory high-water mark of each stage and the largest patient
+                                        records in the run report (using tracemalloc, which slows the run down).
+    :type traceMemory:              bool
+    :param maxRecordBytes:          The size (in bytes when UTF-8 encoded) above which a patient's record is
+                                        decoded one code at a time, with only the codes used by the case definitions
+                                        being decoded. None to always decode the whole record.
+    :type maxRecordBytes:           int | None
+    :param useCodeCache:            Whether to use a cached and indexed copy of the mapping from codes to their
+                                        descriptions, stored alongside the file of descriptions (see
+                                        code_dictionary.load).
+    :type useCodeCache:             bool
+    :param prefixMatching:          Whether wildcard codes should be kept as prefixes and matched against the codes in
+                                        each patient's record, rather than being expanded using the code descriptions.
+                                        Ignored when the input is an extraction plan.
+    :type prefixMatching:           bool
+    :param sink:                    The name of the sink to write the extracted data with (see
+                                        output_sinks.SINKS). Defaults to writing DataExtraction.tsv.
+    :type sink:                     str
+    :param useCohortIndex:          Whether to extract the whole cohort from the index of the patient data file (see
+                                        cohort_index) when it is up to date and can answer every case definition.
+    :type useCohortIndex:           bool
+    :param timeStages:              Whether to time the stages run for every patient or case (reading lines, decoding
+                                        JSON, converting dates, applying restrictions, selecting associations and
+                                        generating output) in the run report.
+    :type timeStages:               bool
 
     """
 
-    # Create a version of the input file with expanded codes and added code descriptions.
-    annotatedCaseDefsName = os.path.split(fileCaseDefs)[1]
-    annotatedCaseDefsName = annotatedCaseDefsName.split('.')[0] + "_Annotated." + annotatedCaseDefsName.split('.')[1]
-    fileAnnotatedCaseDefs = os.path.join(dirOutput, annotatedCaseDefsName)
-    annotate_case_definitions.main(fileCaseDefs, fileCodeDescriptions, fileAnnotatedCaseDefs)
+    memory = None
+    if traceMemory:
+        memory = memory_usage.MemoryMonitor()
+        memory.start()
+    runStats = run_statistics.RunStatistics(explain, memory, timeStages)
 
-    # Extract the case definitions from the file of case definitions.
-    caseDefinitions, caseNames = parse_case_definitions.main(fileAnnotatedCaseDefs)
+    if extraction_plan.is_plan_file(fileCaseDefs):
+        # Load the previously compiled extraction plan.
+        startTime = time.perf_counter()
+        plan = extraction_plan.load_plan(fileCaseDefs)
+        runStats.add_time("PlanLoading", time.perf_counter() - startTime)
+        if memory:
+            memory.end_stage("PlanLoading")
+    else:
+        # Compile the case definitions into an extraction plan, writing out a version of the input file with expanded
+        # codes and added code descriptions along the way.
+        annotatedCaseDefsName = os.path.split(fileCaseDefs)[1]
+        annotatedCaseDefsName = \
+            annotatedCaseDefsName.split('.')[0] + "_Annotated." + annotatedCaseDefsName.split('.')[1]
+        fileAnnotatedCaseDefs = os.path.join(dirOutput, annotatedCaseDefsName)
+        plan = extraction_plan.compile_plan(fileCaseDefs, fileCodeDescriptions, fileAnnotatedCaseDefs, useCodeCache,
+                                            runStats, prefixMatching)
+        extraction_plan.save_plan(plan, os.path.join(dirOutput, "ExtractionPlan.json"))
+    caseDefinitions, caseNames = extraction_plan.build_case_definitions(plan)
+    if explain:
+        for i in caseNames:
+            runStats.set_case_codes(i, len(caseDefinitions[i]["Codes"]))
 
     # Identify the patient to restrict the extraction to.
     patientExtractionSubset = set()
@@ -48,66 +134,795 @@ def main(fileCaseDefs, dirOutput, filePatientData, fileCodeDescriptions, filePat
             line = line.strip()
             patientExtractionSubset.add(line)
 
+    # Use the cohort index in place of the patient data when every case can be extracted from it.
+    cohortIndex = None
+    if useCohortIndex and not explain and all(cohort_index.is_indexable(caseDefinitions[i]) for i in caseNames):
+        startTime = time.perf_counter()
+        cohortIndex = cohort_index.load(filePatientData)
+        runStats.add_time("CohortIndexLoading", time.perf_counter() - startTime)
+        if conf.isLogging and cohortIndex is not None:
+            LOGGER.info("Extracting all patients from the cohort index.")
+
+    # The values file of a split layout is only read when the case definitions need it (see split_layout).
+    readValues = split_layout.needs_values(caseDefinitions, caseNames)
+
+    # Only the blocks of the codes that the case definitions use are read from a code layout (see code_layout).
+    codeDirectory = None
+    layoutCodes = None
+    if cohortIndex is None and code_layout.is_code_layout(filePatientData):
+        startTime = time.perf_counter()
+        codeDirectory = code_layout.load_directory(filePatientData)
+        layoutCodes = code_layout.needed_codes(codeDirectory, caseDefinitions, caseNames)
+        runStats.add_time("CodeDirectoryLoading", time.perf_counter() - startTime)
+        runStats.count("CodeBlocksRead", len(layoutCodes))
+        if conf.isLogging and processes > 1:
+            LOGGER.info("Patients are regrouped from the code layout in a single process.")
+
+    # Setup the reporting of the progress through the patient data.
+    progressReporter = None
+    if progressInterval and cohortIndex is None:
+        if codeDirectory is None:
+            inputSize = split_layout.input_size(filePatientData, readValues)
+        else:
+            inputSize = code_layout.blocks_size(codeDirectory, layoutCodes)
+        progressReporter = progress.ProgressReporter(inputSize, progressInterval, "patients", "PatientExtraction",
+                                                     logger=LOGGER)
+
     # Extract the patient data.
-    fileExtractIon = os.path.join(dirOutput, "DataExtraction.tsv")
-    with open(filePatientData, 'r') as fidPatientData, open(fileExtractIon, 'w') as fidExtraction:
-        # Write out the header.
-        extractions = '\t'.join(
-            ["{:s}__MODE_{:s}__OUT_{:s}".format(i, j, k)
-             for i in caseNames for j in caseDefinitions[i]["Modes"] for k in caseDefinitions[i]["Outputs"]]
+    header = ["PatientID"] + generate_header(caseDefinitions, caseNames)
+    emptyRow = generate_empty_row(caseDefinitions, caseNames)
+    formatPatient = output_sinks.SINKS[sink].formatter(header, emptyRow)
+    with output_sinks.create_sink(sink, dirOutput, header, emptyRow) as outputSink:
+        if cohortIndex is not None:
+            _write_patients(extract_cohort(cohortIndex, caseDefinitions, caseNames, patientExtractionSubset, runStats),
+                            outputSink, formatPatient, runStats)
+        elif codeDirectory is not None:
+            # The patients' records are regrouped from the code blocks, so there are no lines to distribute between
+            # processes.
+            patients = code_layout.read_patients(filePatientData, layoutCodes, codeDirectory, progressReporter)
+            if timeStages:
+                patients = run_statistics.timed_iterator(patients, runStats, "CodeBlockReading")
+            _write_patients(_extract_patients(caseDefinitions, caseNames, patients, patientExtractionSubset, runStats),
+                            outputSink, formatPatient, runStats)
+        elif pipelined or processes > 1:
+            # Read, extract and write the patient data in separate stages.
+            if processes > 1:
+                processBatch = _process_worker_batch
+                resultHandler = functools.partial(_merge_worker_result, runStats=runStats)
+            else:
+                processBatch = functools.partial(process_batch, caseDefinitions=caseDefinitions, caseNames=caseNames,
+                                                 patientSubset=patientExtractionSubset, runStats=runStats,
+                                                 maxRecordBytes=maxRecordBytes, formatPatient=formatPatient)
+                resultHandler = None
+            with split_layout.open_patient_data(filePatientData, readValues) as fidPatientData:
+                pipeline.run(fidPatientData, outputSink, processBatch, processes=processes,
+                             initializer=_initialise_worker,
+                             initArgs=(plan, patientExtractionSubset, conf.isLogging, explain, traceMemory,
+                                       maxRecordBytes, sink, timeStages),
+                             resultHandler=resultHandler, runStats=runStats, progressReporter=progressReporter)
+        else:
+            # Write out the extracted data for each patient in batches.
+            with split_layout.open_patient_data(filePatientData, readValues) as fidPatientData:
+                patientLines = progressReporter.track(fidPatientData) if progressReporter else fidPatientData
+                if timeStages:
+                    patientLines = run_statistics.timed_iterator(patientLines, runStats, "LineReading")
+                _write_patients(_extract_patients(caseDefinitions, caseNames, patientLines, patientExtractionSubset,
+                                                  runStats, maxRecordBytes),
+                                outputSink, formatPatient, runStats)
+
+    if progressReporter:
+        progressReporter.finish()
+    if memory:
+        memory.end_stage("Extraction")
+        memory.stop()
+
+    # Write out the report on the run.
+    runStats.write_report(os.path.join(dirOutput, "RunReport.json"))
+    if explain:
+        runStats.write_explain_report(os.path.join(dirOutput, "ExplainReport.json"), caseNames)
+
+
+def _write_patients(patients, outputSink, formatPatient, runStats):
+    """Write out the extracted data for each patient in batches.
+
+    :param patients:        The (patientID, values) tuples of the patients.
+    :type patients:         iterable
+    :param outputSink:      The sink to write the data to.
+    :type outputSink:       output_sinks.OutputSink
+    :param formatPatient:   The function formatting a patient's values as an entry for the sink.
+    :type formatPatient:    function
+    :param runStats:        The statistics to record the time spent writing in.
+    :type runStats:         run_statistics.RunStatistics
+
+    """
+
+    outputBatch = []
+    for patientID, values in patients:
+        outputBatch.append(formatPatient(patientID, values))
+        if len(outputBatch) >= OUTPUT_BATCH_SIZE:
+            startTime = time.perf_counter()
+            outputSink.writelines(outputBatch)
+            runStats.add_time("OutputWriting", time.perf_counter() - startTime, len(outputBatch))
+            outputBatch = []
+    if outputBatch:
+        startTime = time.perf_counter()
+        outputSink.writelines(outputBatch)
+        runStats.add_time("OutputWriting", time.perf_counter() - startTime, len(outputBatch))
+
+
+def extract(caseDefinitions, patientData, caseNames=None, mapCodeToDescription=None, patientSubset=None,
+            runStats=None, maxRecordBytes=None):
+    """Extract data about patients according to case definitions without writing anything to disk.
+
+    The extraction is lazy, with each patient's record only being decoded and processed as the returned generator is
+    advanced. For example:
+        header, rows = extract(caseDefinitions, open("FlatPatientData.tsv"), caseNames)
+        for patientID, values in rows:
+            ...
+
+    :param caseDefinitions:         Either the case definitions returned by parse_case_definitions.main, an
+                                        extraction plan (see extraction_plan) or the text of a (non-annotated) case
+                                        definitions file. When text is supplied, the codes in it are expanded using
+                                        mapCodeToDescription before being parsed. Parsed case definitions are copied
+                                        rather than modified.
+    :type caseDefinitions:          dict | str
+    :param patientData:             The patients to extract data about. Each entry is either a line from the flat
+                                        file of patient data (i.e. "ID\tJSON history", optionally followed by "\tJSON
+                                        summaries" as described in record_summary) or a (patientID, record) tuple,
+                                        where the record has the format described in apply_restrictions (the
+                                        associations can also be dictionaries with Date, Val1, Val2 and Text keys, and
+                                        their dates YYYY-MM-DD strings).
+    :type patientData:              iterable
+    :param caseNames:               The names of the case definitions in the order they should be output. Defaults to
+                                        the order of the cases in the case definitions.
+    :type caseNames:                list | None
+    :param mapCodeToDescription:    The mapping from codes to their descriptions, used to expand the codes when the
+                                        case definitions are supplied as text. Defaults to an empty mapping.
+    :type mapCodeToDescription:     dict | None
+    :param patientSubset:           The IDs of the patients to restrict the extraction to. An empty or missing subset
+                                        means all patients are used.
+    :type patientSubset:            set | None
+    :param runStats:                The statistics to record the time spent in each stage of the extraction in.
+                                        Defaults to recording no statistics.
+    :type runStats:                 run_statistics.RunStatistics | None
+    :param maxRecordBytes:          The size (in bytes when UTF-8 encoded) above which a line's record is decoded
+                                        one code at a time, with only the codes used by the case definitions being
+                                        decoded. None to always decode the whole record.
+    :type maxRecordBytes:           int | None
+    :return:                        1) The header of the extraction, i.e. "PatientID" followed by the name of the
+                                        column generated for each case, mode and output combination.
+                                    2) A generator of (patientID, values) tuples, where values is the list of the
+                                        extracted output strings for the patient (one per column in the header).
+    :rtype:                         list, generator
+
+    """
+
+    if isinstance(caseDefinitions, str):
+        # The case definitions need annotating and parsing.
+        annotatedCaseDefs = io.StringIO()
+        annotate_case_definitions.annotate(
+            io.StringIO(caseDefinitions), mapCodeToDescription or {}, annotatedCaseDefs
         )
-        header = "PatientID\t{:s}\n".format(extractions)
-        fidExtraction.write(header)
-
-        # Extract the data for each patient.
-        for line in fidPatientData:
-            chunks = (line.strip()).split('\t')
-            patientID = chunks[0]  # The ID of the patient whose record appears on the line.
-            if patientExtractionSubset and patientID not in patientExtractionSubset:
+        annotatedCaseDefs.seek(0)
+        parsedCaseDefinitions, parsedCaseNames = parse_case_definitions.parse(annotatedCaseDefs)
+        caseDefinitions = parsedCaseDefinitions
+        caseNames = caseNames if caseNames is not None else parsedCaseNames
+    elif isinstance(caseDefinitions.get("Cases"), list):
+        # The case definitions are an extraction plan.
+        caseDefinitions, planCaseNames = extraction_plan.build_case_definitions(caseDefinitions)
+        caseNames = caseNames if caseNames is not None else planCaseNames
+    else:
+        # Values are cached in the case definitions as they are extracted, so the caller's definitions are copied.
+        caseDefinitions = copy.copy(caseDefinitions)
+        for i in caseDefinitions:
+            caseDefinitions[i] = copy.copy(caseDefinitions[i])
+        caseNames = caseNames if caseNames is not None else list(caseDefinitions)
+
+    header = ["PatientID"] + generate_header(caseDefinitions, caseNames)
+    return header, _extract_patients(caseDefinitions, caseNames, patientData, patientSubset or set(), runStats,
+                                     maxRecordBytes)
+
+
+def _extract_patients(caseDefinitions, caseNames, patientData, patientSubset, runStats=None, maxRecordBytes=None):
+    """Generate the extracted data for each patient.
+
+    Lines with a record larger than maxRecordBytes (see is_oversized) are decoded one code at a time, with the
+    associations of codes that no case definition uses being skipped over rather than decoded. This bounds the memory
+    needed for patients with very long histories by the size of their associations with the codes of interest.
+
+    :param caseDefinitions: The case definitions (i.e. mode, output, restriction and indicator code information).
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions in the order they should be output.
+    :type caseNames:        list
+    :param patientData:     The lines of patient data or (patientID, record) tuples to extract data from.
+    :type patientData:      iterable
+    :param patientSubset:   The IDs of the patients to restrict the extraction to (empty to use all patients).
+    :type patientSubset:    set
+    :param runStats:        The statistics to record the time spent in each stage in (None to record nothing).
+    :type runStats:         run_statistics.RunStatistics | None
+    :param maxRecordBytes:  The size above which a line's record is decoded one code at a time (None to always
+                                decode the whole record).
+    :type maxRecordBytes:   int | None
+    :return:                A generator of (patientID, values) tuples.
+    :rtype:                 generator
+
+    """
+
+    # Determine the codes that need decoding from oversized records (including those of the cases that relative date
+    # restrictions refer to).
+    evaluationOrder = parse_case_definitions.evaluation_order(caseDefinitions, caseNames)
+    caseCodes = set()
+    if maxRecordBytes is not None:
+        caseCodes = code_matcher.combine(caseDefinitions, evaluationOrder)
+    memory = runStats.memory if runStats is not None else None
+    timeStages = runStats is not None and runStats.timeStages
+
+    for entry in patientData:
+        if runStats is not None:
+            runStats.count("PatientsScanned")
+
+        recordText = None  # The JSON encoded record on the line (None if the entry was already decoded).
+        if isinstance(entry, str):
+            # The entry is a line from the flat file, so only decode it if the patient is going to be used.
+            # Partitioning the line (rather than stripping and splitting it) avoids copying the record.
+            patientID, _, recordText = entry.partition('\t')  # The ID of the patient whose record is on the line.
+            if patientSubset and patientID not in patientSubset:
                 # Skip this patient if they aren't in the extraction subset (and the extraction subset is being used).
+                if runStats is not None:
+                    runStats.count("PatientsSkipped")
+                continue
+            # Lines written with summaries of the patient's codes (see record_summary) have them after the record.
+            # The record is only decoded when the summaries can't answer every case that the patient has codes for.
+            # When the record is needed, only the associations of the codes that may meet a case's restrictions are
+            # kept from it.
+            summaryStart = recordText.rfind('\t')
+            neededCodes = None
+            if summaryStart != -1:
+                if runStats is None or not runStats.explain:
+                    values, neededCodes = extract_patient_summaries(recordText[summaryStart + 1:], caseDefinitions,
+                                                                    caseNames, evaluationOrder, runStats)
+                    if values is not None:
+                        yield patientID, values
+                        continue
+                recordText = recordText[:summaryStart]
+            # Lines read from a split layout (see split_layout) hold a JSON list rather than an object, and are
+            # always decoded whole.
+            isOversized = maxRecordBytes is not None and recordText[0] == '{' and \
+                is_oversized(recordText, maxRecordBytes)
+            decodeCodes = caseCodes if neededCodes is None else neededCodes
+            allocatedBefore = memory.traced_memory() if memory else None
+            if timeStages:
+                startTime = time.perf_counter()
+            # The patient's medical history in JSON format.
+            if isOversized:
+                patientRecord = memory_usage.decode_codes(recordText, decodeCodes)
+            else:
+                patientRecord = json.loads(recordText)
+            if timeStages:
+                runStats.add_time("JSONDecoding", time.perf_counter() - startTime)
+            if isOversized and runStats is not None:
+                runStats.count("PatientsStreamed")
+            if isinstance(patientRecord, list):
+                patientRecord = split_layout.convert_record(patientRecord)
+            if neededCodes is not None and not isOversized:
+                # The other codes are kept without associations, so that the record still has the same codes (and so
+                # select_case_codes selects each case's codes in the same order).
+                patientRecord = {i: j if i in neededCodes else [] for i, j in patientRecord.items()}
+        else:
+            patientID, patientRecord = entry
+            if patientSubset and patientID not in patientSubset:
+                if runStats is not None:
+                    runStats.count("PatientsSkipped")
                 continue
-            patientRecord = json.loads(chunks[1])  # The patient's medical history in JSON format.
-            extractedHistory = {}  # The subset of the patient's medical history to be extracted and output.
-
-            # Convert all dates to datetime objects.
-            for i in patientRecord:
-                for j in patientRecord[i]:
-                    j["Date"] = datetime.datetime.strptime(j["Date"], "%Y-%m-%d")
-
-            # Select the portion of the patient's record (i.e. code associations) meeting the requirements for each
-            # case definition.
-            for i in caseNames:
-                # Select the patient's associations that involve a positive indicator code.
-                caseSubset = {i: patientRecord[i] for i in caseDefinitions[i]["Codes"] if i in patientRecord}
-                # Apply the restrictions for this case to the patient's associations with positive indicator codes
-                # in order to remove associations that can not indicate that the case applies to the patient.
-                caseSubset = apply_restrictions(caseSubset, caseDefinitions[i]["Restrictions"])
-                if not caseSubset:
-                    # If there are no associations remaining, then return an empty dictionary for each mode.
-                    extractedHistory[i] = {j: {} for j in conf.validChoices["Modes"]}
-                else:
-                    # Associations remain, so the case applies to the patient. Therefore, extract the subset of the
-                    # restricted set of associations that the user desires (according to modes specified for the case).
-                    extractedHistory[i] = select_associations(caseSubset, caseDefinitions[i]["Modes"])
-
-            # Generate and record the output for the patient.
-            generatedOutput = generate_patient_output(extractedHistory, caseNames, caseDefinitions)
-            fidExtraction.write("{:s}\t{:s}\n".format(patientID, generatedOutput))
-
-
-def apply_restrictions(medicalRecord, caseRestrictions):
+
+        # Convert all associations to compact association objects (with their dates as datetime objects).
+        if not timeStages:
+            association.convert_record(patientRecord)
+        else:
+            startTime = time.perf_counter()
+            association.convert_record(patientRecord)
+            runStats.add_time("DateConversion", time.perf_counter() - startTime)
+        if runStats is not None:
+            numAssociations = sum(map(len, patientRecord.values()))
+            runStats.count("AssociationsDecoded", numAssociations)
+            if memory and recordText is not None:
+                decodedBytes = None if allocatedBefore is None else memory.traced_memory() - allocatedBefore
+                memory.record_patient(patientID, len(recordText.encode()), numAssociations, decodedBytes)
+
+        yield patientID, extract_patient(patientRecord, caseDefinitions, caseNames, runStats)
+
+
+def is_oversized(recordText, maxRecordBytes):
+    """Determine whether a JSON encoded record is larger than a number of bytes when encoded as UTF-8.
+
+    Each character takes between one and four bytes, so the record is only encoded when its length alone can't decide.
+
+    :param recordText:      The JSON encoded record.
+    :type recordText:       str
+    :param maxRecordBytes:  The number of bytes.
+    :type maxRecordBytes:   int
+    :return:                Whether the record is larger than maxRecordBytes.
+    :rtype:                 bool
+
+    """
+
+    if len(recordText) > maxRecordBytes:
+        return True
+    if len(recordText) * 4 <= maxRecordBytes:
+        return False
+    return len(recordText.encode()) > maxRecordBytes
+
+
+def extract_cohort(cohortIndex, caseDefinitions, caseNames, patientSubset, runStats=None):
+    """Generate the extracted data for each patient from the index of the patients with each code.
+
+    Every case must be indexable (see cohort_index.is_indexable). The patients with each case's codes (and their
+    association counts when needed) are found for the whole cohort at once, before the values of each patient are
+    generated in the order of the flat file.
+
+    :param cohortIndex:     The index of the patients with each code.
+    :type cohortIndex:      cohort_index.CohortIndex
+    :param caseDefinitions: The case definitions (i.e. mode, output, restriction and indicator code information).
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions in the order they should be output.
+    :type caseNames:        list
+    :param patientSubset:   The IDs of the patients to restrict the extraction to (empty to use all patients).
+    :type patientSubset:    set
+    :param runStats:        The statistics to record the time spent in each stage in (None to record nothing).
+    :type runStats:         run_statistics.RunStatistics | None
+    :return:                A generator of (patientID, values) tuples.
+    :rtype:                 generator
+
+    """
+
+    startTime = time.perf_counter()
+    caseColumns = []  # The flags marking the patients with each case's codes, and the patients' association counts.
+    for i in caseNames:
+        caseCodes = select_case_codes(cohortIndex.bitmaps, caseDefinitions[i])
+        patientFlags = cohortIndex.patient_flags(caseCodes)
+        patientCounts = None
+        if "all" in caseDefinitions[i]["Modes"] and "count" in caseDefinitions[i]["Outputs"]:
+            patientCounts = cohortIndex.patient_counts(caseCodes)
+        caseColumns.append((caseDefinitions[i], patientFlags, patientCounts))
+    if runStats is not None:
+        runStats.add_time("CohortIndexExtraction", time.perf_counter() - startTime)
+
+    for position, patientID in enumerate(cohortIndex.patientIDs):
+        if patientSubset and patientID not in patientSubset:
+            if runStats is not None:
+                runStats.count("PatientsSkipped")
+            continue
+        generatedOutput = []
+        isMatched = False
+        for caseDefinition, patientFlags, patientCounts in caseColumns:
+            if patientFlags[position] == '0':
+                generatedOutput.extend(empty_case_values(caseDefinition))
+                continue
+            isMatched = True
+            for mode in caseDefinition["Modes"]:
+                for out in caseDefinition["Outputs"]:
+                    if out == "exists":
+                        generatedOutput.append('1')
+                    else:
+                        # Every mode other than all selects a single association.
+                        generatedOutput.append("{:d}".format(patientCounts[position]) if mode == "all" else '1')
+        if runStats is not None:
+            runStats.count("PatientsIndexed")
+            if isMatched:
+                runStats.count("PatientsMatched")
+        yield patientID, generatedOutput
+
+
+def process_batch(lines, caseDefinitions, caseNames, patientSubset, runStats=None, maxRecordBytes=None,
+                  formatPatient=None):
+    """Extract the data for a batch of lines from the flat file of patient data.
+
+    :param lines:           The lines of patient data.
+    :type lines:            list
+    :param caseDefinitions: The case definitions (i.e. mode, output, restriction and indicator code information).
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions in the order they should be output.
+    :type caseNames:        list
+    :param patientSubset:   The IDs of the patients to restrict the extraction to (empty to use all patients).
+    :type patientSubset:    set
+    :param runStats:        The statistics to record the time spent in each stage in (None to record nothing).
+    :type runStats:         run_statistics.RunStatistics | None
+    :param maxRecordBytes:  The size above which a line's record is decoded one code at a time (None to always
+                                decode the whole record).
+    :type maxRecordBytes:   int | None
+    :param formatPatient:   The function formatting each patient's ID and values for the output sink (see
+                                output_sinks). Defaults to formatting them as lines of a tab separated file.
+    :type formatPatient:    function | None
+    :return:                The output entries for the patients in the batch.
+    :rtype:                 list
+
+    """
+
+    formatPatient = formatPatient or output_sinks.TsvSink.formatter(None, None)
+    return [formatPatient(patientID, values)
+            for patientID, values in _extract_patients(caseDefinitions, caseNames, lines, patientSubset, runStats,
+                                                       maxRecordBytes)]
+
+
+def _initialise_worker(plan, patientSubset, isLogging, explain=False, traceMemory=False, maxRecordBytes=None,
+                       sink="tsv", timeStages=False):
+    """Initialise a worker process used for extracting batches of patient data.
+
+    The case definitions contain restriction functions that can not be pickled, and so are built again by each worker
+    from the extraction plan.
+
+    :param plan:                    The extraction plan.
+    :type plan:                     dict
+    :param patientSubset:           The IDs of the patients to restrict the extraction to (empty to use all patients).
+    :type patientSubset:            set
+    :param isLogging:               Whether logging is turned on.
+    :type isLogging:                bool
+    :param explain:                 Whether the cost and selectivity of each case definition should be recorded.
+    :type explain:                  bool
+    :param traceMemory:             Whether the memory usage of the worker should be recorded.
+    :type traceMemory:              bool
+    :param maxRecordBytes:          The size above which a line's record is decoded one code at a time (None to
+                                        always decode the whole record).
+    :type maxRecordBytes:           int | None
+    :param sink:                    The name of the output sink to format the output for (see output_sinks.SINKS).
+    :type sink:                     str
+    :param timeStages:              Whether the stages run for every patient or case should be timed.
+    :type timeStages:               bool
+
+    """
+
+    conf.init()
+    conf.control_logging(isLogging)
+    caseDefinitions, caseNames = extraction_plan.build_case_definitions(plan)
+    _WORKER_STATE.update({"CaseDefinitions": caseDefinitions, "CaseNames": caseNames, "PatientSubset": patientSubset,
+                          "Explain": explain, "TraceMemory": traceMemory, "MaxRecordBytes": maxRecordBytes,
+                          "TimeStages": timeStages,
+                          "FormatPatient": output_sinks.SINKS[sink].formatter(
+                              ["PatientID"] + generate_header(caseDefinitions, caseNames),
+                              generate_empty_row(caseDefinitions, caseNames)
+                          )})
+    if traceMemory:
+        memory_usage.MemoryMonitor().start()
+
+
+def _process_worker_batch(lines):
+    """Extract the data for a batch of lines in a worker process initialised by _initialise_worker.
+
+    :param lines:   The lines of patient data.
+    :type lines:    list
+    :return:        The output lines for the patients in the batch and the statistics recorded while extracting them
+                        (in the format returned by RunStatistics.to_dict).
+    :rtype:         list, dict
+
+    """
+
+    memory = memory_usage.MemoryMonitor() if _WORKER_STATE["TraceMemory"] else None
+    runStats = run_statistics.RunStatistics(_WORKER_STATE["Explain"], memory, _WORKER_STATE["TimeStages"])
+    outputLines = process_batch(lines, _WORKER_STATE["CaseDefinitions"], _WORKER_STATE["CaseNames"],
+                                _WORKER_STATE["PatientSubset"], runStats, _WORKER_STATE["MaxRecordBytes"],
+                                _WORKER_STATE["FormatPatient"])
+    return outputLines, runStats.to_dict()
+
+
+def _merge_worker_result(result, runStats):
+    """Record the statistics returned by a worker process and return its output lines.
+
+    :param result:      The output lines and statistics returned by _process_worker_batch.
+    :type result:       tuple
+    :param runStats:    The statistics for the whole run.
+    :type runStats:     run_statistics.RunStatistics
+    :return:            The output lines for the patients in the batch.
+    :rtype:             list
+
+    """
+
+    outputLines, workerStats = result
+    runStats.merge(workerStats)
+    return outputLines
+
+
+def extract_patient(patientRecord, caseDefinitions, caseNames, runStats=None):
+    """Extract the output values for a single patient.
+
+    :param patientRecord:   A patient's medical record with its associations converted to association.Association
+                                objects. See apply_restrictions for its format.
+    :type patientRecord:    dict
+    :param caseDefinitions: The case definitions (i.e. mode, output, restriction and indicator code information).
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions in the order they should be output.
+    :type caseNames:        list
+    :param runStats:        The statistics to record the time spent in each stage in (None to record nothing).
+    :type runStats:         run_statistics.RunStatistics | None
+    :return:                The output values for the patient, one per case, mode and output combination.
+    :rtype:                 list
+
+    """
+
+    extractedHistory = {}  # The subset of the patient's medical history to be extracted and output.
+    isMatched = False  # Whether any case applies to the patient.
+    anchorDates = {}  # The earliest and latest dates of the cases referred to by relative date restrictions.
+    timeStages = runStats is not None and runStats.timeStages
+
+    # Select the portion of the patient's record (i.e. code associations) meeting the requirements for each
+    # case definition. Cases are evaluated after the cases their relative date restrictions refer to.
+    for i in parse_case_definitions.evaluation_order(caseDefinitions, caseNames):
+        dateRange = case_date_range(caseDefinitions[i], anchorDates)
+        if runStats is not None and runStats.explain:
+            # Record the cost and selectivity of the case along with the associations extracted for it.
+            extractedHistory[i], caseSubset = _explain_case(i, patientRecord, caseDefinitions[i], runStats,
+                                                            dateRange)
+            isMatched = isMatched or bool(caseSubset)
+            if caseDefinitions[i].get("IsAnchor"):
+                anchorDates[i] = find_anchor_dates(caseSubset)
+            continue
+
+        # Select the patient's associations that involve a positive indicator code.
+        caseSubset = select_case_codes(patientRecord, caseDefinitions[i])
+        # Apply the restrictions for this case to the patient's associations with positive indicator codes
+        # in order to remove associations that can not indicate that the case applies to the patient.
+        if not timeStages:
+            caseSubset = apply_restrictions(caseSubset, caseDefinitions[i]["Restrictions"], dateRange=dateRange)
+        else:
+            startTime = time.perf_counter()
+            caseSubset = apply_restrictions(caseSubset, caseDefinitions[i]["Restrictions"], dateRange=dateRange)
+            runStats.add_time("ApplyRestrictions", time.perf_counter() - startTime)
+        if caseDefinitions[i].get("IsAnchor"):
+            # Only the dates that other cases are relative to are kept.
+            anchorDates[i] = find_anchor_dates(caseSubset)
+        # If associations remain, then the case applies to the patient. Therefore, extract the subset of the
+        # restricted set of associations that the user desires (according to modes specified for the case).
+        isMatched = isMatched or bool(caseSubset)
+        if not timeStages:
+            extractedHistory[i] = select_case_associations(caseSubset, caseDefinitions[i])
+        else:
+            startTime = time.perf_counter()
+            extractedHistory[i] = select_case_associations(caseSubset, caseDefinitions[i])
+            runStats.add_time("SelectAssociations", time.perf_counter() - startTime)
+
+    # Generate the output for the patient.
+    if not timeStages:
+        generatedOutput = generate_patient_values(extractedHistory, caseNames, caseDefinitions)
+    else:
+        startTime = time.perf_counter()
+        generatedOutput = generate_patient_values(extractedHistory, caseNames, caseDefinitions)
+        runStats.add_time("GeneratePatientOutput", time.perf_counter() - startTime)
+    if isMatched and runStats is not None:
+        runStats.count("PatientsMatched")
+    return generatedOutput
+
+
+def extract_patient_summaries(summaryText, caseDefinitions, caseNames, evaluationOrder=None, runStats=None):
+    """Extract the output values for a single patient from the summaries of their codes.
+
+    The summaries are used as zone maps for the cases with restrictions, discarding the codes of each case that can't
+    have associations meeting its restrictions (see record_summary.prune_codes). Cases left without any codes have
+    nothing selected for them, as they would from the full record. When a case that can't be extracted from the
+    summaries still has codes, the codes that any case may need are returned instead of the output values.
+
+    :param summaryText:     The JSON encoded summaries of the patient's codes (see record_summary).
+    :type summaryText:      str
+    :param caseDefinitions: The case definitions (i.e. mode, output, restriction and indicator code information).
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions in the order they should be output.
+    :type caseNames:        list
+    :param evaluationOrder: The names of the case definitions (including those referred to by relative date
+                                restrictions) in the order they are evaluated. Defaults to finding the order.
+    :type evaluationOrder:  list | None
+    :param runStats:        The statistics to record the time spent in each stage in (None to record nothing).
+    :type runStats:         run_statistics.RunStatistics | None
+    :return:                1) The output values for the patient, or None if the patient's record is needed.
+                            2) The codes needed from the patient's record when it is needed, otherwise None.
+    :rtype:                 list | None, set | None
+
+    """
+
+    timeStages = runStats is not None and runStats.timeStages
+    startTime = time.perf_counter() if timeStages else None
+    summaries = json.loads(summaryText)
+    if evaluationOrder is None:
+        evaluationOrder = parse_case_definitions.evaluation_order(caseDefinitions, caseNames)
+
+    # Cases referred to by relative date restrictions are only needed when the cases referring to them still have
+    # codes, as those cases are never summarisable.
+    caseSummaries = {}
+    isRecordNeeded = False
+    numPruned = 0
+    for i in evaluationOrder:
+        caseSummaries[i] = select_case_codes(summaries, caseDefinitions[i])
+        if caseSummaries[i] and not record_summary.is_summarisable(caseDefinitions[i]):
+            numCodes = len(caseSummaries[i])
+            caseSummaries[i] = record_summary.prune_codes(caseSummaries[i], caseDefinitions[i])
+            numPruned += numCodes - len(caseSummaries[i])
+            isRecordNeeded = isRecordNeeded or (bool(caseSummaries[i]) and i in caseNames)
+
+    generatedOutput = None
+    neededCodes = None
+    if isRecordNeeded:
+        neededCodes = set().union(*caseSummaries.values())
+    else:
+        generatedOutput = []
+        for i in caseNames:
+            if caseSummaries[i]:
+                generatedOutput.extend(record_summary.case_values(caseSummaries[i], caseDefinitions[i]))
+            else:
+                for _ in caseDefinitions[i].get("Windows") or [None]:
+                    generatedOutput.extend(empty_case_values(caseDefinitions[i]))
+
+    if timeStages:
+        runStats.add_time("SummaryExtraction", time.perf_counter() - startTime)
+    if runStats is not None:
+        runStats.count("CodesPruned", numPruned)
+        if not isRecordNeeded:
+            runStats.count("PatientsSummarised")
+            if any(caseSummaries[i] for i in caseNames):
+                runStats.count("PatientsMatched")
+    return generatedOutput, neededCodes
+
+
+def _explain_case(caseName, patientRecord, caseDefinition, runStats, dateRange=None):
+    """Extract the associations for a single case, recording the cost and selectivity of the case.
+
+    :param caseName:        The name of the case definition.
+    :type caseName:         str
+    :param patientRecord:   A patient's medical record with its associations converted to association.Association
+                                objects.
+    :type patientRecord:    dict
+    :param caseDefinition:  The mode, output, restriction and indicator code information for the case.
+    :type caseDefinition:   dict
+    :param runStats:        The statistics to record the cost and selectivity of the case in.
+    :type runStats:         run_statistics.RunStatistics
+    :param dateRange:       The date range of the case for the patient (see case_date_range).
+    :type dateRange:        tuple | None
+    :return:                The associations extracted for the case (see select_case_associations) and the patient's
+                                associations that met the case's restrictions.
+    :rtype:                 dict | list, dict
+
+    """
+
+    caseStartTime = time.perf_counter()
+
+    # Select the patient's associations that involve a positive indicator code.
+    caseSubset = select_case_codes(patientRecord, caseDefinition)
+    associationsWithCodes = sum(map(len, caseSubset.values()))
+
+    # Apply the restrictions, recording the number of associations remaining after each one.
+    restrictionCounts = []
+    startTime = time.perf_counter()
+    caseSubset = apply_restrictions(caseSubset, caseDefinition["Restrictions"], restrictionCounts, dateRange)
+    runStats.add_time("ApplyRestrictions", time.perf_counter() - startTime)
+
+    # Select the associations for each mode (and window).
+    startTime = time.perf_counter()
+    extractedHistory = select_case_associations(caseSubset, caseDefinition)
+    runStats.add_time("SelectAssociations", time.perf_counter() - startTime)
+    windowHistories = extractedHistory if caseDefinition.get("Windows") else [extractedHistory]
+    modeCounts = {i: sum(sum(map(len, j[i].values())) for j in windowHistories) for i in caseDefinition["Modes"]}
+
+    runStats.add_case(caseName, time.perf_counter() - caseStartTime, associationsWithCodes, restrictionCounts,
+                      modeCounts)
+    return extractedHistory, caseSubset
+
+
+def case_date_range(caseDefinition, anchorDates):
+    """Determine the range of dates that a case's associations must fall in for a patient.
+
+    This is the case's date range (see parse_case_definitions.create_date_range) intersected with the range of each of
+    its relative date restrictions (see parse_case_definitions.resolve_relative_restrictions) around the patient's
+    anchor dates. If the patient has no associations for a case that a relative date restriction refers to, then the
+    range is empty.
+
+    :param caseDefinition:  The case definition.
+    :type caseDefinition:   dict
+    :param anchorDates:     The earliest and latest dates of the patient's associations for each case that is
+                                referred to by a relative date restriction (see find_anchor_dates).
+    :type anchorDates:      dict
+    :return:                The start and end dates of the range (inclusive), or None if the case's dates are not
+                                restricted.
+    :rtype:                 tuple | None
+
+    """
+
+    dateRange = caseDefinition.get("DateRange")
+    if not caseDefinition.get("Relative"):
+        return dateRange
+
+    startDate, endDate = dateRange if dateRange else (datetime.datetime.min, datetime.datetime.max)
+    for anchorCase, anchor, fromDays, toDays in caseDefinition["Relative"]:
+        caseAnchorDates = anchorDates.get(anchorCase)
+        if caseAnchorDates is None:
+            return EMPTY_DATE_RANGE
+        anchorDate = caseAnchorDates[0] if anchor == "earliest" else caseAnchorDates[1]
+        startDate = max(startDate, anchorDate + datetime.timedelta(days=fromDays))
+        endDate = min(endDate, anchorDate + datetime.timedelta(days=toDays))
+    return startDate, endDate
+
+
+def find_anchor_dates(medicalRecord):
+    """Find the earliest and latest dates of the associations in a patient's medical record.
+
+    As each code's associations are sorted by date, only the first and last association of each code are checked.
+
+    :param medicalRecord:   A patient's medical record. See apply_restrictions for its format.
+    :type medicalRecord:    dict
+    :return:                The earliest and latest dates, or None if the record has no associations.
+    :rtype:                 tuple | None
+
+    """
+
+    associations = [i for i in medicalRecord.values() if i]
+    if not associations:
+        return None
+    return min(i[0].Date for i in associations), max(i[-1].Date for i in associations)
+
+
+def select_case_codes(patientRecord, caseDefinition):
+    """Select the associations in a patient's record with codes that indicate a case.
+
+    Cases with prefixes or negated codes have their matcher applied to each code in the patient's record. Otherwise,
+    the smaller of the patient's codes and the case's codes is iterated over and looked up in the other.
+
+    :param patientRecord:   A patient's medical record. See apply_restrictions for its format.
+    :type patientRecord:    dict
+    :param caseDefinition:  The case definition.
+    :type caseDefinition:   dict
+    :return:                The patient's record restricted to the codes indicating the case.
+    :rtype:                 dict
+
+    """
+
+    matcher = caseDefinition.get("Matcher")
+    if matcher is not None:
+        return matcher.select(patientRecord)
+    codes = caseDefinition["Codes"]
+    if len(patientRecord) < len(codes):
+        return {i: j for i, j in patientRecord.items() if i in codes}
+    return {i: patientRecord[i] for i in codes if i in patientRecord}
+
+
+def generate_header(caseDefinitions, caseNames):
+    """Generate the names of the columns of extracted data.
+
+    :param caseDefinitions: The case definitions (i.e. mode, output, restriction and indicator code information).
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions in the order they should be output.
+    :type caseNames:        list
+    :return:                The name of the column for each case, (window,) mode and output combination.
+    :rtype:                 list
+
+    """
+
+    header = []
+    for i in caseNames:
+        if caseDefinitions[i].get("Windows"):
+            # There is a column for each window, mode and output combination, named after the start of the window.
+            header.extend(
+                "{:s}__WINDOW_{:s}__MODE_{:s}__OUT_{:s}".format(i, window[0].strftime("%Y-%m-%d"), j, k)
+                for window in caseDefinitions[i]["Windows"]
+                for j in caseDefinitions[i]["Modes"] for k in caseDefinitions[i]["Outputs"]
+            )
+        else:
+            header.extend("{:s}__MODE_{:s}__OUT_{:s}".format(i, j, k)
+                          for j in caseDefinitions[i]["Modes"] for k in caseDefinitions[i]["Outputs"])
+    return header
+
+
+def apply_restrictions(medicalRecord, caseRestrictions, restrictionCounts=None, dateRange=None):
     """Remove associations from a patient's medical history not meeting the restriction criteria for a case definition.
 
+    When the interval covered by the case's date restrictions is given, the date restrictions are applied by bisecting
+    each code's associations on their dates rather than by checking every association against each date restriction.
+    This relies on the associations of each code being sorted by date, as they are in the flat file.
+
     :param medicalRecord:       A patient's medical record. This should have the format:
                                     {
                                         "Code1": [
-                                            {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""},
-                                            {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}
+                                            Association(Date=datetime, Val1=0, Val2=0, Text=""),
+                                            Association(Date=datetime, Val1=0, Val2=0, Text="")
                                         ],
-                                        "Code2": [{"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}],
+                                        "Code2": [Association(Date=datetime, Val1=0, Val2=0, Text="")],
                                         "Code3": [
-                                            {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""},
-                                            {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}
+                                            Association(Date=datetime, Val1=0, Val2=0, Text=""),
+                                            Association(Date=datetime, Val1=0, Val2=0, Text="")
                                         ]
                                     }
     :type medicalRecord:        dict
@@ -117,18 +932,45 @@ def apply_restrictions(medicalRecord, caseRestrictions):
                                     type (i.e. the "Date" list contains functions to implement the date-based
                                     restrictions).
     :type caseRestrictions:     dict
+    :param restrictionCounts:   A list to record the name of each restriction (e.g. Date_1, Val1_2) and the number
+                                    of associations remaining after applying it in. Defaults to recording nothing.
+    :type restrictionCounts:    list | None
+    :param dateRange:           The start and end dates that the case's date restrictions intersect to (see
+                                    parse_case_definitions.create_date_range). If given, the "Date" functions in
+                                    caseRestrictions are not used, and the number of associations remaining after
+                                    restricting the dates is recorded as DateRange.
+    :type dateRange:            tuple | None
     :return:                    The restricted patient's medical history in the same format as the input history.
     :rtype:                     dict
 
     """
 
+    # Cut each code's date-sorted associations down to those in the date range.
+    if dateRange is not None:
+        startDate, endDate = dateRange
+        restrictedRecord = {}
+        for i, j in medicalRecord.items():
+            start = association.bisect_left(j, startDate)
+            end = association.bisect_right(j, endDate, lo=start)
+            restrictedRecord[i] = j if start == 0 and end == len(j) else j[start:end]
+        medicalRecord = restrictedRecord
+        if restrictionCounts is not None:
+            restrictionCounts.append(("DateRange", sum(map(len, medicalRecord.values()))))
+
     # Remove associations that do not meet the restriction criteria.
     for i in caseRestrictions:
+        if dateRange is not None and i == "Date":
+            # The date restrictions have already been applied.
+            continue
         # Go through each category of restrictions (values, dates, etc.).
-        for j in caseRestrictions[i]:
+        for restrictionNum, j in enumerate(caseRestrictions[i]):
             # Filter the patient's record by the current restriction, leaving only those associations
             # that meet the current restriction.
-            medicalRecord = {k: [l for l in medicalRecord[k] if j(l[i])] for k in medicalRecord}
+            medicalRecord = {k: association.filter_associations(medicalRecord[k], i, j) for k in medicalRecord}
+            if restrictionCounts is not None:
+                restrictionCounts.append(
+                    ("{:s}_{:d}".format(i, restrictionNum + 1), sum(map(len, medicalRecord.values())))
+                )
 
     # Filter out codes that have had all associations with the patient removed by the restrictions.
     medicalRecord = {i: medicalRecord[i] for i in medicalRecord if medicalRecord[i]}
@@ -147,20 +989,20 @@ def generate_patient_output(extractedHistory, caseNames, caseDefinitions):
                                         "Case_A": {
                                             "all": {
                                                 "Code1": [
-                                                    {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""},
-                                                    {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}
+                                                    Association(Date=datetime, Val1=0, Val2=0, Text=""),
+                                                    Association(Date=datetime, Val1=0, Val2=0, Text="")
                                                 ],
-                                                "Code2": [{"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}],
+                                                "Code2": [Association(Date=datetime, Val1=0, Val2=0, Text="")],
                                                 "Code3": [
-                                                    {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""},
-                                                    {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}
+                                                    Association(Date=datetime, Val1=0, Val2=0, Text=""),
+                                                    Association(Date=datetime, Val1=0, Val2=0, Text="")
                                                 ]
                                             },
                                             "earliest": {
-                                                "Code": [{"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}]
+                                                "Code": [Association(Date=datetime, Val1=0, Val2=0, Text="")]
                                             },
                                             "max": {
-                                                "Code": [{"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}]
+                                                "Code": [Association(Date=datetime, Val1=0, Val2=0, Text="")]
                                             }
                                         },
                                         "Case_B": {...},
@@ -179,16 +1021,140 @@ def generate_patient_output(extractedHistory, caseNames, caseDefinitions):
 
     """
 
+    return '\t'.join(generate_patient_values(extractedHistory, caseNames, caseDefinitions))
+
+
+def generate_patient_values(extractedHistory, caseNames, caseDefinitions):
+    """Generate the output values for a given patient.
+
+    :param extractedHistory:    The subset of a patient's history that has been extracted for each mode and each case.
+                                    See generate_patient_output for its format. Cases with a window series have a list
+                                    containing the associations extracted for each mode in each window.
+    :type extractedHistory:     dict
+    :param caseNames:           The names of the case definitions in the order they will be output.
+    :type caseNames:            list
+    :param caseDefinitions:     The case definitions (i.e. mode, output, restriction and indicator code information).
+    :type caseDefinitions:      dict
+    :return:                    The extracted patient data, with one string per case, (window,) mode and output
+                                    combination.
+    :rtype:                     list
+
+    """
+
     generatedOutput = []  # The output for the patient.
 
     for i in caseNames:
-        # Go through the modes used with this case definition and generate the required output for each one.
-        for mode in caseDefinitions[i]["Modes"]:
-            extractedModeData = extractedHistory[i][mode]  # Data extracted using the mode.
-            for out in caseDefinitions[i]["Outputs"]:
-                generatedOutput.append(conf.validChoices["Outputs"][out](extractedModeData))
+        # Go through the windows (if the case has any) and modes used with this case definition and generate the
+        # required output for each one.
+        windowHistories = extractedHistory[i] if caseDefinitions[i].get("Windows") else [extractedHistory[i]]
+        for windowHistory in windowHistories:
+            if not any(windowHistory.values()):
+                # Nothing was selected, so the outputs are the same as for every other patient without associations.
+                generatedOutput.extend(empty_case_values(caseDefinitions[i]))
+                continue
+            for mode in caseDefinitions[i]["Modes"]:
+                extractedModeData = windowHistory[mode]  # Data extracted using the mode.
+                for out in caseDefinitions[i]["Outputs"]:
+                    generatedOutput.append(conf.validChoices["Outputs"][out](extractedModeData))
+
+    return generatedOutput
+
+
+def empty_case_values(caseDefinition):
+    """Determine the output values of a case (or one window of a case) when no associations are selected for it.
+
+    The values are only generated the first time they are needed, and are then stored in the case definition.
+
+    :param caseDefinition:  The case definition.
+    :type caseDefinition:   dict
+    :return:                The output value for each mode and output combination of the case.
+    :rtype:                 list
+
+    """
+
+    emptyValues = caseDefinition.get("EmptyValues")
+    if emptyValues is None:
+        emptyValues = caseDefinition["EmptyValues"] = [
+            conf.validChoices["Outputs"][j]({}) for _ in caseDefinition["Modes"] for j in caseDefinition["Outputs"]
+        ]
+    return emptyValues
+
+
+def generate_empty_row(caseDefinitions, caseNames):
+    """Generate the output values of a patient without any associations selected for any case.
+
+    :param caseDefinitions: The case definitions (i.e. mode, output, restriction and indicator code information).
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions in the order they should be output.
+    :type caseNames:        list
+    :return:                The output value for each column of the header (excluding the patient ID column).
+    :rtype:                 list
+
+    """
+
+    return [k for i in caseNames for _ in caseDefinitions[i].get("Windows") or [None]
+            for k in empty_case_values(caseDefinitions[i])]
+
+
+def select_case_associations(caseSubset, caseDefinition):
+    """Select the associations for each mode of a case from the associations meeting its restrictions.
+
+    If the case has a window series, then the associations are split into the windows in a single sweep through each
+    code's associations (see split_windows), and the modes are applied to each window separately.
+
+    :param caseSubset:      The associations with the case's codes that meet its restrictions.
+    :type caseSubset:       dict
+    :param caseDefinition:  The case definition.
+    :type caseDefinition:   dict
+    :return:                The associations selected by each mode (see select_associations), or a list of these with
+                                one per window if the case has a window series. Each mode selects nothing when there
+                                are no associations.
+    :rtype:                 dict | list
+
+    """
+
+    windows = caseDefinition.get("Windows")
+    if windows:
+        return [select_associations(i, caseDefinition["Modes"]) if i else {j: {} for j in caseDefinition["Modes"]}
+                for i in split_windows(caseSubset, windows)]
+    if not caseSubset:
+        # If there are no associations remaining, then return an empty dictionary for each mode.
+        return {i: {} for i in caseDefinition["Modes"]}
+    return select_associations(caseSubset, caseDefinition["Modes"])
+
+
+def split_windows(medicalRecord, windows):
+    """Split a patient's medical record into consecutive windows of dates.
+
+    Each code's associations are sorted by date, and so the associations in each window form a contiguous run of them.
+    The end of each run is found by bisection starting from the end of the previous run, so that each code's
+    associations are swept once for all windows rather than being filtered once per window.
+
+    :param medicalRecord:   A patient's medical record. See apply_restrictions for its format.
+    :type medicalRecord:    dict
+    :param windows:         The (start, end) dates of each window in chronological order. Each window contains the
+                                dates from its start up to, but not including, its end.
+    :type windows:          list
+    :return:                The patient's medical record in each window, with codes that have no associations in a
+                                window omitted from it.
+    :rtype:                 list
+
+    """
+
+    windowRecords = [{} for _ in windows]
+    for code, associations in medicalRecord.items():
+        position = 0  # The position in the associations that the previous window ended at.
+        numAssociations = len(associations)
+        for windowRecord, (startDate, endDate) in zip(windowRecords, windows):
+            start = association.bisect_left(associations, startDate, lo=position)
+            position = association.bisect_left(associations, endDate, lo=start)
+            if position > start:
+                windowRecord[code] = associations[start:position]
+            if position == numAssociations:
+                # All remaining windows are empty for this code.
+                break
 
-    return '\t'.join(generatedOutput)
+    return windowRecords
 
 
 def select_associations(medicalRecord, modes):
@@ -206,17 +1172,17 @@ def select_associations(medicalRecord, modes):
                                         {
                                             "all":
                                                 {
-                                                    "C10E": [{"Date": datetime, "Text": "..", "Val1": 0.0, "Val2": 0.0},
-                                                             {"Date": datetime, "Text": "..", "Val1": 0.0, "Val2": 0.0},
+                                                    "C10E": [Association(Date=datetime, Val1=0.0, Val2=0.0, Text=".."),
+                                                             Association(Date=datetime, Val1=0.0, Val2=0.0, Text=".."),
                                                              ...
                                                             ]
-                                                    "C10F": [{"Date": datetime, "Text": "..", "Val1": 0.0, "Val2": 0.0},
-                                                             {"Date": datetime, "Text": "..", "Val1": 0.0, "Val2": 0.0},
+                                                    "C10F": [Association(Date=datetime, Val1=0.0, Val2=0.0, Text=".."),
+                                                             Association(Date=datetime, Val1=0.0, Val2=0.0, Text=".."),
                                                              ...
                                                             ],
                                                     ...
                                                 }
-                                            "max": {"XXX": [{"Date": datetime, "Text": "..", "Val1": 5.5, "Val2": 0.0}]}
+                                            "max": {"XXX": [Association(Date=datetime, Val1=5.5, Val2=0.0, Text="..")]}
                                             ...
                                         }
     :rtype:                         dict
@@ -0,0 +1,229 @@
+"""Run the patient extraction as a pipeline of reader, compute and writer stages.
+
+The reader thread performs large sequential reads of the patient data file and places batches of lines on a bounded
+queue. The compute stage (either the calling thread or a pool of worker processes) turns each batch of lines into a
+batch of output lines, which are placed on a second bounded queue. The writer thread then writes each batch out with
+a single call to writelines.
+
+As the queues are bounded, a slow stage applies backpressure to the stages before it rather than letting batches
+accumulate in memory. If any stage fails, then all stages are stopped and the exception re-raised in the calling
+thread once the reader and writer threads have finished.
+
+"""
+
+# Python imports.
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+# User imports.
+from . import conf
+from . import progress
+
+# Globals.
+LOGGER = logging.getLogger(__name__)
+_SENTINEL = None  # Marker placed on a queue to indicate that no further batches will be added to it.
+_POLL_INTERVAL = 0.1  # Seconds to wait on a queue before checking whether the pipeline has been stopped.
+
+
+def run(fidInput, fidOutput, processBatch, processes=1, initializer=None, initArgs=(), resultHandler=None,
+        runStats=None, progressReporter=None, readSize=2 ** 22, queueSize=8):
+    """Pass the lines of an input file through a batch processing function and write out the results.
+
+    The order of the output batches is the same as the order of the input batches, regardless of the number of
+    processes used.
+
+    :param fidInput:            The file to read the input lines from.
+    :type fidInput:             file
+    :param fidOutput:           The file to write the output lines to.
+    :type fidOutput:            file
+    :param processBatch:        The function that takes a list of input lines and returns a list of output lines. When
+                                    multiple processes are used this must be a picklable (i.e. module level) function.
+    :type processBatch:         function
+    :param processes:           The number of worker processes to use for the compute stage. A value of 1 performs the
+                                    computation in the calling thread.
+    :type processes:            int
+    :param initializer:         The function used to initialise each worker process (only used when processes > 1).
+    :type initializer:          function | None
+    :param initArgs:            The arguments to pass to the initializer.
+    :type initArgs:             tuple
+    :param resultHandler:       The function applied (in the calling thread) to each result of processBatch in order to
+                                    get the list of output lines. Defaults to using the result as the output lines.
+    :type resultHandler:        function | None
+    :param runStats:            The statistics to record the time spent reading and writing in (None to record nothing).
+    :type runStats:             run_statistics.RunStatistics | None
+    :param progressReporter:    The reporter to update with the progress through the input file after each batch is
+                                    read (None to not report progress).
+    :type progressReporter:     progress.ProgressReporter | None
+    :param readSize:            The approximate number of characters to read in each batch of input lines.
+    :type readSize:             int
+    :param queueSize:           The maximum number of batches that can be waiting between two stages.
+    :type queueSize:            int
+
+    """
+
+    stopEvent = threading.Event()  # Set when any stage fails in order to stop the other stages.
+    errors = []  # Exceptions raised in the reader and writer threads.
+    inputQueue = queue.Queue(maxsize=queueSize)
+    outputQueue = queue.Queue(maxsize=queueSize)
+
+    # Start the reader and writer threads.
+    reader = threading.Thread(target=_read,
+                              args=(fidInput, inputQueue, readSize, stopEvent, errors, runStats, progressReporter),
+                              name="PatientExtractionReader", daemon=True)
+    writer = threading.Thread(target=_write, args=(fidOutput, outputQueue, stopEvent, errors, runStats),
+                              name="PatientExtractionWriter", daemon=True)
+    reader.start()
+    writer.start()
+
+    # Run the compute stage.
+    try:
+        batches = _iterate_queue(inputQueue, stopEvent)
+        if processes > 1:
+            with multiprocessing.Pool(processes, initializer=initializer, initargs=initArgs) as pool:
+                results = pool.imap(processBatch, batches)
+                for outputLines in (map(resultHandler, results) if resultHandler else results):
+                    if not _put(outputQueue, outputLines, stopEvent):
+                        break
+        else:
+            results = map(processBatch, batches)
+            for outputLines in (map(resultHandler, results) if resultHandler else results):
+                if not _put(outputQueue, outputLines, stopEvent):
+                    break
+    except BaseException:
+        # Stop the reader and writer, and propagate the exception once they have finished.
+        stopEvent.set()
+        raise
+    finally:
+        # Tell the writer that there is no more output. If the pipeline has been stopped, then the writer will exit
+        # without needing to receive this.
+        _put(outputQueue, _SENTINEL, stopEvent)
+        reader.join()
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _iterate_queue(batchQueue, stopEvent):
+    """Generate the batches placed on a queue until the sentinel is found or the pipeline is stopped.
+
+    :param batchQueue:  The queue to take batches from.
+    :type batchQueue:   queue.Queue
+    :param stopEvent:   The event indicating that the pipeline has been stopped.
+    :type stopEvent:    threading.Event
+    :return:            A generator of the batches on the queue.
+    :rtype:             generator
+
+    """
+
+    while not stopEvent.is_set():
+        try:
+            batch = batchQueue.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if batch is _SENTINEL:
+            return
+        yield batch
+
+
+def _put(batchQueue, batch, stopEvent):
+    """Place a batch on a queue, waiting for space to become available unless the pipeline is stopped.
+
+    :param batchQueue:  The queue to place the batch on.
+    :type batchQueue:   queue.Queue
+    :param batch:       The batch to place on the queue.
+    :type batch:        list | None
+    :param stopEvent:   The event indicating that the pipeline has been stopped.
+    :type stopEvent:    threading.Event
+    :return:            Whether the batch was placed on the queue.
+    :rtype:             bool
+
+    """
+
+    while not stopEvent.is_set():
+        try:
+            batchQueue.put(batch, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read(fidInput, inputQueue, readSize, stopEvent, errors, runStats=None, progressReporter=None):
+    """Read batches of lines from the input file and place them on the input queue.
+
+    :param fidInput:            The file to read the lines from.
+    :type fidInput:             file
+    :param inputQueue:          The queue to place the batches of lines on.
+    :type inputQueue:           queue.Queue
+    :param readSize:            The approximate number of characters to read in each batch.
+    :type readSize:             int
+    :param stopEvent:           The event indicating that the pipeline has been stopped.
+    :type stopEvent:            threading.Event
+    :param errors:              The list to record any exception raised while reading in.
+    :type errors:               list
+    :param runStats:            The statistics to record the time spent reading in (None to record nothing).
+    :type runStats:             run_statistics.RunStatistics | None
+    :param progressReporter:    The reporter to update after each batch is read (None to not report progress).
+    :type progressReporter:     progress.ProgressReporter | None
+
+    """
+
+    try:
+        position = progress.byte_position(fidInput)
+        lastPosition = position() if position else 0
+        while True:
+            startTime = time.perf_counter()
+            lines = fidInput.readlines(readSize)
+            if runStats is not None:
+                runStats.add_time("LineReading", time.perf_counter() - startTime, len(lines))
+            if not lines:
+                break
+            if progressReporter is not None:
+                if position is None:
+                    numBytes = sum(len(i.encode()) for i in lines)
+                else:
+                    numBytes = position() - lastPosition
+                    lastPosition += numBytes
+                progressReporter.update(numBytes, len(lines))
+            if not _put(inputQueue, lines, stopEvent):
+                return
+        _put(inputQueue, _SENTINEL, stopEvent)
+    except BaseException as e:
+        if conf.isLogging:
+            LOGGER.exception("Reading the patient data failed.")
+        errors.append(e)
+        stopEvent.set()
+
+
+def _write(fidOutput, outputQueue, stopEvent, errors, runStats=None):
+    """Write the batches of output lines on the output queue to the output file.
+
+    :param fidOutput:   The file to write the lines to.
+    :type fidOutput:    file
+    :param outputQueue: The queue to take the batches of lines from.
+    :type outputQueue:  queue.Queue
+    :param stopEvent:   The event indicating that the pipeline has been stopped.
+    :type stopEvent:    threading.Event
+    :param errors:      The list to record any exception raised while writing in.
+    :type errors:       list
+    :param runStats:    The statistics to record the time spent writing in (None to record nothing).
+    :type runStats:     run_statistics.RunStatistics | None
+
+    """
+
+    try:
+        for lines in _iterate_queue(outputQueue, stopEvent):
+            startTime = time.perf_counter()
+            fidOutput.writelines(lines)
+            if runStats is not None:
+                runStats.add_time("OutputWriting", time.perf_counter() - startTime, len(lines))
+        fidOutput.flush()
+    except BaseException as e:
+        if conf.isLogging:
+            LOGGER.exception("Writing the extracted data failed.")
+        errors.append(e)
+        stopEvent.set()
@@ -0,0 +1,179 @@
+"""Report the progress, throughput and estimated time remaining of long running passes over a file."""
+
+# Python imports.
+import datetime
+import json
+import logging
+import sys
+import time
+
+# Globals.
+LOGGER = logging.getLogger(__name__)
+
+
+class ProgressReporter(object):
+    """Periodically report how far through a file a pass has got.
+
+    Progress is measured by the number of bytes consumed against the size of the file. When the lines come from a file
+    (or a reader with a bytes_read method), the bytes consumed are taken from its position in the underlying binary
+    file, so that line ending translation and multi-byte characters are accounted for. To keep the cost low enough to
+    leave on, the clock and position are only checked after every checkEvery items, and the counting of consumed lines
+    is done with local variables (see track).
+
+    Each report is written to a stream (stderr by default) as a human readable line, and logged as a structured
+    record of the form "Progress\t{JSON}" so that it can be parsed back out of the log file.
+
+    """
+
+    def __init__(self, totalBytes, interval=60.0, unit="rows", name="Progress", stream=sys.stderr, logger=LOGGER,
+                 checkEvery=1000):
+        """Initialise the reporter.
+
+        :param totalBytes:  The size of the file being processed.
+        :type totalBytes:   int
+        :param interval:    The minimum number of seconds between reports.
+        :type interval:     float
+        :param unit:        The name of the items being processed (e.g. rows or patients).
+        :type unit:         str
+        :param name:        The name of the pass being reported on.
+        :type name:         str
+        :param stream:      The stream to write the reports to (None to not write them).
+        :type stream:       file | None
+        :param logger:      The logger to record the reports with (None to not log them).
+        :type logger:       logging.Logger | None
+        :param checkEvery:  The number of items to process between checks of the clock.
+        :type checkEvery:   int
+
+        """
+
+        self.totalBytes = totalBytes
+        self.interval = interval
+        self.unit = unit
+        self.name = name
+        self.stream = stream
+        self.logger = logger
+        self.checkEvery = checkEvery
+        self.bytesConsumed = 0
+        self.itemsProcessed = 0
+        self.startTime = time.perf_counter()
+        self.nextReportTime = self.startTime + interval
+
+    def update(self, numBytes, numItems):
+        """Record that more of the file has been consumed, and report the progress if the interval has elapsed.
+
+        This checks the clock, and so should be called for batches of items rather than every item.
+
+        :param numBytes:    The number of bytes consumed since the last update.
+        :type numBytes:     int
+        :param numItems:    The number of items processed since the last update.
+        :type numItems:     int
+
+        """
+
+        self.bytesConsumed += numBytes
+        self.itemsProcessed += numItems
+        currentTime = time.perf_counter()
+        if currentTime >= self.nextReportTime:
+            self.report(currentTime)
+            self.nextReportTime = currentTime + self.interval
+
+    def track(self, lines):
+        """Wrap an iterable of lines so that the progress through them is recorded.
+
+        :param lines:   The lines being processed (e.g. an open file). The bytes consumed by lines that do not come
+                            from a file are counted by encoding them as UTF-8.
+        :type lines:    iterable
+        :return:        A generator of the lines.
+        :rtype:         generator
+
+        """
+
+        position = byte_position(lines)
+        lastPosition = position() if position else 0
+        numBytes = 0
+        numItems = 0
+        for line in lines:
+            yield line
+            numItems += 1
+            if position is None:
+                numBytes += len(line.encode())
+            if numItems == self.checkEvery:
+                if position is not None:
+                    numBytes = position() - lastPosition
+                    lastPosition += numBytes
+                self.update(numBytes, numItems)
+                numBytes = 0
+                numItems = 0
+        if position is not None:
+            numBytes = position() - lastPosition
+        self.update(numBytes, numItems)
+
+    def report(self, currentTime=None):
+        """Report the current progress.
+
+        :param currentTime: The current value of time.perf_counter (looked up if not supplied).
+        :type currentTime:  float | None
+        :return:            The progress statistics reported.
+        :rtype:             dict
+
+        """
+
+        currentTime = time.perf_counter() if currentTime is None else currentTime
+        elapsed = max(currentTime - self.startTime, 1e-9)
+        byteRate = self.bytesConsumed / elapsed
+        remainingBytes = max(self.totalBytes - self.bytesConsumed, 0)
+        progress = {
+            "Name": self.name,
+            "Elapsed": elapsed,
+            "Items": self.itemsProcessed,
+            "Unit": self.unit,
+            "ItemsPerSecond": self.itemsProcessed / elapsed,
+            "BytesConsumed": self.bytesConsumed,
+            "TotalBytes": self.totalBytes,
+            "Fraction": self.bytesConsumed / self.totalBytes if self.totalBytes else 1.0,
+            "MBPerSecond": byteRate / 2 ** 20,
+            "ETA": remainingBytes / byteRate if byteRate else None
+        }
+
+        if self.stream is not None:
+            eta = "unknown" if progress["ETA"] is None else str(datetime.timedelta(seconds=round(progress["ETA"])))
+            self.stream.write("{:s}: {:.1%} {:,d} {:s} ({:,.1f} {:s}/s, {:.2f} MB/s) ETA {:s}\n".format(
+                self.name, progress["Fraction"], self.itemsProcessed, self.unit, progress["ItemsPerSecond"],
+                self.unit, progress["MBPerSecond"], eta
+            ))
+            self.stream.flush()
+        if self.logger is not None:
+            self.logger.info("Progress\t{:s}".format(json.dumps(progress)))
+
+        return progress
+
+    def finish(self):
+        """Report the final progress once the pass is complete.
+
+        :return:    The progress statistics reported.
+        :rtype:     dict
+
+        """
+
+        return self.report()
+
+
+def byte_position(source):
+    """Find the function giving the number of bytes of a file (or reader of files) that have been consumed.
+
+    Text files can not be told their position while being iterated over, so the position of their underlying binary
+    file is used instead. This includes any text read ahead of the lines returned, and so is exact once the file has
+    been consumed.
+
+    :param source:  The file or reader the lines are read from.
+    :type source:   file | object
+    :return:        The function returning the number of bytes consumed, or None if the source is not a file and has
+                        no bytes_read method.
+    :rtype:         callable | None
+
+    """
+
+    buffer = getattr(source, "buffer", None)
+    if buffer is not None:
+        return buffer.tell
+    return getattr(source, "bytes_read", None)
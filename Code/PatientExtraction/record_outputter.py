@@ -4,18 +4,27 @@ A typical record will be a dictionary with contents along the lines of:
 
 {
     "Code1": [
-        {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""},
-        {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}
+        Association(Date=datetime, Val1=0, Val2=0, Text=""),
+        Association(Date=datetime, Val1=0, Val2=0, Text="")
     ],
-    "Code2": [{"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}],
+    "Code2": [Association(Date=datetime, Val1=0, Val2=0, Text="")],
     "Code3": [
-        {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""},
-        {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}
+        Association(Date=datetime, Val1=0, Val2=0, Text=""),
+        Association(Date=datetime, Val1=0, Val2=0, Text="")
     ]
 }
 
+where each code's associations are either a list of association.Association objects or an association.CodeColumns.
+
 """
 
+# Python imports.
+import itertools
+import operator
+
+# User imports.
+from . import association
+
 
 def code_outputter(record):
     """Function to output an arbitrary code in the patient's record.
@@ -88,7 +97,7 @@ def date_outputter(record):
 
         # Get an arbitrary date associated with the code. As records are sorted chronologically, this will get the
         # earliest date in the record that the code was associated with the patient.
-        date = record[code][0]["Date"]
+        date = record[code][0].Date
         return "{:s}".format(date.strftime("%Y-%m-%d"))
     else:
         # The record is empty.
@@ -138,14 +147,11 @@ def max_outputter(valType):
         """
 
         if record:
-            # Combine all code associations into one list.
-            associations = [k for j in record.values() for k in j]
+            # Get the maximum valType value of each code's associations, and then the maximum of these.
+            maxValue = max(max(association.field_values(j, valType)) for j in record.values())
 
-            # Get the code association with the maximum value.
-            maxAssociation = max(associations, key=lambda x: x[valType])
-
-            # Return the valType value from this maximum association.
-            return "{:.2f}".format(maxAssociation[valType])
+            # Return the maximum valType value.
+            return "{:.2f}".format(maxValue)
         else:
             # The record is empty.
             return ''
@@ -179,11 +185,13 @@ def mean_outputter(valType):
         """
 
         if record:
-            # Combine all the valType values of the code associations into one list.
-            associationValues = [k[valType] for j in record.values() for k in j]
+            # Get the valType values of each code's associations.
+            associationValues = [association.field_values(j, valType) for j in record.values()]
 
-            # Get the mean value over the associations.
-            meanValue = sum(associationValues) / len(associationValues)
+            # Get the mean value over the associations. Each code's values are summed before the codes' sums are
+            # added together, so that the mean matches the one calculated from the summaries of the codes (see
+            # record_summary).
+            meanValue = sum(map(sum, associationValues)) / sum(map(len, associationValues))
 
             # Return the valType value from this mean association.
             return "{:.2f}".format(meanValue)
@@ -220,7 +228,9 @@ def median_outputter(valType):
 
         if record:
             # Combine all the valType values of the code associations into one list and sort them.
-            associationValues = sorted([k[valType] for j in record.values() for k in j])
+            associationValues = sorted(
+                itertools.chain.from_iterable(association.field_values(j, valType) for j in record.values())
+            )
 
             # If there is only one record, then return that record.
             if len(associationValues) == 1:
@@ -271,14 +281,11 @@ def min_outputter(valType):
         """
 
         if record:
-            # Combine all code associations into one list.
-            associations = [k for j in record.values() for k in j]
-
-            # Get the code association with the minimum value.
-            minAssociation = min(associations, key=lambda x: x[valType])
+            # Get the minimum valType value of each code's associations, and then the minimum of these.
+            minValue = min(min(association.field_values(j, valType)) for j in record.values())
 
-            # Return the valType value from this minimum association.
-            return "{:.2f}".format(minAssociation[valType])
+            # Return the minimum valType value.
+            return "{:.2f}".format(minValue)
         else:
             # The record is empty.
             return ''
@@ -296,6 +303,8 @@ def value_outputter(valType):
 
     """
 
+    getValue = operator.attrgetter(valType)  # Extracts the valType value from an association.
+
     def outputter(record):
         """Function to output an arbitrary value in the patient's record.
 
@@ -319,7 +328,7 @@ def value_outputter(valType):
 
             # Get an arbitrary value associated with the code. As records are sorted chronologically, this will get the
             # value associated with the earliest association in the record between the code and the patient.
-            value = record[code][0][valType]
+            value = getValue(record[code][0])
             return "{:.2f}".format(value)
         else:
             # The record is empty.
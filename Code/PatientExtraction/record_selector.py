@@ -4,18 +4,34 @@ A typical record will be a dictionary with contents along the lines of:
 
 {
     "Code1": [
-        {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""},
-        {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}
+        Association(Date=datetime, Val1=0, Val2=0, Text=""),
+        Association(Date=datetime, Val1=0, Val2=0, Text="")
     ],
-    "Code2": [{"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}],
+    "Code2": [Association(Date=datetime, Val1=0, Val2=0, Text="")],
     "Code3": [
-        {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""},
-        {"Val1": 0, "Val2": 0, "Date": datetime, "Text": ""}
+        Association(Date=datetime, Val1=0, Val2=0, Text=""),
+        Association(Date=datetime, Val1=0, Val2=0, Text="")
     ]
 }
 
+where each code's associations are either a list of association.Association objects or an association.CodeColumns.
+
+As well as the fixed modes, there are modes selecting a number of associations given in the mode's name (see
+create_selector). These use the chronological ordering of each code's associations or a heap to pick out the selected
+associations, rather than sorting all of the patient's associations.
+
 """
 
+# Python imports.
+import heapq
+import re
+
+# User imports.
+from . import association
+
+# Globals.
+PARAMETERISED_MODE = re.compile("^(?:(first|last|nth)([1-9][0-9]*)|(top|bottom)([1-9][0-9]*)_val([12]))$")
+
 
 def all_selector(records):
     """Select all associations between a patient and their codes.
@@ -36,7 +52,7 @@ def earliest_selector(records):
     This relies on the associations being sorted chronologically, thereby enabling additional loops to be
     bypassed as the earliest association between a given code and a patient is first in the record of associations with
     that code. For example code "A" may have a record of associations like
-    "A": [{"Date": "1990-10-30"}, {"Date": "1995-2-8"}, {"Date": "2001-7-23"}]. You can therefore just get the
+    "A": [<Date 1990-10-30>, <Date 1995-2-8>, <Date 2001-7-23>]. You can therefore just get the
     association at index 0 to get the earliest association between the patient and code.
 
     :param records: A patient's medical records. See the module docstring for its format.
@@ -50,7 +66,7 @@ def earliest_selector(records):
 
     # First find the code that has the earliest association with the patient. This will return not just
     # the earliest association, but all associations between the patient and the earliest occurring code.
-    earliestRecord = min(records.items(), key=lambda x: (x[1][0]["Date"], x[0]))
+    earliestRecord = min(records.items(), key=lambda x: (x[1][0].Date, x[0]))
 
     # Determine the code that occurred earliest, and its association with the patient that caused it to be
     # the earliest occurring code. Due to the way associations are stored (chronologically) the first
@@ -66,7 +82,7 @@ def latest_selector(records):
     This relies on the associations being sorted chronologically, thereby enabling additional loops to be
     bypassed as the latest association between a given code and a patient is last in the record of associations with
     that code. For example code "A" may have a record of associations like
-    "A": [{"Date": "1990-10-30"}, {"Date": "1995-2-8"}, {"Date": "2001-7-23"}]. You can therefore just get the
+    "A": [<Date 1990-10-30>, <Date 1995-2-8>, <Date 2001-7-23>]. You can therefore just get the
     association at index -1 to get the latest association between the patient and code.
 
     :param records: A patient's medical records. See the module docstring for its format.
@@ -80,7 +96,7 @@ def latest_selector(records):
 
     # First find the code that has the latest association with the patient. This will return not just
     # the latest association, but all associations between the patient and the latest occurring code.
-    latestRecord = max(records.items(), key=lambda x: (x[1][-1]["Date"], x[0]))
+    latestRecord = max(records.items(), key=lambda x: (x[1][-1].Date, x[0]))
 
     # Determine the code that occurred latest, and its association with the patient that caused it to be
     # the latest occurring code. Due to the way associations are stored (chronologically) the last
@@ -114,12 +130,12 @@ def max_selector(valType):
 
         # Select the positive indicator code that has an association with the patient that contains the
         # greatest valType value.
-        maxRecord = max(records.items(), key=lambda x: (max([i[valType] for i in x[1]]), x[0]))
+        values = {i: association.field_values(j, valType) for i, j in records.items()}
+        maxCode = max(values, key=lambda x: (max(values[x]), x))
 
-        # Determine the code associated with the max value and its association with the patient that actually has
-        # the maximum value.
-        maxCode = maxRecord[0]
-        maxAssociation = max(maxRecord[1], key=lambda x: x[valType])
+        # Determine the association between the code and the patient that actually has the maximum value.
+        maxValues = values[maxCode]
+        maxAssociation = records[maxCode][maxValues.index(max(maxValues))]
         return {maxCode: [maxAssociation]}
 
     return selector
@@ -149,12 +165,215 @@ def min_selector(valType):
 
         # Select the positive indicator code that has an association with the patient that contains the
         # smallest valType value.
-        minRecord = min(records.items(), key=lambda x: (min([i[valType] for i in x[1]]), x[0]))
+        values = {i: association.field_values(j, valType) for i, j in records.items()}
+        minCode = min(values, key=lambda x: (min(values[x]), x))
 
-        # Determine the code associated with the min value and its association with the patient that actually has
-        # the minimum value.
-        minCode = minRecord[0]
-        minAssociation = min(minRecord[1], key=lambda x: x[valType])
+        # Determine the association between the code and the patient that actually has the minimum value.
+        minValues = values[minCode]
+        minAssociation = records[minCode][minValues.index(min(minValues))]
         return {minCode: [minAssociation]}
 
     return selector
+
+
+def create_selector(mode):
+    """Create the selector for a mode that selects a number of associations.
+
+    The valid modes are:
+        firstK - The K earliest associations.
+        lastK - The K latest associations.
+        nthK - The Kth earliest association (nothing is selected if there are fewer than K associations).
+        topK_val1, topK_val2 - The K associations with the largest Val1 or Val2 values.
+        bottomK_val1, bottomK_val2 - The K associations with the smallest Val1 or Val2 values.
+    Ties are broken in the same way as the single association modes, i.e. on the code name, with earlier associations
+    of the same code preferred (except for lastK).
+
+    :param mode:    The name of the mode.
+    :type mode:     str
+    :return:        The selector for the mode, or None if the mode is not a valid mode of this type.
+    :rtype:         function | None
+
+    """
+
+    match = PARAMETERISED_MODE.match(mode)
+    if not match:
+        return None
+    ordering, number, valueOrdering, valueNumber, valueNum = match.groups()
+    if ordering == "first":
+        return first_selector(int(number))
+    elif ordering == "last":
+        return last_selector(int(number))
+    elif ordering == "nth":
+        return nth_selector(int(number))
+    elif valueOrdering == "top":
+        return largest_selector("Val" + valueNum, int(valueNumber))
+    return smallest_selector("Val" + valueNum, int(valueNumber))
+
+
+def first_selector(numAssociations):
+    """Generate a function that will select the earliest associations.
+
+    :param numAssociations: The number of associations to select.
+    :type numAssociations:  int
+    :return:                A function that selects the numAssociations earliest associations.
+    :rtype:                 function
+
+    """
+
+    def selector(records):
+        """Select the earliest associations between a patient and their codes.
+
+        As each code's associations are stored chronologically, only the first numAssociations associations with
+        each code can be selected, and these are the only ones considered.
+
+        :param records: A patient's medical records. See the module docstring for its format.
+        :type records:  dict
+        :return:        The earliest associations.
+        :rtype:         dict
+
+        """
+
+        candidates = (
+            (j[k].Date, i, k) for i, j in records.items() for k in range(min(numAssociations, len(j)))
+        )
+        return _group_associations(records, heapq.nsmallest(numAssociations, candidates))
+
+    return selector
+
+
+def last_selector(numAssociations):
+    """Generate a function that will select the latest associations.
+
+    :param numAssociations: The number of associations to select.
+    :type numAssociations:  int
+    :return:                A function that selects the numAssociations latest associations.
+    :rtype:                 function
+
+    """
+
+    def selector(records):
+        """Select the latest associations between a patient and their codes.
+
+        As each code's associations are stored chronologically, only the last numAssociations associations with
+        each code can be selected, and these are the only ones considered.
+
+        :param records: A patient's medical records. See the module docstring for its format.
+        :type records:  dict
+        :return:        The latest associations.
+        :rtype:         dict
+
+        """
+
+        candidates = (
+            (j[k].Date, i, k) for i, j in records.items() for k in range(max(0, len(j) - numAssociations), len(j))
+        )
+        return _group_associations(records, heapq.nlargest(numAssociations, candidates))
+
+    return selector
+
+
+def nth_selector(position):
+    """Generate a function that will select the association at a given position in chronological order.
+
+    :param position:    The position of the association to select (1 for the earliest association).
+    :type position:     int
+    :return:            A function that selects the association at the position.
+    :rtype:             function
+
+    """
+
+    def selector(records):
+        """Select the association between a patient and a code at a given position in chronological order.
+
+        :param records: A patient's medical records. See the module docstring for its format.
+        :type records:  dict
+        :return:        The association at the position, or nothing if the patient has too few associations.
+        :rtype:         dict
+
+        """
+
+        candidates = (
+            (j[k].Date, i, k) for i, j in records.items() for k in range(min(position, len(j)))
+        )
+        selected = heapq.nsmallest(position, candidates)
+        return _group_associations(records, selected[-1:]) if len(selected) == position else {}
+
+    return selector
+
+
+def largest_selector(valType, numAssociations):
+    """Generate a function that will select the associations with the largest valType values.
+
+    :param valType:         The type of value to select within the record (i.e. Val1 or Val2).
+    :type valType:          str
+    :param numAssociations: The number of associations to select.
+    :type numAssociations:  int
+    :return:                A function that selects the numAssociations associations with the largest valType values.
+    :rtype:                 function
+
+    """
+
+    def selector(records):
+        """Select the associations between a patient and their codes that contain the largest values.
+
+        :param records: A patient's medical records. See the module docstring for its format.
+        :type records:  dict
+        :return:        The associations with the largest values.
+        :rtype:         dict
+
+        """
+
+        candidates = ((l, i, -k) for i, j in records.items()
+                      for k, l in enumerate(association.field_values(j, valType)))
+        return _group_associations(records, [(i, j, -k) for i, j, k in heapq.nlargest(numAssociations, candidates)])
+
+    return selector
+
+
+def smallest_selector(valType, numAssociations):
+    """Generate a function that will select the associations with the smallest valType values.
+
+    :param valType:         The type of value to select within the record (i.e. Val1 or Val2).
+    :type valType:          str
+    :param numAssociations: The number of associations to select.
+    :type numAssociations:  int
+    :return:                A function that selects the numAssociations associations with the smallest valType values.
+    :rtype:                 function
+
+    """
+
+    def selector(records):
+        """Select the associations between a patient and their codes that contain the smallest values.
+
+        :param records: A patient's medical records. See the module docstring for its format.
+        :type records:  dict
+        :return:        The associations with the smallest values.
+        :rtype:         dict
+
+        """
+
+        candidates = ((l, i, k) for i, j in records.items()
+                      for k, l in enumerate(association.field_values(j, valType)))
+        return _group_associations(records, heapq.nsmallest(numAssociations, candidates))
+
+    return selector
+
+
+def _group_associations(records, selected):
+    """Group selected associations by their code.
+
+    :param records:     A patient's medical records. See the module docstring for its format.
+    :type records:      dict
+    :param selected:    The selected associations as (sort key, code, position in the code's associations) tuples in
+                            the order they were selected.
+    :type selected:     list
+    :return:            The selected associations in the same format as the records, with each code's associations
+                            kept in chronological order.
+    :rtype:             dict
+
+    """
+
+    positions = {}  # The positions of the selected associations of each code.
+    for _, code, position in selected:
+        positions.setdefault(code, []).append(position)
+    return {i: [records[i][k] for k in sorted(j)] for i, j in positions.items()}
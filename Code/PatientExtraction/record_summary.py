@@ -0,0 +1,241 @@
+"""Summaries of the associations between each patient and code, and the extraction of case definitions from them.
+
+When the flat file is generated with summaries (see GenerateDataFiles), each line has a third tab separated column after
+the patient's record. This is a JSON object mapping each of the patient's codes to a list summarising the code's
+associations, with the entries given by SUMMARY_FIELDS:
+    Count - The number of associations.
+    FirstDate, LastDate - The dates (YYYY-MM-DD) of the earliest and latest associations.
+    MinVal1, MaxVal1 (and MinVal2, MaxVal2) - The smallest and largest values.
+    MinVal1Position, MaxVal1Position (and the Val2 equivalents) - The position in the code's (chronologically sorted)
+        associations of the first association with the smallest or largest value.
+    SumVal1, SumVal2 - The sum of the values in chronological order.
+
+A case definition without any restrictions, whose mode and output combinations can all be determined from these
+summaries (see SUMMARY_OUTPUTS), can be extracted from the summaries alone without decoding the patient's record. The
+summaries also act as zone maps for the cases with restrictions, as a code whose dates or values all lie outside what
+a case's restrictions allow can be discarded for the case before the record is decoded (see prune_codes).
+
+"""
+
+# Python imports.
+import argparse
+import json
+
+# User imports.
+from . import association
+
+# Globals.
+SUMMARY_FIELDS = ["Count", "FirstDate", "LastDate", "MinVal1", "MinVal1Position", "MaxVal1", "MaxVal1Position",
+                  "SumVal1", "MinVal2", "MinVal2Position", "MaxVal2", "MaxVal2Position", "SumVal2"]
+_COUNT, _FIRST_DATE, _LAST_DATE = 0, 1, 2
+_VALUE_FIELDS = {"Val1": (3, 5, 7), "Val2": (8, 10, 12)}  # The positions of the min, max and sum of each value.
+# The outputs that can be determined from the summaries for each mode. The single association modes only know about
+# the parts of the association that they select on.
+SUMMARY_OUTPUTS = {
+    "all": {"code", "count", "date", "exists", "max1", "max2", "mean1", "mean2", "min1", "min2"},
+    "earliest": {"code", "count", "date", "exists"},
+    "latest": {"code", "count", "date", "exists"},
+    "max1": {"code", "count", "exists", "max1", "mean1", "median1", "min1", "val1"},
+    "max2": {"code", "count", "exists", "max2", "mean2", "median2", "min2", "val2"},
+    "min1": {"code", "count", "exists", "max1", "mean1", "median1", "min1", "val1"},
+    "min2": {"code", "count", "exists", "max2", "mean2", "median2", "min2", "val2"}
+}
+
+
+def summarise_record(patientRecord):
+    """Summarise the associations of each code in a patient's record.
+
+    :param patientRecord:   A patient's medical record as stored in the flat file (i.e. mapping each code to its
+                                chronologically sorted associations, each a dictionary with a YYYY-MM-DD date).
+    :type patientRecord:    dict
+    :return:                The summary of each code, in the same order as the record.
+    :rtype:                 dict
+
+    """
+
+    summaries = {}
+    for code, associations in patientRecord.items():
+        if not associations:
+            continue
+        summary = [len(associations), associations[0]["Date"], associations[-1]["Date"]]
+        for valType in ["Val1", "Val2"]:
+            values = [i.get(valType, 0) for i in associations]
+            minValue = min(values)
+            maxValue = max(values)
+            summary.extend([minValue, values.index(minValue), maxValue, values.index(maxValue), sum(values)])
+        summaries[code] = summary
+    return summaries
+
+
+def is_summarisable(caseDefinition):
+    """Determine whether a case definition can be extracted from the summaries of a patient's codes.
+
+    The result is only determined the first time it is needed, and is then stored in the case definition.
+
+    :param caseDefinition:  The case definition.
+    :type caseDefinition:   dict
+    :return:                Whether the case has no restrictions, windows or relative date restrictions, and only uses
+                                mode and output combinations in SUMMARY_OUTPUTS.
+    :rtype:                 bool
+
+    """
+
+    summarisable = caseDefinition.get("Summarisable")
+    if summarisable is None:
+        summarisable = caseDefinition["Summarisable"] = (
+            not any(caseDefinition["Restrictions"].values()) and not caseDefinition.get("DateRange") and
+            not caseDefinition.get("Windows") and not caseDefinition.get("Relative") and
+            all(j in SUMMARY_OUTPUTS.get(i, ()) for i in caseDefinition["Modes"] for j in caseDefinition["Outputs"])
+        )
+    return summarisable
+
+
+def prune_codes(caseSummaries, caseDefinition):
+    """Discard the codes of a case with no associations that could meet the case's restrictions.
+
+    A code is discarded when its dates all lie outside the case's date range, or when its values can't meet one of the
+    case's value restrictions. As each value restriction compares the value against a threshold, some value of a code
+    meets the restriction exactly when its smallest or largest value does. The associations of the remaining codes may
+    still all fail the restrictions in combination.
+
+    :param caseSummaries:   The summaries of the patient's codes indicating the case.
+    :type caseSummaries:    dict
+    :param caseDefinition:  The case definition.
+    :type caseDefinition:   dict
+    :return:                The summaries of the codes that may have associations meeting the case's restrictions.
+    :rtype:                 dict
+
+    """
+
+    dateRange = caseDefinition.get("DateRange")
+    restrictions = caseDefinition["Restrictions"]
+    if dateRange is None and not restrictions["Val1"] and not restrictions["Val2"]:
+        return caseSummaries
+
+    prunedSummaries = {}
+    for code, summary in caseSummaries.items():
+        if dateRange is not None and (association.parse_date(summary[_LAST_DATE]) < dateRange[0] or
+                                      association.parse_date(summary[_FIRST_DATE]) > dateRange[1]):
+            continue
+        if all(j(summary[minPosition]) or j(summary[maxPosition])
+               for i, (minPosition, maxPosition, _) in _VALUE_FIELDS.items() for j in restrictions[i]):
+            prunedSummaries[code] = summary
+    return prunedSummaries
+
+
+def case_values(caseSummaries, caseDefinition):
+    """Generate the output values of a summarisable case for a patient.
+
+    The values are the same as those generated from the patient's full record by the selectors and outputters.
+
+    :param caseSummaries:   The summaries of the patient's codes indicating the case (in the order they appear in the
+                                patient's record). This should not be empty.
+    :type caseSummaries:    dict
+    :param caseDefinition:  The case definition.
+    :type caseDefinition:   dict
+    :return:                The output value for each mode and output combination of the case.
+    :rtype:                 list
+
+    """
+
+    values = []
+    for mode in caseDefinition["Modes"]:
+        selected = _select(caseSummaries, mode)
+        values.extend(_output(selected, i) for i in caseDefinition["Outputs"])
+    return values
+
+
+def _select(caseSummaries, mode):
+    """Select the summaries of the associations chosen by a mode.
+
+    The single association modes return a summary of the one association they select, with the parts of it that are
+    not known from the summaries set to None.
+
+    :param caseSummaries:   The summaries of the patient's codes indicating the case.
+    :type caseSummaries:    dict
+    :param mode:            The mode.
+    :type mode:             str
+    :return:                The summaries of the selected associations, indexed by code.
+    :rtype:                 dict
+
+    """
+
+    if mode == "all":
+        return caseSummaries
+    elif mode in ("earliest", "latest"):
+        position = _FIRST_DATE if mode == "earliest" else _LAST_DATE
+        chooser = min if mode == "earliest" else max
+        code = chooser(caseSummaries, key=lambda x: (association.parse_date(caseSummaries[x][position]), x))
+        date = caseSummaries[code][position]
+        return {code: [1, date, date] + [None] * (len(SUMMARY_FIELDS) - 3)}
+
+    # Select the code with the largest (or smallest) value, and summarise the association with it.
+    minPosition, maxPosition, _ = _VALUE_FIELDS["Val" + mode[-1]]
+    position = maxPosition if mode.startswith("max") else minPosition
+    chooser = max if mode.startswith("max") else min
+    code = chooser(caseSummaries, key=lambda x: (caseSummaries[x][position], x))
+    value = caseSummaries[code][position]
+    summary = [1, None, None] + [None] * (len(SUMMARY_FIELDS) - 3)
+    summary[minPosition:minPosition + 5] = [value, 0, value, 0, value]
+    return {code: summary}
+
+
+def _output(selected, output):
+    """Generate an output value from the summaries of the selected associations.
+
+    :param selected:    The summaries of the selected associations, indexed by code.
+    :type selected:     dict
+    :param output:      The output.
+    :type output:       str
+    :return:            The output value.
+    :rtype:             str
+
+    """
+
+    if output == "code":
+        return next(iter(selected))
+    elif output == "count":
+        return "{:d}".format(sum(i[_COUNT] for i in selected.values()))
+    elif output == "date":
+        return association.parse_date(next(iter(selected.values()))[_FIRST_DATE]).strftime("%Y-%m-%d")
+    elif output == "exists":
+        return '1'
+
+    minPosition, maxPosition, sumPosition = _VALUE_FIELDS["Val" + output[-1]]
+    if output.startswith("max"):
+        value = max(i[maxPosition] for i in selected.values())
+    elif output.startswith("min"):
+        value = min(i[minPosition] for i in selected.values())
+    elif output.startswith("mean"):
+        value = sum([i[sumPosition] for i in selected.values()]) / sum(i[_COUNT] for i in selected.values())
+    else:
+        # The median and value outputs are only used with modes selecting a single association.
+        value = next(iter(selected.values()))[maxPosition]
+    return "{:.2f}".format(value)
+
+
+def add_summaries(filePatientData, fileOutput):
+    """Write a copy of a flat file of patient data with the summary of each patient's codes added to each line.
+
+    :param filePatientData: The location of the flat file of patient data.
+    :type filePatientData:  str
+    :param fileOutput:      The location to write the flat file with summaries to.
+    :type fileOutput:       str
+
+    """
+
+    with open(filePatientData, 'r') as fidPatientData, open(fileOutput, 'w') as fidOutput:
+        for line in fidPatientData:
+            patientID, recordText = line.rstrip('\n').split('\t')[:2]
+            fidOutput.write("{:s}\t{:s}\t{:s}\n".format(
+                patientID, recordText, json.dumps(summarise_record(json.loads(recordText)))
+            ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the summaries of each patient's codes to a flat file of patient "
+                                                 "data.")
+    parser.add_argument("input", help="The location of the flat file of patient data.", type=str)
+    parser.add_argument("output", help="The location to write the flat file with summaries to.", type=str)
+    args = parser.parse_args()
+    add_summaries(args.input, args.output)
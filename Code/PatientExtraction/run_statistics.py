@@ -0,0 +1,249 @@
+"""Record the time spent in each stage of an extraction run along with counts of what was processed."""
+
+# Python imports.
+from collections import defaultdict
+import datetime
+import json
+import time
+
+
+class RunStatistics(object):
+    """Accumulate per-stage timings, call counts and general counters for an extraction run.
+
+    Timings are recorded by the caller with explicit calls to add_time, e.g.
+        start = time.perf_counter()
+        ...
+        runStats.add_time("ApplyRestrictions", time.perf_counter() - start)
+    as this is cheaper than using a context manager in the inner loops of the extraction. The stages run for every
+    patient or case are only timed when timeStages is set, so that runs that don't need the breakdown don't pay for it.
+
+    """
+
+    def __init__(self, explain=False, memory=None, timeStages=False):
+        """Initialise an empty set of statistics.
+
+        :param explain:     Whether the cost and selectivity of each case definition should also be recorded.
+        :type explain:      bool
+        :param memory:      The monitor to record the memory usage of the run with (None to not record memory usage).
+        :type memory:       memory_usage.MemoryMonitor | None
+        :param timeStages:  Whether the stages run for every patient or case (e.g. JSON decoding and applying
+                                restrictions) should be timed.
+        :type timeStages:   bool
+
+        """
+
+        self.started = datetime.datetime.now()
+        self.startTime = time.perf_counter()
+        self.explain = explain
+        self.timeStages = timeStages
+        self.timings = defaultdict(float)  # Total seconds spent in each stage.
+        self.calls = defaultdict(int)  # Number of times each stage was run.
+        self.counters = defaultdict(int)  # General counts (patients scanned, associations decoded, etc.).
+        self.cases = {}  # The cost and selectivity statistics for each case definition (when explaining).
+        self.memory = memory
+
+    def add_time(self, stage, seconds, calls=1):
+        """Record time spent in a stage.
+
+        :param stage:   The name of the stage.
+        :type stage:    str
+        :param seconds: The number of seconds spent in the stage.
+        :type seconds:  float
+        :param calls:   The number of calls to the stage that the time covers.
+        :type calls:    int
+
+        """
+
+        self.timings[stage] += seconds
+        self.calls[stage] += calls
+
+    def count(self, counter, amount=1):
+        """Increment a counter.
+
+        :param counter: The name of the counter.
+        :type counter:  str
+        :param amount:  The amount to increment the counter by.
+        :type amount:   int
+
+        """
+
+        self.counters[counter] += amount
+
+    def add_case(self, caseName, seconds, associationsWithCodes, restrictionCounts, modeCounts):
+        """Record the cost and selectivity of a case definition for one patient.
+
+        :param caseName:                The name of the case definition.
+        :type caseName:                 str
+        :param seconds:                 The time spent selecting the patient's associations for the case.
+        :type seconds:                  float
+        :param associationsWithCodes:   The number of the patient's associations with the case's codes.
+        :type associationsWithCodes:    int
+        :param restrictionCounts:       The name of each restriction in the order they were applied, along with the
+                                            number of associations remaining after it was applied.
+        :type restrictionCounts:        list
+        :param modeCounts:              The number of associations selected by each mode.
+        :type modeCounts:               dict
+
+        """
+
+        caseStats = self._get_case(caseName)
+        caseStats["Seconds"] += seconds
+        caseStats["Patients"] += 1
+        if associationsWithCodes:
+            caseStats["PatientsWithCodes"] += 1
+            caseStats["AssociationsWithCodes"] += associationsWithCodes
+        for i, j in restrictionCounts:
+            caseStats["Restrictions"][i] = caseStats["Restrictions"].get(i, 0) + j
+        for i, j in modeCounts.items():
+            modeStats = caseStats["Modes"].setdefault(i, {"Patients": 0, "Associations": 0})
+            modeStats["Patients"] += 1 if j else 0
+            modeStats["Associations"] += j
+
+    def set_case_codes(self, caseName, numCodes):
+        """Record the size of the expanded code set of a case definition.
+
+        :param caseName:    The name of the case definition.
+        :type caseName:     str
+        :param numCodes:    The number of codes in the case definition once wildcards have been expanded.
+        :type numCodes:     int
+
+        """
+
+        self._get_case(caseName)["ExpandedCodes"] = numCodes
+
+    def _get_case(self, caseName):
+        """Get the statistics for a case definition, initialising them if the case has not been seen before.
+
+        :param caseName:    The name of the case definition.
+        :type caseName:     str
+        :return:            The statistics for the case definition.
+        :rtype:             dict
+
+        """
+
+        if caseName not in self.cases:
+            self.cases[caseName] = {"ExpandedCodes": 0, "Seconds": 0.0, "Patients": 0, "PatientsWithCodes": 0,
+                                    "AssociationsWithCodes": 0, "Restrictions": {}, "Modes": {}}
+        return self.cases[caseName]
+
+    def merge(self, other):
+        """Add the timings and counters from another set of statistics (e.g. from a worker process) to these ones.
+
+        :param other:   The statistics to merge in. Either a RunStatistics object or the output of its to_dict method.
+        :type other:    RunStatistics | dict
+
+        """
+
+        other = other.to_dict() if isinstance(other, RunStatistics) else other
+        for i, j in other["Timings"].items():
+            self.add_time(i, j["Seconds"], j["Calls"])
+        for i, j in other["Counters"].items():
+            self.count(i, j)
+        for i, j in other.get("Cases", {}).items():
+            caseStats = self._get_case(i)
+            caseStats["ExpandedCodes"] = max(caseStats["ExpandedCodes"], j["ExpandedCodes"])
+            for k in ["Seconds", "Patients", "PatientsWithCodes", "AssociationsWithCodes"]:
+                caseStats[k] += j[k]
+            for k, l in j["Restrictions"].items():
+                caseStats["Restrictions"][k] = caseStats["Restrictions"].get(k, 0) + l
+            for k, l in j["Modes"].items():
+                modeStats = caseStats["Modes"].setdefault(k, {"Patients": 0, "Associations": 0})
+                modeStats["Patients"] += l["Patients"]
+                modeStats["Associations"] += l["Associations"]
+        if self.memory is not None and "Memory" in other:
+            self.memory.merge(other["Memory"])
+
+    def to_dict(self):
+        """Convert the statistics to a JSON serialisable dictionary.
+
+        :return:    The statistics in the format:
+                        {
+                            "Started": "YYYY-MM-DDTHH:MM:SS",
+                            "TotalSeconds": 0.0,
+                            "Timings": {"Stage1": {"Seconds": 0.0, "Calls": 0}, ...},
+                            "Counters": {"Counter1": 0, ...},
+                            "Cases": {"Case1": {...}, ...},
+                            "Memory": {...}
+                        }
+                    where "Cases" is only present when explaining and "Memory" is only present when recording memory
+                    usage. See write_explain_report for the format of the statistics for each case, and
+                    MemoryMonitor.to_dict for the format of the memory usage.
+        :rtype:     dict
+
+        """
+
+        statistics = {
+            "Started": self.started.isoformat(timespec="seconds"),
+            "TotalSeconds": time.perf_counter() - self.startTime,
+            "Timings": {i: {"Seconds": self.timings[i], "Calls": self.calls[i]} for i in sorted(self.timings)},
+            "Counters": {i: self.counters[i] for i in sorted(self.counters)}
+        }
+        if self.explain:
+            statistics["Cases"] = self.cases
+        if self.memory is not None:
+            statistics["Memory"] = self.memory.to_dict()
+        return statistics
+
+    def write_report(self, fileReport):
+        """Write the statistics out as a JSON report.
+
+        :param fileReport:  The location of the file to write the report to.
+        :type fileReport:   str
+
+        """
+
+        with open(fileReport, 'w') as fidReport:
+            json.dump(self.to_dict(), fidReport, indent=4)
+            fidReport.write('\n')
+
+    def write_explain_report(self, fileReport, caseNames):
+        """Write out the cost and selectivity of each case definition as a JSON report.
+
+        The report contains one entry per case definition (in the order they are output in) with the format:
+            {
+                "Case": "CaseName",
+                "ExpandedCodes": 0,  # Size of the case's code set once wildcards are expanded.
+                "Seconds": 0.0,  # Time spent selecting associations for the case over all patients.
+                "Patients": 0,  # Patients that the case was evaluated for.
+                "PatientsWithCodes": 0,  # Patients with an association with any of the case's codes.
+                "AssociationsWithCodes": 0,  # Associations with any of the case's codes.
+                "Restrictions": {"Date_1": 0, "Val1_1": 0, ...},  # Associations remaining after each restriction.
+                "Modes": {"all": {"Patients": 0, "Associations": 0}, ...}  # Patients and associations selected.
+            }
+
+        :param fileReport:  The location of the file to write the report to.
+        :type fileReport:   str
+        :param caseNames:   The names of the case definitions in the order they are output in.
+        :type caseNames:    list
+
+        """
+
+        with open(fileReport, 'w') as fidReport:
+            json.dump([dict(Case=i, **self._get_case(i)) for i in caseNames], fidReport, indent=4)
+            fidReport.write('\n')
+
+
+def timed_iterator(iterable, runStats, stage):
+    """Wrap an iterable so that the time spent fetching each item is recorded.
+
+    :param iterable:    The iterable to time the iteration of.
+    :type iterable:     iterable
+    :param runStats:    The statistics to record the time in.
+    :type runStats:     RunStatistics
+    :param stage:       The name of the stage to record the time under.
+    :type stage:        str
+    :return:            A generator of the items in the iterable.
+    :rtype:             generator
+
+    """
+
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            runStats.add_time(stage, time.perf_counter() - start, calls=0)
+            return
+        runStats.add_time(stage, time.perf_counter() - start)
+        yield item
@@ -0,0 +1,369 @@
+"""Split the patient data into shards by patient, extract each shard independently and merge the extracted data.
+
+Each patient is assigned to one of N shards by a stable hash of their ID (see shard_of), so that the same patient
+always ends up in the same shard regardless of the machine or Python process doing the sharding. The shards of
+FlatPatientData.tsv are written to FlatPatientData.shard0.tsv to FlatPatientData.shardN-1.tsv (see shard_files), and
+can be extracted in parallel processes (see extract_shards) or as separate runs of the extraction on batch nodes
+sharing a filesystem.
+
+The extracted data of the shards is combined with merge_outputs. By default the shard outputs are concatenated, with the
+copying done by the kernel (copy_file_range or sendfile) where possible. When the patients need to be in order of
+their IDs, the shard outputs are instead combined with a k-way merge.
+
+"""
+
+# Python imports.
+import argparse
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import zlib
+
+# User imports.
+from . import conf
+from . import extraction_plan
+from . import output_sinks
+from . import patient_extraction
+
+# Globals.
+LOGGER = logging.getLogger(__name__)
+MERGEABLE_SINKS = {"ndjson", "tsv"}  # The sinks whose outputs can be merged.
+COPY_SIZE = 1 << 30  # The maximum number of bytes to ask the kernel to copy at a time.
+
+
+def shard_of(patientID, numShards):
+    """Determine the shard that a patient belongs to.
+
+    Python's built in hash is randomised for each process, so a CRC32 checksum of the patient ID is used instead.
+
+    :param patientID:   The ID of the patient.
+    :type patientID:    str
+    :param numShards:   The number of shards.
+    :type numShards:    int
+    :return:            The index of the patient's shard.
+    :rtype:             int
+
+    """
+
+    return zlib.crc32(patientID.encode("utf-8")) % numShards
+
+
+def shard_files(fileOutput, numShards):
+    """Determine the locations of the shards of a flat file of patient data.
+
+    :param fileOutput:  The location of the flat file being sharded (e.g. FlatPatientData.tsv).
+    :type fileOutput:   str
+    :param numShards:   The number of shards.
+    :type numShards:    int
+    :return:            The location of each shard.
+    :rtype:             list
+
+    """
+
+    fileBase = fileOutput[:-len(".tsv")] if fileOutput.endswith(".tsv") else fileOutput
+    return ["{:s}.shard{:d}.tsv".format(fileBase, i) for i in range(numShards)]
+
+
+def shard_file(filePatientData, numShards, fileOutput=None):
+    """Split a flat file of patient data (with or without summaries) into shards.
+
+    The lines are copied to their shards without being decoded.
+
+    :param filePatientData: The location of the flat file of patient data.
+    :type filePatientData:  str
+    :param numShards:       The number of shards.
+    :type numShards:        int
+    :param fileOutput:      The location used to name the shards (see shard_files). Defaults to the location of the
+                                flat file.
+    :type fileOutput:       str | None
+    :return:                The location of each shard.
+    :rtype:                 list
+
+    """
+
+    fileShards = shard_files(fileOutput or filePatientData, numShards)
+    fidShards = []
+    try:
+        for i in fileShards:
+            fidShards.append(open(i, 'w'))
+        with open(filePatientData, 'r') as fidPatientData:
+            for line in fidPatientData:
+                fidShards[shard_of(line.partition('\t')[0], numShards)].write(line)
+    finally:
+        for i in fidShards:
+            i.close()
+    return fileShards
+
+
+def extract_shards(fileCaseDefs, dirOutput, fileShards, fileCodeDescriptions, filePatientSubset, processes=1,
+                   sink="tsv", sortedOrder=False, useCodeCache=True, prefixMatching=False, **extractionArgs):
+    """Extract data about patients from each shard of the patient data, and merge the extracted data.
+
+    The case definitions are compiled into an extraction plan once, and each shard is then extracted from the plan into
+    its own subdirectory of the output directory (Shard0, Shard1, ...), along with its own run report. The merged data
+    is written to the output directory under the usual name of the sink's output (e.g. DataExtraction.tsv).
+
+    :param fileCaseDefs:            The location of the input file containing the case definitions, or of an
+                                        extraction plan compiled from them.
+    :type fileCaseDefs:             str
+    :param dirOutput:               The location of the directory to write the program output to.
+    :type dirOutput:                str
+    :param fileShards:              The locations of the shards of the patient data.
+    :type fileShards:               list
+    :param fileCodeDescriptions:    The location of the file containing the mapping from codes to their descriptions.
+    :type fileCodeDescriptions:     str
+    :param filePatientSubset:       The location of the file containing the IDs of the subset of patients to use.
+    :type filePatientSubset:        str
+    :param processes:               The number of shards to extract at once, each in its own process.
+    :type processes:                int
+    :param sink:                    The name of the sink to write the extracted data with (one of MERGEABLE_SINKS).
+    :type sink:                     str
+    :param sortedOrder:             Whether the merged data should have the patients in order of their IDs (see
+                                        merge_outputs). Otherwise the shards' data is concatenated in shard order.
+    :type sortedOrder:              bool
+    :param useCodeCache:            Whether to use a cached, indexed copy of the code descriptions file.
+    :type useCodeCache:             bool
+    :param prefixMatching:          Whether wildcard codes should be matched against the codes in each record.
+    :type prefixMatching:           bool
+    :param extractionArgs:          Further keyword arguments to pass to the extraction of each shard (see
+                                        patient_extraction.main).
+    :type extractionArgs:           dict
+    :return:                        The location of the merged data.
+    :rtype:                         str
+
+    """
+
+    if sink not in MERGEABLE_SINKS:
+        raise ValueError("The output of the {:s} sink can not be merged.".format(sink))
+
+    # Compile the case definitions once rather than once per shard.
+    filePlan = fileCaseDefs
+    if not extraction_plan.is_plan_file(fileCaseDefs):
+        annotatedCaseDefsName = os.path.split(fileCaseDefs)[1]
+        annotatedCaseDefsName = \
+            annotatedCaseDefsName.split('.')[0] + "_Annotated." + annotatedCaseDefsName.split('.')[1]
+        plan = extraction_plan.compile_plan(fileCaseDefs, fileCodeDescriptions,
+                                            os.path.join(dirOutput, annotatedCaseDefsName), useCodeCache,
+                                            prefixMatching=prefixMatching)
+        filePlan = os.path.join(dirOutput, "ExtractionPlan.json")
+        extraction_plan.save_plan(plan, filePlan)
+
+    # Extract each shard into its own directory.
+    dirShards = [os.path.join(dirOutput, "Shard{:d}".format(i)) for i in range(len(fileShards))]
+    shardArgs = [(filePlan, i, j, fileCodeDescriptions, filePatientSubset) for i, j in zip(dirShards, fileShards)]
+    shardKwargs = dict(extractionArgs, sink=sink, prefixMatching=prefixMatching)
+    for i in dirShards:
+        os.makedirs(i, exist_ok=True)
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            results = [pool.apply_async(_extract_shard, (conf.isLogging, i, shardKwargs)) for i in shardArgs]
+            for i in results:
+                i.get()
+    else:
+        for i in shardArgs:
+            patient_extraction.main(*i, **shardKwargs)
+    if conf.isLogging:
+        LOGGER.info("Extracted {:d} shards.".format(len(fileShards)))
+
+    # Merge the extracted data of the shards.
+    fileName = output_sinks.SINKS[sink].fileName
+    fileMerged = os.path.join(dirOutput, fileName)
+    merge_outputs([os.path.join(i, fileName) for i in dirShards], fileMerged, sortedOrder, hasHeader=sink == "tsv")
+    return fileMerged
+
+
+def merge_outputs(fileInputs, fileMerged, sortedOrder=False, hasHeader=True):
+    """Merge the extracted data of a number of shards.
+
+    When the order of the patients is not needed, the data of each shard after its header is appended to the merged
+    file using copy_file_range (or sendfile where this is unavailable), so that the data is copied within the kernel
+    rather than through Python. Otherwise, the shards are combined with a k-way merge on the patient IDs (compared as
+    numbers when they are numeric), which needs the patients of each shard to already be in order of their IDs, as they
+    are when the flat file is.
+
+    :param fileInputs:  The locations of the extracted data of the shards, each a tab separated or newline delimited
+                            JSON file with one line per patient.
+    :type fileInputs:   list
+    :param fileMerged:  The location to write the merged data to.
+    :type fileMerged:   str
+    :param sortedOrder: Whether the merged data should have the patients in order of their IDs.
+    :type sortedOrder:  bool
+    :param hasHeader:   Whether the files start with a header line (written once to the merged file). Files without
+                            a header are taken to be newline delimited JSON.
+    :type hasHeader:    bool
+
+    """
+
+    if sortedOrder:
+        fidInputs = [open(i, 'r') for i in fileInputs]
+        try:
+            with open(fileMerged, 'w') as fidMerged:
+                if hasHeader:
+                    headers = {i.readline() for i in fidInputs}
+                    if len(headers) > 1:
+                        raise ValueError("The shards to merge have different headers.")
+                    fidMerged.writelines(headers)
+                key = _tsv_patient_key if hasHeader else _ndjson_patient_key
+                fidMerged.writelines(heapq.merge(*[_check_sorted(i, j, key) for i, j in zip(fidInputs, fileInputs)],
+                                                 key=key))
+        finally:
+            for i in fidInputs:
+                i.close()
+        return
+
+    with open(fileMerged, 'wb') as fidMerged:
+        header = None
+        for fileInput in fileInputs:
+            with open(fileInput, 'rb') as fidInput:
+                offset = 0
+                if hasHeader:
+                    shardHeader = fidInput.readline()
+                    if header is None:
+                        header = shardHeader
+                        fidMerged.write(header)
+                        fidMerged.flush()
+                    elif shardHeader != header:
+                        raise ValueError("The shard {:s} has a different header to the previous shards.".format(
+                            fileInput))
+                    offset = len(shardHeader)
+                _copy_range(fidInput, fidMerged, offset, os.fstat(fidInput.fileno()).st_size - offset)
+
+
+def _copy_range(fidInput, fidOutput, offset, count):
+    """Append a range of bytes from one file to another, with the copying done by the kernel where possible.
+
+    :param fidInput:    The file to copy from, opened in binary mode.
+    :type fidInput:     file
+    :param fidOutput:   The file to append to, opened in binary mode and flushed.
+    :type fidOutput:    file
+    :param offset:      The offset of the start of the range in the input file.
+    :type offset:       int
+    :param count:       The number of bytes to copy.
+    :type count:        int
+
+    """
+
+    fdInput = fidInput.fileno()
+    fdOutput = fidOutput.fileno()
+    for copier in [getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)]:
+        if copier is None:
+            continue
+        try:
+            while count > 0:
+                if copier is os.sendfile:
+                    copied = os.sendfile(fdOutput, fdInput, offset, min(count, COPY_SIZE))
+                else:
+                    copied = os.copy_file_range(fdInput, fdOutput, min(count, COPY_SIZE), offset)
+                if copied == 0:
+                    break
+                offset += copied
+                count -= copied
+            return
+        except OSError:
+            # The copy is not supported between these files (e.g. they are on different filesystems), so carry on
+            # from where it stopped with the next way of copying.
+            pass
+
+    # Fall back to copying through Python.
+    fidInput.seek(offset)
+    fidOutput.seek(0, os.SEEK_END)
+    while count > 0:
+        chunk = fidInput.read(min(count, shutil.COPY_BUFSIZE))
+        if not chunk:
+            break
+        fidOutput.write(chunk)
+        count -= len(chunk)
+    fidOutput.flush()
+
+
+def _patient_key(patientID):
+    """Create the key to order a patient by their ID with, ordering numeric IDs numerically (before any others).
+
+    :param patientID:   The ID of the patient.
+    :type patientID:    str
+    :return:            The key.
+    :rtype:             tuple
+
+    """
+
+    return (0, int(patientID), '') if patientID.isdigit() else (1, 0, patientID)
+
+
+def _tsv_patient_key(line):
+    """Create the key to order a line of tab separated extracted data with (see _patient_key)."""
+
+    return _patient_key(line.partition('\t')[0])
+
+
+def _ndjson_patient_key(line):
+    """Create the key to order a line of newline delimited JSON extracted data with (see _patient_key)."""
+
+    return _patient_key(json.loads(line)["PatientID"])
+
+
+def _check_sorted(lines, fileInput, key):
+    """Generate lines of extracted data, checking that their patients are in order.
+
+    :param lines:       The lines.
+    :type lines:        iterable
+    :param fileInput:   The location of the file the lines are from.
+    :type fileInput:    str
+    :param key:         The function giving the key to order a line by.
+    :type key:          function
+    :return:            A generator of the lines.
+    :rtype:             generator
+
+    """
+
+    previousKey = None
+    for line in lines:
+        currentKey = key(line)
+        if previousKey is not None and currentKey < previousKey:
+            raise ValueError("The patients in {:s} are not in order of their IDs, and so can not be merged in "
+                             "order.".format(fileInput))
+        previousKey = currentKey
+        yield line
+
+
+def _extract_shard(isLogging, shardArgs, shardKwargs):
+    """Extract a shard of the patient data in a worker process.
+
+    :param isLogging:   Whether logging is turned on.
+    :type isLogging:    bool
+    :param shardArgs:   The positional arguments for patient_extraction.main.
+    :type shardArgs:    tuple
+    :param shardKwargs: The keyword arguments for patient_extraction.main.
+    :type shardKwargs:  dict
+
+    """
+
+    conf.init()
+    conf.control_logging(isLogging)
+    patient_extraction.main(*shardArgs, **shardKwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shard a flat file of patient data, or merge the extracted data of "
+                                                 "its shards.")
+    subparsers = parser.add_subparsers(dest="command")
+    parserShard = subparsers.add_parser("shard", help="Split a flat file of patient data into shards by patient.")
+    parserShard.add_argument("input", help="The location of the flat file of patient data.", type=str)
+    parserShard.add_argument("shards", help="The number of shards.", type=int)
+    parserMerge = subparsers.add_parser("merge", help="Merge the extracted data of the shards.")
+    parserMerge.add_argument("output", help="The location to write the merged data to.", type=str)
+    parserMerge.add_argument("inputs", help="The locations of the extracted data of the shards.", nargs='+', type=str)
+    parserMerge.add_argument("--ndjson", action="store_true",
+                             help="Whether the extracted data is newline delimited JSON rather than tab separated.")
+    parserMerge.add_argument("--sorted", action="store_true",
+                             help="Whether to merge the patients in order of their IDs rather than concatenating the "
+                                  "shards.")
+    args = parser.parse_args()
+    if args.command == "shard":
+        shard_file(args.input, args.shards)
+    elif args.command == "merge":
+        merge_outputs(args.inputs, args.output, args.sorted, hasHeader=not args.ndjson)
+    else:
+        parser.print_help()
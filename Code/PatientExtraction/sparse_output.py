@@ -0,0 +1,149 @@
+"""Write the extracted data in a sparse format, and convert it back to the dense tab separated format.
+
+Most patients do not match most case definitions, and so most values in the dense output are the value output for a
+case with no associations (e.g. '' or '0'). The sparse format only records the values that differ from these empty
+values. It consists of three files in the output directory:
+    DataExtraction.columns.tsv - A header line followed by one line per column of the dense output (excluding the
+        patient ID column) giving the index of the column (starting at 1), its name and its empty value.
+    DataExtraction.rows.txt - The ID of each extracted patient in the order they were extracted.
+    DataExtraction.sparse.tsv - One line per non-empty value giving the patient ID, the column index and the value.
+        The lines are grouped by patient in the same order as the rows file, and in column order for each patient.
+
+"""
+
+# Python imports.
+import argparse
+import os
+
+# Globals.
+FILE_COLUMNS = "DataExtraction.columns.tsv"  # The file recording the columns of the extraction.
+FILE_ROWS = "DataExtraction.rows.txt"  # The file recording the patients extracted.
+FILE_VALUES = "DataExtraction.sparse.tsv"  # The file recording the non-empty values extracted.
+
+
+class SparseWriter(object):
+    """Write the patients' extracted values to the files of the sparse format.
+
+    The writer accepts the (patientID, values) entries created by format_patient through its writelines method, and so
+    can be used in place of the dense output file (e.g. by pipeline.run).
+
+    """
+
+    def __init__(self, dirOutput, header, emptyRow):
+        """Initialise the writer, and write the columns file.
+
+        :param dirOutput:   The directory to write the files to.
+        :type dirOutput:    str
+        :param header:      The header of the extraction (i.e. "PatientID" followed by the name of each column).
+        :type header:       list
+        :param emptyRow:    The empty value of each column (excluding the patient ID column).
+        :type emptyRow:     list
+
+        """
+
+        with open(os.path.join(dirOutput, FILE_COLUMNS), 'w') as fidColumns:
+            fidColumns.write("Index\tColumn\tEmptyValue\n")
+            for index, (column, emptyValue) in enumerate(zip(header[1:], emptyRow)):
+                fidColumns.write("{:d}\t{:s}\t{:s}\n".format(index + 1, column, emptyValue))
+        self.fidRows = open(os.path.join(dirOutput, FILE_ROWS), 'w')
+        self.fidValues = open(os.path.join(dirOutput, FILE_VALUES), 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def writelines(self, entries):
+        """Write out the extracted values of a batch of patients.
+
+        :param entries: The (patientID, values) entries created by format_patient.
+        :type entries:  list
+
+        """
+
+        self.fidRows.writelines(["{:s}\n".format(i[0]) for i in entries])
+        self.fidValues.writelines([i[1] for i in entries])
+
+    def flush(self):
+        """Flush the rows and values files."""
+
+        self.fidRows.flush()
+        self.fidValues.flush()
+
+    def close(self):
+        """Close the rows and values files."""
+
+        self.fidRows.close()
+        self.fidValues.close()
+
+
+def format_patient(patientID, values, emptyRow):
+    """Format a patient's extracted values in the sparse format.
+
+    :param patientID:   The ID of the patient.
+    :type patientID:    str
+    :param values:      The patient's extracted values, one per column.
+    :type values:       list
+    :param emptyRow:    The empty value of each column.
+    :type emptyRow:     list
+    :return:            The patient's ID and the lines of the values file for the patient's non-empty values.
+    :rtype:             tuple
+
+    """
+
+    return patientID, ''.join(["{:s}\t{:d}\t{:s}\n".format(patientID, index + 1, value)
+                               for index, (value, emptyValue) in enumerate(zip(values, emptyRow))
+                               if value != emptyValue])
+
+
+def to_dense(dirSparse, fileDense):
+    """Convert extracted data in the sparse format to the dense tab separated format.
+
+    :param dirSparse:   The directory containing the files of the sparse format.
+    :type dirSparse:    str
+    :param fileDense:   The location to write the dense data to.
+    :type fileDense:    str
+
+    """
+
+    # Load the columns.
+    with open(os.path.join(dirSparse, FILE_COLUMNS), 'r') as fidColumns:
+        fidColumns.readline()  # Skip the header line.
+        columns = [line.rstrip('\n').split('\t') for line in fidColumns]
+    header = ["PatientID"] + [i[1] for i in columns]
+    emptyRow = [i[2] for i in columns]
+
+    with open(os.path.join(dirSparse, FILE_ROWS), 'r') as fidRows, \
+            open(os.path.join(dirSparse, FILE_VALUES), 'r') as fidValues, open(fileDense, 'w') as fidDense:
+        fidDense.write("{:s}\n".format('\t'.join(header)))
+
+        # The values are grouped by patient in the same order as the rows, so the two files are merged in one pass.
+        valueLine = fidValues.readline()
+        for patientID in fidRows:
+            patientID = patientID.rstrip('\n')
+            values = list(emptyRow)
+            while valueLine:
+                valuePatientID, index, value = valueLine.rstrip('\n').split('\t', 2)
+                if valuePatientID != patientID:
+                    break
+                values[int(index) - 1] = value
+                valueLine = fidValues.readline()
+            fidDense.write("{:s}\t{:s}\n".format(patientID, '\t'.join(values)))
+        if valueLine:
+            raise ValueError("The sparse values file contains values for patient {:s} that are not in the order of "
+                             "the rows file.".format(valueLine.split('\t', 1)[0]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert extracted data in the sparse format to the dense format.")
+    parser.add_argument("input",
+                        help="The location of the directory containing the extracted data in the sparse format.",
+                        type=str)
+    parser.add_argument("output",
+                        help="The location of the file to write the dense data to. Default: DataExtraction.tsv in the "
+                             "input directory.",
+                        nargs='?',
+                        type=str)
+    args = parser.parse_args()
+    to_dense(args.input, args.output or os.path.join(args.input, "DataExtraction.tsv"))
@@ -0,0 +1,282 @@
+"""Write and read the patient data in a split layout, with the associations' dates, values and text in separate files.
+
+Most case definitions only need the dates of the associations (e.g. those using the exists, date, code and count
+outputs without value restrictions), and no case definition needs the free text. The split layout therefore stores the
+flat file of patient data FlatPatientData.tsv as three files with one line per patient in the same order:
+    FlatPatientData.dates.tsv - The patient ID and a JSON object mapping each code to the list of the YYYY-MM-DD dates
+        of its associations in chronological order (optionally followed by the summaries of the codes, see
+        record_summary).
+    FlatPatientData.values.tsv - The patient ID and a JSON object mapping each code to the list of the Val1 values and
+        the list of the Val2 values of its associations, i.e. {"Code": [[Val1, ...], [Val2, ...]]}.
+    FlatPatientData.text.tsv - The patient ID and a JSON object mapping each code to the list of the text of its
+        associations.
+The extraction is given the dates file, and only reads the values file when a case definition needs the values (see
+needs_values). The text file is never read.
+
+"""
+
+# Python imports.
+import argparse
+import json
+import os
+import re
+
+# User imports.
+from . import association
+from . import parse_case_definitions
+
+# Globals.
+FILE_SUFFIXES = {"Dates": ".dates.tsv", "Values": ".values.tsv", "Text": ".text.tsv"}  # The suffix of each file.
+DATE_OUTPUTS = {"code", "count", "date", "exists"}  # The outputs that only need the dates of the associations.
+DATE_MODE = re.compile(r"(all|earliest|latest|(first|last|nth)\d+)$")  # The modes only needing the dates.
+
+
+def split_files(fileOutput):
+    """Determine the locations of the files of a split layout.
+
+    :param fileOutput:  The location of the flat file that the layout stores (e.g. FlatPatientData.tsv).
+    :type fileOutput:   str
+    :return:            The location of the dates, values and text files, indexed by Dates, Values and Text.
+    :rtype:             dict
+
+    """
+
+    fileBase = fileOutput[:-len(".tsv")] if fileOutput.endswith(".tsv") else fileOutput
+    return {i: fileBase + j for i, j in FILE_SUFFIXES.items()}
+
+
+def is_split(filePatientData):
+    """Determine whether a file of patient data is the dates file of a split layout.
+
+    :param filePatientData: The location of the file of patient data.
+    :type filePatientData:  str
+    :return:                Whether the file is the dates file of a split layout.
+    :rtype:                 bool
+
+    """
+
+    return filePatientData.endswith(FILE_SUFFIXES["Dates"])
+
+
+def write_patient(patientID, patientData, files, summaryText=None):
+    """Append a patient's medical history to the files of a split layout.
+
+    :param patientID:   The ID of the patient.
+    :type patientID:    str
+    :param patientData: The patient's medical history, mapping each code to its chronologically sorted associations
+                            in the format of the flat file (i.e. dictionaries with a YYYY-MM-DD date).
+    :type patientData:  dict
+    :param files:       The locations of the files of the layout (see split_files).
+    :type files:        dict
+    :param summaryText: The JSON encoded summaries of the patient's codes to write after the dates (None to not write
+                            any summaries).
+    :type summaryText:  str | None
+
+    """
+
+    dates = {i: [k["Date"] for k in j] for i, j in patientData.items()}
+    values = {i: [[k.get("Val1", 0) for k in j], [k.get("Val2", 0) for k in j]] for i, j in patientData.items()}
+    texts = {i: [k.get("Text", "") for k in j] for i, j in patientData.items()}
+    with open(files["Dates"], 'a') as fidDates:
+        if summaryText is None:
+            fidDates.write("{0:s}\t{1:s}\n".format(patientID, json.dumps(dates)))
+        else:
+            fidDates.write("{0:s}\t{1:s}\t{2:s}\n".format(patientID, json.dumps(dates), summaryText))
+    with open(files["Values"], 'a') as fidValues:
+        fidValues.write("{0:s}\t{1:s}\n".format(patientID, json.dumps(values)))
+    with open(files["Text"], 'a') as fidText:
+        fidText.write("{0:s}\t{1:s}\n".format(patientID, json.dumps(texts)))
+
+
+def split_file(filePatientData, fileOutput=None):
+    """Write a flat file of patient data (with or without summaries) in the split layout.
+
+    :param filePatientData: The location of the flat file of patient data.
+    :type filePatientData:  str
+    :param fileOutput:      The location used to name the files of the layout (see split_files). Defaults to the
+                                location of the flat file.
+    :type fileOutput:       str | None
+    :return:                The locations of the files of the layout.
+    :rtype:                 dict
+
+    """
+
+    files = split_files(fileOutput or filePatientData)
+    for i in files.values():
+        if os.path.isfile(i):
+            os.remove(i)
+    with open(filePatientData, 'r') as fidPatientData:
+        for line in fidPatientData:
+            chunks = line.rstrip('\n').split('\t')
+            write_patient(chunks[0], json.loads(chunks[1]), files, chunks[2] if len(chunks) > 2 else None)
+    return files
+
+
+def needs_values(caseDefinitions, caseNames):
+    """Determine whether the values of the associations are needed to extract a set of case definitions.
+
+    :param caseDefinitions: The case definitions.
+    :type caseDefinitions:  dict
+    :param caseNames:       The names of the case definitions to extract.
+    :type caseNames:        list
+    :return:                Whether any case (or a case referred to by their relative date restrictions) has a value
+                                restriction, or uses a mode or output needing the values.
+    :rtype:                 bool
+
+    """
+
+    for i in parse_case_definitions.evaluation_order(caseDefinitions, caseNames):
+        restrictions = caseDefinitions[i]["Restrictions"]
+        if restrictions["Val1"] or restrictions["Val2"] or not DATE_OUTPUTS.issuperset(caseDefinitions[i]["Outputs"]) \
+                or not all(DATE_MODE.match(j) for j in caseDefinitions[i]["Modes"]):
+            return True
+    return False
+
+
+def open_patient_data(filePatientData, readValues=True):
+    """Open a file of patient data for reading, using a SplitReader if it is the dates file of a split layout.
+
+    :param filePatientData: The location of the flat file of patient data, or of the dates file of a split layout.
+    :type filePatientData:  str
+    :param readValues:      Whether to read the values file of a split layout.
+    :type readValues:       bool
+    :return:                The opened file or reader.
+    :rtype:                 file | SplitReader
+
+    """
+
+    if is_split(filePatientData):
+        return SplitReader(filePatientData, readValues)
+    return open(filePatientData, 'r')
+
+
+def input_size(filePatientData, readValues=True):
+    """Determine the number of bytes that reading a file of patient data reads.
+
+    :param filePatientData: The location of the flat file of patient data, or of the dates file of a split layout.
+    :type filePatientData:  str
+    :param readValues:      Whether the values file of a split layout is read.
+    :type readValues:       bool
+    :return:                The total size of the files read.
+    :rtype:                 int
+
+    """
+
+    size = os.path.getsize(filePatientData)
+    if is_split(filePatientData) and readValues:
+        size += os.path.getsize(filePatientData[:-len(FILE_SUFFIXES["Dates"])] + FILE_SUFFIXES["Values"])
+    return size
+
+
+def convert_record(columns):
+    """Convert a record read from a split layout to a record of associations (see association.convert_columns).
+
+    :param columns:     The decoded record, i.e. a list containing the mapping from each code to its dates, followed
+                            by the mapping from each code to its values if they were read.
+    :type columns:      list
+    :return:            The patient's record, mapping each code to its associations.
+    :rtype:             dict
+
+    """
+
+    if len(columns) == 1:
+        return {i: association.convert_columns(j) for i, j in columns[0].items()}
+    valuesRecord = columns[1]
+    return {i: association.convert_columns(j, *valuesRecord[i]) for i, j in columns[0].items()}
+
+
+class SplitReader(object):
+    """Read the patients of a split layout as lines that the extraction can process in place of the flat file's lines.
+
+    Each line has the patient ID followed by a JSON list holding the record of the patient's dates, and then the
+    record of their values when these are being read (see convert_record). Any summaries of the patient's codes follow
+    this as they do in the flat file. As with a file, the reader can be iterated over or read in batches with
+    readlines.
+
+    """
+
+    def __init__(self, fileDates, readValues=True):
+        """Open the files of the layout.
+
+        :param fileDates:   The location of the dates file of the layout.
+        :type fileDates:    str
+        :param readValues:  Whether to read the values file.
+        :type readValues:   bool
+
+        """
+
+        self.files = split_files(fileDates[:-len(FILE_SUFFIXES["Dates"])] + ".tsv")
+        self.fidDates = open(self.files["Dates"], 'r')
+        self.fidValues = open(self.files["Values"], 'r') if readValues else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def __iter__(self):
+        for line in self.fidDates:
+            yield self._join(line)
+
+    def readlines(self, hint=-1):
+        """Read a batch of lines.
+
+        :param hint:    The approximate number of characters of the dates file to read (-1 to read all lines).
+        :type hint:     int
+        :return:        The lines.
+        :rtype:         list
+
+        """
+
+        return [self._join(i) for i in self.fidDates.readlines(hint)]
+
+    def bytes_read(self):
+        """Determine the number of bytes read from the files of the layout (see progress.byte_position).
+
+        :return:    The total position of the files being read.
+        :rtype:     int
+
+        """
+
+        return self.fidDates.buffer.tell() + (self.fidValues.buffer.tell() if self.fidValues else 0)
+
+    def close(self):
+        """Close the files of the layout."""
+
+        self.fidDates.close()
+        if self.fidValues:
+            self.fidValues.close()
+
+    def _join(self, datesLine):
+        """Join a patient's line of the dates file with their line of the values file (when these are being read).
+
+        :param datesLine:   The patient's line of the dates file.
+        :type datesLine:    str
+        :return:            The line for the extraction.
+        :rtype:             str
+
+        """
+
+        patientID, _, datesText = datesLine.rstrip('\n').partition('\t')
+        summaryText = ''
+        summaryStart = datesText.rfind('\t')
+        if summaryStart != -1:
+            summaryText = datesText[summaryStart:]
+            datesText = datesText[:summaryStart]
+        if self.fidValues is None:
+            return "{:s}\t[{:s}]{:s}\n".format(patientID, datesText, summaryText)
+
+        valuesID, _, valuesText = self.fidValues.readline().rstrip('\n').partition('\t')
+        if valuesID != patientID:
+            raise ValueError("The values file {:s} has patient {:s} where patient {:s} was expected.".format(
+                self.files["Values"], valuesID, patientID))
+        return "{:s}\t[{:s}, {:s}]{:s}\n".format(patientID, datesText, valuesText, summaryText)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a flat file of patient data in the split layout, with the "
+                                                 "dates, values and text of the associations in separate files.")
+    parser.add_argument("input", help="The location of the flat file of patient data.", type=str)
+    args = parser.parse_args()
+    split_file(args.input)
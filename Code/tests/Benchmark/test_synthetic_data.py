@@ -0,0 +1,48 @@
+"""Tests for the synthetic_data module."""
+
+# Python imports.
+import json
+import os
+import unittest
+
+# User imports.
+from Benchmark import synthetic_data
+from GenerateDataFiles import generate_flat_files
+
+
+class TestSyntheticData(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, os.pardir, "PatientExtraction", "TestData",
+                                                     "TempData", "SyntheticData"))
+
+    def test_generation(self):
+        # Generate the same data set twice and check that the seed makes it reproducible.
+        journals = []
+        for i in ["A", "B"]:
+            files = synthetic_data.main(os.path.join(self.dirOutput, i), numPatients=50, numCodes=200,
+                                        codesPerPatient=5, associationsPerCode=2, edgeCaseRate=0.2, seed=1)
+            with open(files["Journal"], 'r') as fidJournal:
+                journals.append(fidJournal.read())
+        self.assertEqual(journals[0], journals[1])
+        self.assertIn(",v=", journals[0])  # Check that edge cases were generated.
+
+        # Check that the journal can be converted to a flat file with one line per patient.
+        fileFlatData = os.path.join(self.dirOutput, "A", "FlatPatientData.tsv")
+        if os.path.isfile(fileFlatData):
+            os.remove(fileFlatData)
+        generate_flat_files.main(files["Journal"], fileFlatData)
+        with open(fileFlatData, 'r') as fidFlatData:
+            patients = [i.split('\t') for i in fidFlatData]
+        self.assertEqual([i[0] for i in patients], [str(i) for i in range(1, 51)])
+
+        # Check that all codes in the flat file are in the coding dictionary.
+        with open(files["Coding"], 'r') as fidCoding:
+            codes = {i.split('\t')[0] for i in fidCoding}
+        self.assertEqual(len(codes), 200)
+        for i in patients:
+            self.assertTrue(set(json.loads(i[1])) <= codes)
@@ -7,7 +7,9 @@ import os
 import unittest
 
 # User imports.
+from PatientExtraction import association
 from PatientExtraction import conf
+from PatientExtraction.parse_case_definitions import create_date_range
 from PatientExtraction.patient_extraction import apply_restrictions
 from PatientExtraction import restriction_comparator_generators
 
@@ -31,23 +33,27 @@ class TestRestrictionApplication(unittest.TestCase):
         fileData = os.path.join(dirData, "ApplyRestrictions", "Data.json")
         fileOutput = os.path.join(dirData, "ApplyRestrictions", "ExpectedOutput.json")
 
-        # Load the patient data (replacing all dates in their string format with datetime.datetime objects) and the
-        # restriction information (replacing all value by restriction comparison functions).
+        # Load the patient data (converting all associations to association objects) and the restriction information
+        # (replacing all value by restriction comparison functions).
         fidData = open(fileData, 'r')
         inputData = json.load(fidData)
         fidData.close()
         cls.medicalRecords = {}
         cls.restrictions = {}
+        cls.dateRanges = {}
         for i in inputData:
             # Process the patient medical record data.
-            for j in inputData[i]["Record"]:
-                for k in inputData[i]["Record"][j]:
-                    k["Date"] = datetime.datetime.strptime(k["Date"], "%Y-%m-%d")
+            association.convert_record(inputData[i]["Record"])
             cls.medicalRecords[i] = inputData[i]["Record"]
 
             # Save the restrictions.
             cls.restrictions[i] = inputData[i]["Restrictions"]
 
+            # Create the interval covered by the date restrictions.
+            cls.dateRanges[i] = create_date_range(
+                [[j[0], j[1] if len(j) > 1 else None] for j in cls.restrictions[i]["Date"]]
+            )
+
             # Create date comparisons.
             cls.restrictions[i]["Date"] = [
                 [datetime.datetime.strptime(k, "%Y-%m-%d") for k in j] for j in cls.restrictions[i]["Date"]
@@ -68,15 +74,12 @@ class TestRestrictionApplication(unittest.TestCase):
                 for j in cls.restrictions[i]["Val2"]
             ]
 
-        # Load the expected results of performing the selections (replacing all dates in their string format with
-        # datetime.datetime objects).
+        # Load the expected results of performing the selections (converting all associations to association objects).
         fidOutput = open(fileOutput, 'r')
         cls.expectedOutput = json.load(fidOutput)
         fidOutput.close()
         for i in cls.expectedOutput:
-            for j in cls.expectedOutput[i]:
-                for k in cls.expectedOutput[i][j]:
-                    k["Date"] = datetime.datetime.strptime(k["Date"], "%Y-%m-%d")
+            association.convert_record(cls.expectedOutput[i])
 
     def test_apply_restrictions(self):
         # Loop through all patients and test that the result of applying the restriction to their record is correct.
@@ -90,3 +93,45 @@ class TestRestrictionApplication(unittest.TestCase):
 
             # Check that the result is as expected.
             self.assertEqual(restrictedRecord, self.expectedOutput[i])
+
+            # Check that the number of associations remaining after each restriction can be recorded.
+            restrictionCounts = []
+            apply_restrictions(patientRecord, patientRestrictions, restrictionCounts)
+            numRestrictions = sum(map(len, patientRestrictions.values()))
+            self.assertEqual(len(restrictionCounts), numRestrictions)
+            if numRestrictions:
+                self.assertEqual(restrictionCounts[-1][1], sum(map(len, self.expectedOutput[i].values())))
+
+    def test_apply_date_range(self):
+        # Check that bisecting each code's associations on the date range gives the same result as applying each date
+        # restriction to every association.
+        for i in self.medicalRecords:
+            patientRecord = self.medicalRecords[i]
+            patientRestrictions = self.restrictions[i]
+            restrictedRecord = apply_restrictions(patientRecord, patientRestrictions, dateRange=self.dateRanges[i])
+            self.assertEqual(restrictedRecord, self.expectedOutput[i])
+
+            # Check that the date restrictions are recorded as a single restriction.
+            restrictionCounts = []
+            apply_restrictions(patientRecord, patientRestrictions, restrictionCounts, self.dateRanges[i])
+            numRestrictions = len(patientRestrictions["Val1"]) + len(patientRestrictions["Val2"])
+            numRestrictions += self.dateRanges[i] is not None
+            self.assertEqual(len(restrictionCounts), numRestrictions)
+
+    def test_create_date_range(self):
+        # Check that overlapping date restrictions are intersected.
+        self.assertIsNone(create_date_range([]))
+        self.assertEqual(
+            create_date_range([["2000-01-01", "2010-12-31"], ["2005-06-01", None], ["1990-01-01", "2008-01-01"]]),
+            (datetime.datetime(2005, 6, 1), datetime.datetime(2008, 1, 1))
+        )
+        startDate, endDate = create_date_range([["2000-01-01", None]])
+        self.assertEqual(startDate, datetime.datetime(2000, 1, 1))
+        self.assertLessEqual(endDate, datetime.datetime.now())
+        self.assertGreater(endDate, datetime.datetime(2020, 1, 1))
+
+        # Check that disjoint date restrictions leave no associations.
+        dateRange = create_date_range([["2000-01-01", "2001-01-01"], ["2002-01-01", "2003-01-01"]])
+        patientRecord = {"A": [association.Association(datetime.datetime(k, 6, 1)) for k in range(1998, 2005)]}
+        self.assertEqual(apply_restrictions(patientRecord, {"Date": [], "Val1": [], "Val2": []}, dateRange=dateRange),
+                         {})
@@ -0,0 +1,114 @@
+"""Tests for the association module."""
+
+# Python imports.
+import bisect
+import datetime
+import json
+import os
+import pickle
+import unittest
+import unittest.mock
+
+# User imports.
+from PatientExtraction import annotate_case_definitions
+from PatientExtraction import association
+from PatientExtraction import conf
+from PatientExtraction import patient_extraction
+
+
+class TestAssociation(unittest.TestCase):
+
+    def test_from_dict(self):
+        # String and datetime dates should both be accepted, and missing values given their defaults.
+        expected = association.Association(datetime.datetime(2001, 7, 24), 130.0, 80.0, "BP")
+        self.assertEqual(association.from_dict({"Date": "2001-07-24", "Val1": 130.0, "Val2": 80.0, "Text": "BP"}),
+                         expected)
+        self.assertEqual(association.from_dict(expected.to_dict()), expected)
+        self.assertEqual(association.from_dict({"Date": "2001-07-24"}),
+                         association.Association(datetime.datetime(2001, 7, 24), 0, 0, ""))
+        self.assertNotEqual(association.from_dict({"Date": "2001-07-24", "Val1": 1}),
+                            association.from_dict({"Date": "2001-07-24"}))
+
+        # Associations should not have a per-object dictionary.
+        self.assertFalse(hasattr(expected, "__dict__"))
+        self.assertEqual(pickle.loads(pickle.dumps(expected)), expected)
+
+    def test_convert_record(self):
+        record = json.loads('{"A": [{"Date": "2001-07-24", "Val1": 1.5, "Val2": 0.0, "Text": "Some text"}, '
+                            '{"Date": "2005-06-14", "Val1": 2.5, "Val2": 0.0, "Text": "Some text"}], "B": []}')
+        association.convert_record(record)
+        self.assertEqual(record, {"A": [association.Association(datetime.datetime(2001, 7, 24), 1.5, 0.0, "Some text"),
+                                        association.Association(datetime.datetime(2005, 6, 14), 2.5, 0.0, "Some text")],
+                                  "B": []})
+
+        # Repeated text and dates should be shared between associations.
+        self.assertIs(record["A"][0].Text, record["A"][1].Text)
+        self.assertIs(association.parse_date("2001-07-24"), record["A"][0].Date)
+
+        # Converting an already converted record should leave it unchanged.
+        converted = record["A"]
+        association.convert_record(record)
+        self.assertIs(record["A"], converted)
+
+    def test_code_columns(self):
+        dates = ["2001-07-24", "2001-07-24", "2003-01-01", "2005-06-14"]
+        associations = [{"Date": j, "Val1": float(i), "Val2": -float(i), "Text": "T{:d}".format(i % 2)}
+                        for i, j in enumerate(dates)]
+        columns = association.CodeColumns.from_dicts(associations)
+        expected = [association.from_dict(i) for i in associations]
+
+        # The columns should behave as the sequence of their associations.
+        self.assertEqual(len(columns), 4)
+        self.assertEqual(columns, expected)
+        self.assertEqual(list(columns), expected)
+        self.assertEqual(columns[-1], expected[-1])
+        self.assertIsInstance(columns[1:3], association.CodeColumns)
+        self.assertEqual(columns[1:3], expected[1:3])
+        self.assertEqual(columns.take([0, 3]), [expected[0], expected[3]])
+        self.assertEqual(pickle.loads(pickle.dumps(columns)), columns)
+        self.assertEqual(list(association.field_values(columns, "Val2")), association.field_values(expected, "Val2"))
+        self.assertEqual(association.field_values(columns, "Text"), ["T0", "T1", "T0", "T1"])
+        self.assertIs(columns.Text[0], columns.Text[2])  # Repeated text is shared within the columns.
+        self.assertEqual(association.filter_associations(columns, "Val1", lambda x: x > 1.5), expected[2:])
+
+        # Bisecting the columns should match bisecting the associations, including for dates with a time.
+        for date in [datetime.datetime(2001, 7, 24), datetime.datetime(2001, 7, 24, 12), datetime.datetime(2001, 7, 23),
+                     datetime.datetime(2004, 1, 1), datetime.datetime.min, datetime.datetime.max]:
+            self.assertEqual(association.bisect_left(columns, date), association.bisect_left(expected, date))
+            self.assertEqual(association.bisect_right(columns, date), association.bisect_right(expected, date))
+            self.assertEqual(association.bisect_left(expected, date),
+                             bisect.bisect_left([i.Date for i in expected], date))
+            self.assertEqual(association.bisect_right(expected, date, 1),
+                             bisect.bisect_right([i.Date for i in expected], date, 1))
+
+        # The columns should be viewable as NumPy arrays when NumPy is installed.
+        numpyColumns = columns.as_numpy()
+        if association.numpy is None:
+            self.assertIsNone(numpyColumns)
+        else:
+            self.assertEqual(numpyColumns["Val1"].tolist(), [0.0, 1.0, 2.0, 3.0])
+            numpyColumns["Val1"][0] = 5.0  # The arrays share their memory with the columns.
+            self.assertEqual(columns.Val1[0], 5.0)
+
+    def test_columnar_extraction(self):
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        # Storing every code as columns should not change the extracted data.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "PatientExtraction"))
+        with open(os.path.join(dirData, "ExpectedOutputBlank.txt"), 'r') as fidExpected:
+            expectedOutput = [i.split('\t') for i in fidExpected.read().split('\n') if i]
+        with open(os.path.join(dirData, "CaseDefinitions.txt"), 'r') as fidCaseDefinitions:
+            caseDefinitionsText = fidCaseDefinitions.read()
+        mapCodeToDescription = annotate_case_definitions.load_code_descriptions(
+            os.path.join(dirData, "CodeDescriptions.tsv")
+        )
+        with unittest.mock.patch.object(association, "COLUMNS_THRESHOLD", 1), \
+                open(os.path.join(dirData, "FlatPatientData.tsv"), 'r') as fidPatientData:
+            header, rows = patient_extraction.extract(caseDefinitionsText, fidPatientData,
+                                                      mapCodeToDescription=mapCodeToDescription)
+            actualOutput = [header] + [[patientID] + values for patientID, values in rows]
+        self.assertEqual(actualOutput, expectedOutput)
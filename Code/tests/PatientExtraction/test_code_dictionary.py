@@ -0,0 +1,65 @@
+"""Tests for the code_dictionary module."""
+
+# Python imports.
+import os
+import shutil
+import unittest
+
+# User imports.
+from PatientExtraction import code_dictionary
+from PatientExtraction import conf
+
+
+class TestCodeDictionary(unittest.TestCase):
+
+    def test_codes_with_prefix(self):
+        codes = ["C10", "C10E", "C10E0", "C10F", "C11", "C1", "G30", "G3", "c10", "2469"]
+        mapCodeToDescription = code_dictionary.CodeDictionary({i: "Description {:s}".format(i) for i in codes})
+        self.assertEqual(mapCodeToDescription["C10E"], "Description C10E")
+
+        # The expansion should match a scan of every code in the dictionary.
+        for prefix in ["", "C", "C1", "C10", "C10E", "C10E0", "C10E00", "c", "G", "X", "2", "~"]:
+            self.assertEqual(mapCodeToDescription.codes_with_prefix(prefix),
+                             sorted(i for i in codes if i[:len(prefix)] == prefix))
+
+        # Codes added after the dictionary is created are only found once it is reindexed.
+        mapCodeToDescription["C10G"] = "Description C10G"
+        self.assertEqual(mapCodeToDescription.codes_with_prefix("C10G"), [])
+        mapCodeToDescription.reindex()
+        self.assertEqual(mapCodeToDescription.codes_with_prefix("C10G"), ["C10G"])
+
+    def test_cache(self):
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "CodeDictionary"))
+        shutil.rmtree(dirOutput, ignore_errors=True)
+        os.makedirs(dirOutput)
+        fileCodeDescriptions = os.path.join(dirOutput, "Coding.tsv")
+        fileCache = fileCodeDescriptions + ".index.pickle"
+        with open(fileCodeDescriptions, 'w') as fidCodeDescriptions:
+            fidCodeDescriptions.write("C10\tDiabetes\nC10E\tType 1 diabetes\n")
+
+        # The first load should create the cache, and the second should load the same dictionary from it.
+        mapCodeToDescription = code_dictionary.load(fileCodeDescriptions)
+        self.assertTrue(os.path.isfile(fileCache))
+        cachedMapCodeToDescription = code_dictionary.load(fileCodeDescriptions)
+        self.assertEqual(cachedMapCodeToDescription, {"C10": "Diabetes", "C10E": "Type 1 diabetes"})
+        self.assertEqual(cachedMapCodeToDescription, mapCodeToDescription)
+        self.assertEqual(cachedMapCodeToDescription.codes_with_prefix("C10"), ["C10", "C10E"])
+
+        # Changing the file of code descriptions should invalidate the cache.
+        with open(fileCodeDescriptions, 'a') as fidCodeDescriptions:
+            fidCodeDescriptions.write("C10F\tType 2 diabetes\n")
+        self.assertEqual(code_dictionary.load(fileCodeDescriptions).codes_with_prefix("C10"), ["C10", "C10E", "C10F"])
+
+        # A corrupt cache should be ignored and recreated.
+        with open(fileCache, 'wb') as fidCache:
+            fidCache.write(b"not a pickle")
+        self.assertEqual(len(code_dictionary.load(fileCodeDescriptions)), 3)
+        self.assertEqual(len(code_dictionary.load(fileCodeDescriptions)), 3)
+
+        # A cache that can not be written should not prevent the dictionary being loaded.
+        fileUnwritableCache = os.path.join(dirOutput, "Missing", "Coding.tsv.index.pickle")
+        self.assertEqual(len(code_dictionary.load(fileCodeDescriptions, fileUnwritableCache)), 3)
+        self.assertEqual(sorted(os.listdir(dirOutput)), ["Coding.tsv", "Coding.tsv.index.pickle"])
@@ -0,0 +1,108 @@
+"""Tests for the code_layout module."""
+
+# Python imports.
+import io
+import json
+import os
+import unittest
+
+# User imports.
+from Benchmark import synthetic_data
+from GenerateDataFiles import generate_flat_files
+from PatientExtraction import annotate_case_definitions
+from PatientExtraction import code_layout
+from PatientExtraction import conf
+from PatientExtraction import parse_case_definitions
+from PatientExtraction import patient_extraction
+
+
+class TestCodeLayout(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        # Setup global settings-like variables.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+
+        # Write the test patient data in the code layout, spilling a run every few associations so that the runs need
+        # merging.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "PatientExtraction"))
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "CodeLayout"))
+        os.makedirs(cls.dirOutput, exist_ok=True)
+        cls.filePatientData = os.path.join(dirData, "FlatPatientData.tsv")
+        cls.files = code_layout.build(cls.filePatientData, os.path.join(cls.dirOutput, "FlatPatientData.tsv"),
+                                      runSize=10)
+        cls.fileCodeDescriptions = os.path.join(dirData, "CodeDescriptions.tsv")
+        cls.fileCaseDefinitions = os.path.join(dirData, "CaseDefinitions.txt")
+        cls.filePatientSubset = os.path.join(dirData, "PatientSubset.txt")
+        cls.filePatientSubsetBlank = os.path.join(dirData, "PatientSubsetBlank.txt")
+        cls.fileExpectedOutput = os.path.join(dirData, "ExpectedOutput.txt")
+        cls.fileExpectedOutputBlank = os.path.join(dirData, "ExpectedOutputBlank.txt")
+
+    def test_read_patients(self):
+        with open(self.filePatientData, 'r') as fidPatientData:
+            records = [(i.split('\t')[0], json.loads(i.split('\t')[1])) for i in fidPatientData]
+        directory = code_layout.load_directory(self.files["Data"])
+        self.assertEqual(directory["Patients"], [i for i, _ in records])
+
+        # Reading every code should give back each patient's record in full (without the free text).
+        patients = list(code_layout.read_patients(self.files["Data"], directory["Codes"], directory))
+        self.assertEqual([i for i, _ in patients], [i for i, _ in records])
+        for (_, expected), (_, actual) in zip(records, patients):
+            self.assertEqual(list(actual), list(expected))
+            for code, associations in expected.items():
+                self.assertEqual([(i.Date.strftime("%Y-%m-%d"), i.Val1, i.Val2) for i in actual[code]],
+                                 [(i["Date"], i["Val1"], i["Val2"]) for i in associations])
+
+        # Reading some codes should only give back their associations.
+        codes = ["44Q", "229"]
+        patients = code_layout.read_patients(self.files["Data"], codes)
+        for (_, expected), (_, actual) in zip(records, patients):
+            self.assertEqual(list(actual), [i for i in expected if i in codes])
+
+    def test_needed_codes(self):
+        mapCodeToDescription = annotate_case_definitions.load_code_descriptions(self.fileCodeDescriptions)
+        annotatedCaseDefs = io.StringIO()
+        annotate_case_definitions.annotate(io.StringIO("# A\n> mode all\n> out count\n229\n44Q\n\n# B\nNotACode\n"),
+                                           mapCodeToDescription, annotatedCaseDefs)
+        annotatedCaseDefs.seek(0)
+        caseDefinitions, caseNames = parse_case_definitions.parse(annotatedCaseDefs)
+        directory = code_layout.load_directory(self.files["Data"])
+        self.assertEqual(sorted(code_layout.needed_codes(directory, caseDefinitions, caseNames)), ["229", "44Q"])
+
+    def test_code_layout_extraction(self):
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        # Extracting the cases from the code layout should give the same output as extracting them from the flat file.
+        for filePatientSubset, fileExpectedOutput in [(self.filePatientSubsetBlank, self.fileExpectedOutputBlank),
+                                                      (self.filePatientSubset, self.fileExpectedOutput)]:
+            with open(fileExpectedOutput, 'r') as fidExpected:
+                expectedOutput = fidExpected.read()
+            patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.files["Data"],
+                                    self.fileCodeDescriptions, filePatientSubset, useCohortIndex=False)
+            with open(os.path.join(self.dirOutput, "DataExtraction.tsv"), 'r') as fidOutput:
+                self.assertEqual(fidOutput.read(), expectedOutput)
+            with open(os.path.join(self.dirOutput, "RunReport.json"), 'r') as fidReport:
+                self.assertGreater(json.load(fidReport)["Counters"]["CodeBlocksRead"], 0)
+
+    def test_generated_layout(self):
+        # The layout written while generating the data should match the one built from the flat file.
+        dirSynthetic = os.path.join(self.dirOutput, "SyntheticData")
+        files = synthetic_data.main(dirSynthetic, numPatients=50, numCodes=200, codesPerPatient=5,
+                                    associationsPerCode=2, edgeCaseRate=0.2, seed=1)
+        fileFlatData = os.path.join(dirSynthetic, "FlatPatientData.tsv")
+        fileGenerated = os.path.join(dirSynthetic, "Generated.tsv")
+        for i in [fileFlatData] + list(code_layout.layout_files(fileGenerated).values()):
+            if os.path.isfile(i):
+                os.remove(i)
+        generate_flat_files.main(files["Journal"], fileFlatData)
+        generate_flat_files.main(files["Journal"], fileGenerated, codeLayout=True)
+        builtFiles = code_layout.build(fileFlatData)
+        generatedFiles = code_layout.layout_files(fileGenerated)
+        for i in ["Data", "Directory"]:
+            with open(builtFiles[i], 'rb') as fidBuilt, open(generatedFiles[i], 'rb') as fidGenerated:
+                self.assertEqual(fidBuilt.read(), fidGenerated.read())
@@ -0,0 +1,67 @@
+"""Tests for the code_matcher module."""
+
+# Python imports.
+import io
+import os
+import unittest
+
+# User imports.
+from PatientExtraction import annotate_case_definitions
+from PatientExtraction import code_matcher
+from PatientExtraction import conf
+from PatientExtraction import parse_case_definitions
+
+
+class TestCodeMatcher(unittest.TestCase):
+
+    def test_matching(self):
+        matcher = code_matcher.CodeMatcher(codes=["G30", "C10E0"], prefixes=["C10", "44"],
+                                           negativeCodes=["C10F1", "G30"], negativePrefixes=["C10E", "443"])
+        for i in ["C10", "C10F", "C10F12", "C10Z", "44", "442", "44A1"]:
+            self.assertIn(i, matcher)
+        for i in ["C1", "C11", "C10E", "C10E0", "C10E01", "C10F1", "G30", "G301", "443", "4431", "4", ""]:
+            self.assertNotIn(i, matcher)
+        self.assertTrue(matcher.cache["C10F12"])  # The results are cached.
+
+        # Test selecting the matching codes from a record.
+        record = {"C10F": [1], "C10E0": [2], "G30": [3], "44A": [4], "X": [5]}
+        self.assertEqual(matcher.select(record), {"C10F": [1], "44A": [4]})
+
+        # Cases with only positive codes do not need a matcher.
+        self.assertIsNone(code_matcher.create({"Codes": {"C10"}, "Prefixes": set(), "NegativeCodes": set()}))
+        self.assertIsInstance(code_matcher.create({"Codes": set(), "Prefixes": {"C10"}}), code_matcher.CodeMatcher)
+
+        # Test combining the codes of multiple cases.
+        caseDefinitions = {"A": {"Codes": {"X1"}}, "B": {"Codes": {"Y1"}, "Prefixes": {"Z"}}}
+        self.assertEqual(code_matcher.combine(caseDefinitions, ["A"]), {"X1"})
+        combined = code_matcher.combine(caseDefinitions, ["A", "B"])
+        self.assertEqual([i in combined for i in ["X1", "Y1", "Z9", "Y2"]], [True, True, True, False])
+
+    def test_prefix_matching_annotation(self):
+        # Setup global settings-like variables.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+
+        # Annotate the case definitions with both wildcard expansion and prefix matching.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "CaseDefinitions"))
+        mapCodeToDescription = annotate_case_definitions.load_code_descriptions(
+            os.path.join(dirData, "CodeDescriptions.tsv")
+        )
+        caseDefinitions = {}
+        for prefixMatching in [False, True]:
+            annotatedCaseDefs = io.StringIO()
+            with open(os.path.join(dirData, "CaseDefinitions.txt"), 'r') as fidCaseDefs:
+                annotate_case_definitions.annotate(fidCaseDefs, mapCodeToDescription, annotatedCaseDefs,
+                                                   prefixMatching)
+            caseDefinitions[prefixMatching], caseNames = parse_case_definitions.parse(
+                annotatedCaseDefs.getvalue().splitlines()
+            )
+        self.assertTrue(any(caseDefinitions[True][i]["Prefixes"] for i in caseNames))
+
+        # Both should match the same codes in the dictionary.
+        for i in caseNames:
+            expandedCodes = caseDefinitions[False][i]["Codes"]
+            matcher = caseDefinitions[True][i]["Matcher"] or caseDefinitions[True][i]["Codes"]
+            self.assertEqual({j for j in mapCodeToDescription if j in expandedCodes},
+                             {j for j in mapCodeToDescription if j in matcher}, "Case {:s} differs.".format(i))
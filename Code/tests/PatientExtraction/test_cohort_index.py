@@ -0,0 +1,103 @@
+"""Tests for the cohort_index module."""
+
+# Python imports.
+import json
+import os
+import shutil
+import unittest
+
+# User imports.
+from Benchmark import synthetic_data
+from GenerateDataFiles import generate_flat_files
+from PatientExtraction import cohort_index
+from PatientExtraction import conf
+from PatientExtraction import patient_extraction
+
+# Globals.
+INDEXED_CASES = (
+    "# Counts\n> mode all earliest max1\n> out count exists\n229\n2469.\n44I5\nNYSU5221\n44Q\n\n"
+    "# Exists\n> mode all\n> out exists\n8H5%\n-8H53\n\n"
+    "# Missing\n> mode latest\n> out count\nNotACode\n"
+)
+
+
+class TestCohortIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        # Setup global settings-like variables.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+
+        # Copy the test patient data to the temporary directory, so that its index can be stored alongside it.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "PatientExtraction"))
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "CohortIndex"))
+        os.makedirs(cls.dirOutput, exist_ok=True)
+        cls.filePatientData = os.path.join(cls.dirOutput, "FlatPatientData.tsv")
+        shutil.copyfile(os.path.join(dirData, "FlatPatientData.tsv"), cls.filePatientData)
+        cls.fileCodeDescriptions = os.path.join(dirData, "CodeDescriptions.tsv")
+        cls.filePatientSubset = os.path.join(dirData, "PatientSubset.txt")
+        cls.filePatientSubsetBlank = os.path.join(dirData, "PatientSubsetBlank.txt")
+        cls.fileCaseDefinitions = os.path.join(cls.dirOutput, "IndexedCases.txt")
+        with open(cls.fileCaseDefinitions, 'w') as fidCaseDefinitions:
+            fidCaseDefinitions.write(INDEXED_CASES)
+
+    def test_index(self):
+        with open(self.filePatientData, 'r') as fidPatientData:
+            records = [(i.split('\t')[0], json.loads(i.split('\t')[1])) for i in fidPatientData]
+        index = cohort_index.build(self.filePatientData)
+        self.assertEqual(index.patientIDs, [i for i, _ in records])
+
+        # The flags and counts for a set of codes should match those found from the records.
+        codes = ["44Q", "8H5", "229"]
+        self.assertEqual(index.patient_flags(codes),
+                         ''.join('1' if any(i in j for i in codes) else '0' for _, j in records))
+        self.assertEqual(list(index.patient_counts(codes)), [sum(len(j.get(i, [])) for i in codes) for _, j in records])
+        self.assertEqual(index.patient_flags([]), '0' * len(records))
+
+        # Adding patients after the index has been finished should extend the bitmaps.
+        index.add_patient("New", {"44Q": [{}, {}]})
+        index.finish()
+        self.assertEqual(index.patient_flags(["44Q"])[-1], '1')
+        self.assertEqual(index.patient_counts(["44Q"])[-1], 2)
+
+    def test_indexed_extraction(self):
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        # Extracting the cohort from the index should give the same output as extracting it from the flat file.
+        cohort_index.save(cohort_index.build(self.filePatientData), self.filePatientData)
+        for filePatientSubset in [self.filePatientSubsetBlank, self.filePatientSubset]:
+            outputs = []
+            for useCohortIndex in [False, True]:
+                patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.filePatientData,
+                                        self.fileCodeDescriptions, filePatientSubset, useCohortIndex=useCohortIndex)
+                with open(os.path.join(self.dirOutput, "DataExtraction.tsv"), 'r') as fidOutput:
+                    outputs.append(fidOutput.read())
+                with open(os.path.join(self.dirOutput, "RunReport.json"), 'r') as fidReport:
+                    counters = json.load(fidReport)["Counters"]
+                self.assertEqual(counters.get("PatientsIndexed", 0) > 0, useCohortIndex)
+            self.assertEqual(outputs[0], outputs[1])
+
+        # A stale index should be ignored.
+        os.utime(self.filePatientData)
+        self.assertIsNone(cohort_index.load(self.filePatientData))
+
+    def test_generated_index(self):
+        # The index saved while generating the flat file should match the one built from it afterwards.
+        dirSynthetic = os.path.join(self.dirOutput, "SyntheticData")
+        files = synthetic_data.main(dirSynthetic, numPatients=50, numCodes=200, codesPerPatient=5,
+                                    associationsPerCode=2, edgeCaseRate=0.2, seed=1)
+        fileFlatData = os.path.join(dirSynthetic, "FlatPatientData.tsv")
+        if os.path.isfile(fileFlatData):
+            os.remove(fileFlatData)
+        generate_flat_files.main(files["Journal"], fileFlatData, summaries=True, cohortIndex=True)
+        generatedIndex = cohort_index.load(fileFlatData)
+        builtIndex = cohort_index.build(fileFlatData)
+        self.assertIsNotNone(generatedIndex)
+        self.assertEqual(generatedIndex.patientIDs, builtIndex.patientIDs)
+        self.assertEqual(generatedIndex.bitmaps, builtIndex.bitmaps)
+        self.assertEqual(generatedIndex.counts, builtIndex.counts)
@@ -0,0 +1,100 @@
+"""Tests for the extraction_plan module."""
+
+# Python imports.
+import datetime
+import os
+import unittest
+
+# User imports.
+from PatientExtraction import conf
+from PatientExtraction import extraction_plan
+from PatientExtraction import parse_case_definitions
+from PatientExtraction import patient_extraction
+
+
+class TestExtractionPlan(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        # Setup global settings-like variables.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+
+        # Determine the files needed to load the data and the expected results of the tests.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "PatientExtraction"))
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "ExtractionPlan"))
+        os.makedirs(cls.dirOutput, exist_ok=True)
+        cls.filePatientData = os.path.join(dirData, "FlatPatientData.tsv")
+        cls.fileCodeDescriptions = os.path.join(dirData, "CodeDescriptions.tsv")
+        cls.fileCaseDefinitions = os.path.join(dirData, "CaseDefinitions.txt")
+        cls.filePatientSubsetBlank = os.path.join(dirData, "PatientSubsetBlank.txt")
+        cls.fileExpectedOutputBlank = os.path.join(dirData, "ExpectedOutputBlank.txt")
+        cls.fileAnnotatedRestrictions = os.path.abspath(
+            os.path.join(dirCurrent, "TestData", "CaseDefinitions", "AnnotatedCaseDefinitions.txt")
+        )
+
+    def test_plan(self):
+        # Compile and save the plan.
+        fileAnnotatedCaseDefs = os.path.join(self.dirOutput, "CaseDefinitions_Annotated.txt")
+        plan = extraction_plan.compile_plan(self.fileCaseDefinitions, self.fileCodeDescriptions, fileAnnotatedCaseDefs,
+                                            useCodeCache=False)
+        self.assertTrue(os.path.isfile(fileAnnotatedCaseDefs))
+        filePlan = os.path.join(self.dirOutput, "ExtractionPlan.json")
+        extraction_plan.save_plan(plan, filePlan)
+        self.assertTrue(extraction_plan.is_plan_file(filePlan))
+        self.assertFalse(extraction_plan.is_plan_file(self.fileCaseDefinitions))
+
+        # The loaded plan should build the same case definitions as the compiled one.
+        loadedPlan = extraction_plan.load_plan(filePlan)
+        self.assertEqual(loadedPlan, plan)
+        caseDefinitions, caseNames = extraction_plan.build_case_definitions(loadedPlan)
+        self.assertEqual(caseNames, [i["Name"] for i in plan["Cases"]])
+        for case in plan["Cases"]:
+            caseDefinition = caseDefinitions[case["Name"]]
+            self.assertEqual(caseDefinition["Codes"], set(case["Codes"]))
+            self.assertEqual(caseDefinition["RestrictionSpecs"], case["Restrictions"])
+            for i, j in case["Restrictions"].items():
+                self.assertEqual(len(caseDefinition["Restrictions"][i]), len(j))
+
+        # Test that restrictions survive the round trip through a plan.
+        caseDefinitions, caseNames = parse_case_definitions.main(self.fileAnnotatedRestrictions)
+        restrictedPlan = extraction_plan.create_plan(caseDefinitions, caseNames)
+        builtCaseDefinitions, _ = extraction_plan.build_case_definitions(restrictedPlan)
+        testValues = {"Date": [datetime.datetime(i, 6, 1) for i in range(1990, 2030, 3)],
+                      "Val1": [-10, 0, 0.5, 1, 2, 5, 10, 100], "Val2": [-10, 0, 0.5, 1, 2, 5, 10, 100]}
+        numRestrictions = 0
+        for i in caseNames:
+            for j in testValues:
+                self.assertEqual(len(builtCaseDefinitions[i]["Restrictions"][j]),
+                                 len(caseDefinitions[i]["Restrictions"][j]))
+                builtRestrictions = builtCaseDefinitions[i]["Restrictions"][j]
+                for parsed, built in zip(caseDefinitions[i]["Restrictions"][j], builtRestrictions):
+                    numRestrictions += 1
+                    self.assertEqual([parsed(k) for k in testValues[j]], [built(k) for k in testValues[j]])
+        self.assertGreater(numRestrictions, 0)
+
+        # Test that window series survive the round trip through a plan.
+        caseDefinitions, caseNames = parse_case_definitions.parse(
+            ["# Case", ">windows 2000-01-01 2009-12-31 6m", ">from 2003-06-01", "C10"]
+        )
+        builtCaseDefinitions, _ = extraction_plan.build_case_definitions(
+            extraction_plan.create_plan(caseDefinitions, caseNames)
+        )
+        for i in ["WindowSpec", "Windows", "DateRange"]:
+            self.assertEqual(builtCaseDefinitions["Case"][i], caseDefinitions["Case"][i])
+
+        # An extraction using the plan should give the same output as one using the case definitions.
+        patient_extraction.main(filePlan, self.dirOutput, self.filePatientData, self.fileCodeDescriptions,
+                                self.filePatientSubsetBlank)
+        with open(os.path.join(self.dirOutput, "DataExtraction.tsv"), 'r') as fidActual, \
+                open(self.fileExpectedOutputBlank, 'r') as fidExpected:
+            self.assertEqual(fidActual.read(), fidExpected.read())
+
+        # Plans from a different version (or without one) should be rejected.
+        self.assertEqual(plan["Version"], 1)
+        for version in [extraction_plan.PLAN_VERSION + 1, None]:
+            with self.assertRaises(ValueError):
+                extraction_plan.build_case_definitions(dict(plan, Version=version))
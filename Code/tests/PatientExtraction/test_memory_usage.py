@@ -0,0 +1,51 @@
+"""Tests for the memory_usage module."""
+
+# Python imports.
+import json
+import unittest
+
+# User imports.
+from PatientExtraction import memory_usage
+
+
+class TestDecodeCodes(unittest.TestCase):
+
+    def test_decode_codes(self):
+        # Create a record where the free text of the skipped codes contains quotes, brackets and escapes.
+        record = {
+            "C10E": [{"Date": "2001-01-01", "Val1": 1.5, "Val2": 0, "Text": "plain"}],
+            "XaJ": [{"Date": "2002-02-02", "Val1": 0, "Val2": 0, "Text": "a \"quoted\" ]} bracket"}],
+            "2469": [{"Date": "2003-03-03", "Val1": 130, "Val2": 80, "Text": "[{\\"}],
+            "G30": [{"Date": "2004-04-04", "Val1": 0, "Val2": 0, "Text": "\u00e9 ]"},
+                    {"Date": "2005-05-05", "Val1": 0, "Val2": 0, "Text": ""}]
+        }
+
+        for recordText in [json.dumps(record), json.dumps(record, indent=2), json.dumps(record) + '\n']:
+            self.assertEqual(memory_usage.decode_codes(recordText, {"C10E", "G30"}),
+                             {"C10E": record["C10E"], "G30": record["G30"]})
+            self.assertEqual(memory_usage.decode_codes(recordText, set(record)), record)
+            self.assertEqual(memory_usage.decode_codes(recordText, {"Missing"}), {})
+        self.assertEqual(memory_usage.decode_codes("{}", {"C10E"}), {})
+
+        # Test that malformed records are rejected.
+        with self.assertRaises(ValueError):
+            memory_usage.decode_codes('["C10E"]', {"C10E"})
+        with self.assertRaises(ValueError):
+            memory_usage.decode_codes('{"C10E": [{"Text": "]"}', {"G30"})
+
+
+class TestMemoryMonitor(unittest.TestCase):
+
+    def test_largest_patients(self):
+        monitor = memory_usage.MemoryMonitor(traceAllocations=False, numLargestPatients=3, sampleEvery=2)
+        for i, j in enumerate([50, 10, 70, 30, 90, 60]):
+            monitor.record_patient(str(i), j, i)
+        workerMonitor = memory_usage.MemoryMonitor(traceAllocations=False, numLargestPatients=3)
+        workerMonitor.record_patient("Worker", 80, 1)
+        monitor.merge(workerMonitor.to_dict())
+
+        memoryUsage = monitor.to_dict()
+        self.assertEqual([i["PatientID"] for i in memoryUsage["LargestPatients"]], ["4", "Worker", "2"])
+        self.assertEqual([i["RecordBytes"] for i in memoryUsage["LargestPatients"]], [90, 80, 70])
+        self.assertGreaterEqual(memoryUsage["PeakRSS"], 0)
+        self.assertEqual(memoryUsage["Stages"], {})
@@ -0,0 +1,100 @@
+"""Tests for the output_sinks module."""
+
+# Python imports.
+import gzip
+import json
+import lzma
+import os
+import sqlite3
+import unittest
+
+# User imports.
+from PatientExtraction import conf
+from PatientExtraction import output_sinks
+from PatientExtraction import patient_extraction
+
+
+class TestOutputSinks(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        # Setup global settings-like variables.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+
+        # Determine the files needed to load the data and the expected results of the tests.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "PatientExtraction"))
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "OutputSinks"))
+        os.makedirs(cls.dirOutput, exist_ok=True)
+        cls.filePatientData = os.path.join(dirData, "FlatPatientData.tsv")
+        cls.fileCodeDescriptions = os.path.join(dirData, "CodeDescriptions.tsv")
+        cls.fileCaseDefinitions = os.path.join(dirData, "CaseDefinitions.txt")
+        cls.filePatientSubsetBlank = os.path.join(dirData, "PatientSubsetBlank.txt")
+        cls.fileExpectedOutputBlank = os.path.join(dirData, "ExpectedOutputBlank.txt")
+
+    def test_sinks(self):
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        with open(self.fileExpectedOutputBlank, 'r') as fidExpected:
+            expectedLines = fidExpected.read().splitlines()
+        expectedRows = [i.split('\t') for i in expectedLines]
+        header = expectedRows[0]
+
+        # Reading the output of each sink back should give the rows of the normal output.
+        for processes in [1, 2]:
+            patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.filePatientData,
+                                    self.fileCodeDescriptions, self.filePatientSubsetBlank, processes=processes,
+                                    sink="tsv.gz")
+            with gzip.open(os.path.join(self.dirOutput, "DataExtraction.tsv.gz"), 'rt') as fidOutput:
+                self.assertEqual(fidOutput.read().splitlines(), expectedLines)
+
+            patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.filePatientData,
+                                    self.fileCodeDescriptions, self.filePatientSubsetBlank, processes=processes,
+                                    sink="tsv.xz")
+            with lzma.open(os.path.join(self.dirOutput, "DataExtraction.tsv.xz"), 'rt') as fidOutput:
+                self.assertEqual(fidOutput.read().splitlines(), expectedLines)
+
+            patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.filePatientData,
+                                    self.fileCodeDescriptions, self.filePatientSubsetBlank, processes=processes,
+                                    sink="ndjson")
+            with open(os.path.join(self.dirOutput, "DataExtraction.ndjson"), 'r') as fidOutput:
+                self.assertEqual([json.loads(i) for i in fidOutput], [dict(zip(header, i)) for i in expectedRows[1:]])
+
+            patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.filePatientData,
+                                    self.fileCodeDescriptions, self.filePatientSubsetBlank, processes=processes,
+                                    sink="sqlite")
+            connection = sqlite3.connect(os.path.join(self.dirOutput, "DataExtraction.sqlite"))
+            try:
+                cursor = connection.execute("SELECT * FROM DataExtraction ORDER BY rowid")
+                self.assertEqual([i[0] for i in cursor.description], header)
+                self.assertEqual([list(i) for i in cursor], expectedRows[1:])
+            finally:
+                connection.close()
+
+    def test_batched_writing(self):
+        # Entries written in several batches should all end up in the output, in order.
+        header = ["PatientID", "Case__MODE_count__OUT_count"]
+        formatPatient = output_sinks.TsvSink.formatter(header, ['0'])
+        entries = [formatPatient("P{:d}".format(i), [str(i)]) for i in range(5)]
+        with output_sinks.create_sink("tsv", self.dirOutput, header, ['0']) as sink:
+            sink.writelines(entries[:2])
+            sink.writelines(entries[2:])
+        with open(os.path.join(self.dirOutput, "DataExtraction.tsv"), 'r') as fidOutput:
+            self.assertEqual(fidOutput.read(), "PatientID\tCase__MODE_count__OUT_count\n" + ''.join(entries))
+
+    def test_sqlite_batches(self):
+        # Each batch written to the database should be committed (through the rollback journal) before the sink closes.
+        header = ["PatientID", "Case__MODE_count__OUT_count"]
+        with output_sinks.create_sink("sqlite", self.dirOutput, header, ['0']) as sink:
+            self.assertEqual(sink.connection.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+            sink.writelines([["P0", "0"], ["P1", "1"]])
+            connection = sqlite3.connect(os.path.join(self.dirOutput, "DataExtraction.sqlite"))
+            try:
+                self.assertEqual(connection.execute("SELECT * FROM DataExtraction").fetchall(),
+                                 [("P0", "0"), ("P1", "1")])
+            finally:
+                connection.close()
@@ -116,3 +116,48 @@ class TestRestrictionApplication(unittest.TestCase):
                 annotatedCellContents = [l.cell_contents for l in j.__closure__]
                 expectedCellContents = [l.cell_contents for l in k.__closure__]
                 self.assertEqual(annotatedCellContents, expectedCellContents)
+
+    def test_windows(self):
+        # Test the creation of the windows of a window series.
+        self.assertIsNone(parse_case_definitions.create_windows(None))
+        windows = parse_case_definitions.create_windows(["2000-01-31", "2000-06-15", "2m"])
+        self.assertEqual(windows, [
+            (datetime.datetime(2000, 1, 31), datetime.datetime(2000, 3, 31)),
+            (datetime.datetime(2000, 3, 31), datetime.datetime(2000, 5, 31)),
+            (datetime.datetime(2000, 5, 31), datetime.datetime(2000, 6, 16))
+        ])
+        windows = parse_case_definitions.create_windows(["2000-02-29", "2003-12-31", "1y"])
+        self.assertEqual([i[0] for i in windows], [datetime.datetime(2000, 2, 29), datetime.datetime(2001, 2, 28),
+                                                   datetime.datetime(2002, 2, 28), datetime.datetime(2003, 2, 28)])
+        self.assertEqual(len(parse_case_definitions.create_windows(["2000-01-01", "2000-01-10", "3d"])), 4)
+
+        # Test that the window series is parsed and also restricts the dates of the case.
+        caseDefinitions, caseNames = parse_case_definitions.parse(
+            ["# Case", ">windows 2000-01-01 2009-12-31 1y", ">from 2003-06-01", "C10"]
+        )
+        self.assertEqual(caseDefinitions["Case"]["WindowSpec"], ["2000-01-01", "2009-12-31", "1y"])
+        self.assertEqual(len(caseDefinitions["Case"]["Windows"]), 10)
+        self.assertEqual(caseDefinitions["Case"]["DateRange"],
+                         (datetime.datetime(2003, 6, 1), datetime.datetime(2009, 12, 31)))
+
+    def test_relative_restrictions(self):
+        # Test that anchor case names are resolved without regard to case and that unknown cases and cycles of
+        # dependencies are removed.
+        conf.control_logging(False)
+        caseDefinitions, caseNames = parse_case_definitions.parse(
+            ["# A", ">relative b earliest 0 90", "C10",
+             "# B", ">relative c latest -30 30", ">relative d latest 0 1", "C11",
+             "# C", ">relative a earliest 0 10", ">relative z earliest 0 10", "C12",
+             "# D", ">relative d earliest 0 1", "C13"]
+        )
+        conf.control_logging(True)
+        self.assertEqual(caseDefinitions["A"]["Relative"], [["B", "earliest", 0, 90]])
+        self.assertEqual(caseDefinitions["B"]["Relative"], [["C", "latest", -30, 30], ["D", "latest", 0, 1]])
+        self.assertEqual(caseDefinitions["C"]["Relative"], [])
+        self.assertEqual(caseDefinitions["D"]["Relative"], [])
+        self.assertEqual([caseDefinitions[i]["IsAnchor"] for i in caseNames], [False, True, True, True])
+
+        # Test that cases are evaluated after the cases they refer to.
+        self.assertEqual(parse_case_definitions.evaluation_order(caseDefinitions, caseNames), ["C", "D", "B", "A"])
+        self.assertEqual(parse_case_definitions.evaluation_order(caseDefinitions, ["A"]), ["C", "D", "B", "A"])
+        self.assertEqual(parse_case_definitions.evaluation_order(caseDefinitions, ["D", "C"]), ["D", "C"])
@@ -1,11 +1,16 @@
 """Tests for the patient_extraction module."""
 
 # Python imports.
+import datetime
+import io
+import json
 import os
 import unittest
 
 # User imports.
+from PatientExtraction import annotate_case_definitions
 from PatientExtraction import conf
+from PatientExtraction import parse_case_definitions
 from PatientExtraction import patient_extraction
 
 
@@ -32,6 +37,64 @@ class TestRestrictionApplication(unittest.TestCase):
         cls.fileExpectedOutputBlank = os.path.join(dirData, "PatientExtraction", "ExpectedOutputBlank.txt")
         cls.fileExpectedOutput = os.path.join(dirData, "PatientExtraction", "ExpectedOutput.txt")
 
+    def test_pipelined_extraction(self):
+
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        fid = open(self.fileExpectedOutputBlank, 'r')
+        expectedOutput = fid.read()
+        fid.close()
+
+        # Test the pipelined extraction in the current process and using a pool of worker processes.
+        for processes in [1, 2]:
+            patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.filePatientData,
+                                    self.fileCodeDescriptions, self.filePatientSubsetBlank, pipelined=True,
+                                    processes=processes)
+            fid = open(os.path.join(self.dirOutput, "DataExtraction.tsv"))
+            actualOutput = fid.read()
+            fid.close()
+            self.assertEqual(actualOutput, expectedOutput)
+
+    def test_bounded_memory_extraction(self):
+
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        fid = open(self.fileExpectedOutputBlank, 'r')
+        expectedOutput = fid.read()
+        fid.close()
+
+        # Test decoding every record one code at a time while recording the memory usage.
+        for processes in [1, 2]:
+            patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.filePatientData,
+                                    self.fileCodeDescriptions, self.filePatientSubsetBlank, processes=processes,
+                                    traceMemory=True, maxRecordBytes=0)
+            fid = open(os.path.join(self.dirOutput, "DataExtraction.tsv"))
+            actualOutput = fid.read()
+            fid.close()
+            self.assertEqual(actualOutput, expectedOutput)
+
+            # Test that the run report records the streamed patients and the memory usage.
+            fid = open(os.path.join(self.dirOutput, "RunReport.json"), 'r')
+            runReport = json.load(fid)
+            fid.close()
+            numPatients = len(expectedOutput.split('\n')) - 2
+            self.assertEqual(runReport["Counters"]["PatientsStreamed"], numPatients)
+            self.assertEqual(set(runReport["Memory"]["Stages"]), {"Annotation", "Parsing", "Extraction"})
+            self.assertIn("Peak", runReport["Memory"]["Stages"]["Parsing"])
+            largestPatients = runReport["Memory"]["LargestPatients"]
+            self.assertEqual(len(largestPatients), min(10, numPatients))
+            recordSizes = [i["RecordBytes"] for i in largestPatients]
+            self.assertEqual(recordSizes, sorted(recordSizes, reverse=True))
+
+    def test_is_oversized(self):
+        # Records should be measured by their size in bytes rather than characters.
+        self.assertFalse(patient_extraction.is_oversized('{"A": []}', 9))
+        self.assertTrue(patient_extraction.is_oversized('{"A": []}', 8))
+        self.assertFalse(patient_extraction.is_oversized('{"A": [{"Text": "caf\u00e9"}]}', 26))
+        self.assertTrue(patient_extraction.is_oversized('{"A": [{"Text": "caf\u00e9"}]}', 25))
+
     def test_patient_extraction(self):
 
         # Set the test to output the entire difference between the actual and expected outputs.
@@ -52,9 +115,17 @@ class TestRestrictionApplication(unittest.TestCase):
         for i, j in zip(actualOutput, expectedOutput):
             self.assertEqual(i, j)
 
-        # Test with a patient subset.
+        # Test that the run report records every patient.
+        fid = open(os.path.join(self.dirOutput, "RunReport.json"), 'r')
+        runReport = json.load(fid)
+        fid.close()
+        self.assertEqual(runReport["Counters"]["PatientsScanned"], len(expectedOutput) - 2)
+        self.assertEqual(runReport["Counters"].get("PatientsSkipped", 0), 0)
+        self.assertNotIn("JSONDecoding", runReport["Timings"])  # Per patient stages are only timed when asked.
+
+        # Test with a patient subset (and the stages timed).
         patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.filePatientData,
-                                self.fileCodeDescriptions, self.filePatientSubset)
+                                self.fileCodeDescriptions, self.filePatientSubset, timeStages=True)
         fid = open(os.path.join(self.dirOutput, "DataExtraction.tsv"))
         actualOutput = fid.read()
         actualOutput = actualOutput.split('\n')
@@ -66,3 +137,120 @@ class TestRestrictionApplication(unittest.TestCase):
         self.assertEqual(len(actualOutput), len(expectedOutput))
         for i, j in zip(actualOutput, expectedOutput):
             self.assertEqual(i, j)
+        with open(os.path.join(self.dirOutput, "RunReport.json"), 'r') as fidReport:
+            runReport = json.load(fidReport)
+        self.assertEqual(runReport["Timings"]["JSONDecoding"]["Calls"], len(expectedOutput) - 2)
+        self.assertIn("ApplyRestrictions", runReport["Timings"])
+
+    def test_extract(self):
+
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        # Load the expected output (the header and one line per patient).
+        fid = open(self.fileExpectedOutputBlank, 'r')
+        expectedOutput = [i.split('\t') for i in fid.read().split('\n') if i]
+        fid.close()
+
+        # Test the extraction using the text of the case definitions and the lines of the patient data file.
+        fid = open(self.fileCaseDefinitions, 'r')
+        caseDefinitionsText = fid.read()
+        fid.close()
+        mapCodeToDescription = annotate_case_definitions.load_code_descriptions(self.fileCodeDescriptions)
+        with open(self.filePatientData, 'r') as fidPatientData:
+            header, rows = patient_extraction.extract(caseDefinitionsText, fidPatientData,
+                                                      mapCodeToDescription=mapCodeToDescription)
+            self.assertEqual(header, expectedOutput[0])
+            actualOutput = [[patientID] + values for patientID, values in rows]
+        self.assertEqual(actualOutput, expectedOutput[1:])
+
+        # Test the extraction using parsed case definitions and (patientID, record) tuples for a subset of patients.
+        fid = open(self.filePatientSubset, 'r')
+        patientSubset = {i.strip() for i in fid if i.strip()}
+        fid.close()
+        with open(self.filePatientData, 'r') as fidPatientData:
+            records = [(i.split('\t')[0], json.loads(i.split('\t')[1])) for i in fidPatientData]
+        annotatedCaseDefinitions = io.StringIO()
+        annotate_case_definitions.annotate(io.StringIO(caseDefinitionsText), mapCodeToDescription,
+                                           annotatedCaseDefinitions)
+        caseDefinitions, caseNames = parse_case_definitions.parse(annotatedCaseDefinitions.getvalue().split('\n'))
+        header, rows = patient_extraction.extract(caseDefinitions, records, caseNames, patientSubset=patientSubset)
+        actualOutput = [[patientID] + values for patientID, values in rows]
+        self.assertEqual(actualOutput, [i for i in expectedOutput[1:] if i[0] in patientSubset])
+
+        # The extraction should not have cached anything in the parsed case definitions.
+        self.assertFalse(any("EmptyValues" in i or "Summarisable" in i for i in caseDefinitions.values()))
+
+    def test_window_series(self):
+        # A case extracted in a window series should give the same output as a separate case for each window.
+        codes = "229\n2469.\n40729\n44I5\n44Q\nNYSU5221\n"
+        control = "> mode earliest latest max1\n> out count exists mean1 date val1\n"
+        windowedText = "# Windowed\n" + control + "> from 2001-06-01\n> windows 2000-01-01 2009-06-30 2y\n" + codes
+        windowStarts = ["2000-01-01", "2002-01-01", "2004-01-01", "2006-01-01", "2008-01-01"]
+        windowEnds = ["2001-12-31", "2003-12-31", "2005-12-31", "2007-12-31", "2009-06-30"]
+        separateText = ''.join(
+            "# Window {:d}\n{:s}> from 2001-06-01\n> from {:s} to {:s}\n{:s}".format(i, control, j, k, codes)
+            for i, (j, k) in enumerate(zip(windowStarts, windowEnds))
+        )
+        mapCodeToDescription = annotate_case_definitions.load_code_descriptions(self.fileCodeDescriptions)
+
+        with open(self.filePatientData, 'r') as fidPatientData:
+            windowedHeader, windowedRows = patient_extraction.extract(windowedText, fidPatientData,
+                                                                      mapCodeToDescription=mapCodeToDescription)
+            windowedOutput = list(windowedRows)
+        with open(self.filePatientData, 'r') as fidPatientData:
+            separateHeader, separateRows = patient_extraction.extract(separateText, fidPatientData,
+                                                                      mapCodeToDescription=mapCodeToDescription)
+            separateOutput = list(separateRows)
+
+        # Check that there is one column per window, mode and output, named after the start of the window.
+        self.assertEqual(len(windowedHeader), len(separateHeader))
+        self.assertEqual(windowedHeader[1], "Windowed__WINDOW_2000-01-01__MODE_earliest__OUT_count")
+        self.assertEqual(windowedHeader[-1], "Windowed__WINDOW_2008-01-01__MODE_max1__OUT_val1")
+        self.assertEqual(windowedOutput, separateOutput)
+        self.assertTrue(any(i != '0' for _, j in windowedOutput for i in j[::5]))
+
+    def test_relative_restrictions(self):
+        # The dependent case is defined before its anchor case, so the cases must be evaluated out of order.
+        caseDefinitionsText = (
+            "# Dependent\n> out count\n> relative Blood_Pressure earliest -365 730\n> from 2000-01-01\n22K\n42A\n"
+            "# Blood Pressure\n> out count\n246%\n"
+            "# Latest\n> out count\n> relative blood_pressure latest 0 0\n> relative DEPENDENT earliest -5000 5000\n"
+            "2469\n"
+        )
+        mapCodeToDescription = annotate_case_definitions.load_code_descriptions(self.fileCodeDescriptions)
+        with open(self.filePatientData, 'r') as fidPatientData:
+            records = [(i.split('\t')[0], json.loads(i.split('\t')[1])) for i in fidPatientData]
+        # Determine the expected counts by checking every association against the anchor dates (before the extraction
+        # converts the dates).
+        expectedOutput = {}
+        for patientID, record in records:
+            dates = {i: [datetime.datetime.strptime(k["Date"], "%Y-%m-%d") for k in j] for i, j in record.items()}
+            anchorDates = [k for i, j in dates.items() if i.startswith("246") for k in j]
+            dependentDates = []
+            latestDates = []
+            if anchorDates:
+                dependentDates = [k for i in ["22K", "42A"] for k in dates.get(i, [])
+                                  if k >= datetime.datetime(2000, 1, 1) and
+                                  min(anchorDates) - datetime.timedelta(days=365) <= k <=
+                                  min(anchorDates) + datetime.timedelta(days=730)]
+            if dependentDates:
+                latestDates = [k for k in dates.get("2469", []) if k == max(anchorDates)]
+            expectedOutput[patientID] = [str(len(dependentDates)), str(len(anchorDates)), str(len(latestDates))]
+        self.assertTrue(any(i[0] != '0' for i in expectedOutput.values()))
+        self.assertTrue(any(i[2] != '0' for i in expectedOutput.values()))
+
+        header, rows = patient_extraction.extract(caseDefinitionsText, records,
+                                                  mapCodeToDescription=mapCodeToDescription)
+        self.assertEqual(header, ["PatientID", "Dependent__MODE_all__OUT_count", "Blood_Pressure__MODE_all__OUT_count",
+                                  "Latest__MODE_all__OUT_count"])
+        actualOutput = {patientID: values for patientID, values in rows}
+        self.assertEqual(actualOutput, expectedOutput)
+
+        # Cases referred to by relative date restrictions are evaluated even when they are not output.
+        caseDefinitions, caseNames = parse_case_definitions.parse(
+            ["# Dependent", ">relative Anchor earliest 0 0", "22K", "# Anchor", "22K"]
+        )
+        _, rows = patient_extraction.extract(caseDefinitions, records, ["Dependent"])
+        self.assertEqual({patientID: values[0] for patientID, values in rows},
+                         {i: str(int("22K" in j)) for i, j in records})
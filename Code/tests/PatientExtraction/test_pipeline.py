@@ -0,0 +1,55 @@
+"""Tests for the pipeline module."""
+
+# Python imports.
+import io
+import unittest
+
+# User imports.
+from PatientExtraction import conf
+from PatientExtraction import pipeline
+
+
+def reverse_batch(lines):
+    """Reverse the characters of each line in a batch (excluding the newline)."""
+    return ["{:s}\n".format(i.strip()[::-1]) for i in lines]
+
+
+def failing_batch(lines):
+    """Fail to process a batch."""
+    raise ValueError("Batch failed.")
+
+
+class FailingOutput(io.StringIO):
+    """File-like object that fails on writing."""
+
+    def writelines(self, lines):
+        raise IOError("Write failed.")
+
+
+class TestPipeline(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+        cls.inputText = ''.join(["{:d}abc\n".format(i) for i in range(5000)])
+        cls.expectedOutput = ''.join(["cba{:s}\n".format(str(i)[::-1]) for i in range(5000)])
+
+    def test_order_preserved(self):
+        # Use a small read size and queue so that there are many batches and the queues fill up.
+        for processes in [1, 2]:
+            fidOutput = io.StringIO()
+            pipeline.run(io.StringIO(self.inputText), fidOutput, reverse_batch, processes=processes, readSize=100,
+                         queueSize=2)
+            self.assertEqual(fidOutput.getvalue(), self.expectedOutput)
+
+    def test_errors_propagated(self):
+        # Test an error in the compute stage.
+        with self.assertRaises(ValueError):
+            pipeline.run(io.StringIO(self.inputText), io.StringIO(), failing_batch, readSize=100, queueSize=2)
+
+        # Test an error in the writer.
+        with self.assertRaises(IOError):
+            pipeline.run(io.StringIO(self.inputText), FailingOutput(), reverse_batch, readSize=100, queueSize=2)
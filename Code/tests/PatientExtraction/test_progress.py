@@ -0,0 +1,75 @@
+"""Tests for the progress module."""
+
+# Python imports.
+import io
+import json
+import logging
+import os
+import unittest
+
+# User imports.
+from PatientExtraction import progress
+
+
+class ListHandler(logging.Handler):
+    """Logging handler that records the messages logged."""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestProgressReporter(unittest.TestCase):
+
+    def test_tracking(self):
+        lines = ["{:d}\tabcdefgh\n".format(i) for i in range(25)]
+        totalBytes = sum(map(len, lines))
+
+        # Create a reporter that reports every time it checks the clock.
+        stream = io.StringIO()
+        logger = logging.getLogger("TestProgressReporter")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = ListHandler()
+        logger.addHandler(handler)
+        reporter = progress.ProgressReporter(totalBytes, interval=0, unit="patients", name="Test", stream=stream,
+                                             logger=logger, checkEvery=10)
+
+        # The lines should be unchanged, with the clock checked after 10 and 20 lines and once all lines are consumed.
+        self.assertEqual(list(reporter.track(lines)), lines)
+        self.assertEqual(len(stream.getvalue().splitlines()), 3)
+        self.assertEqual(len(handler.messages), 3)
+        self.assertTrue(stream.getvalue().startswith("Test: "))
+
+        # Check the structured record of the final report.
+        finalReport = json.loads(handler.messages[-1].split('\t', 1)[1])
+        self.assertEqual(finalReport["Items"], 25)
+        self.assertEqual(finalReport["BytesConsumed"], totalBytes)
+        self.assertEqual(finalReport["Fraction"], 1.0)
+        self.assertEqual(finalReport["ETA"], 0.0)
+        self.assertEqual(finalReport["Unit"], "patients")
+
+    def test_file_bytes(self):
+        # The progress through a file should be measured in bytes, whatever its line endings and characters.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "Progress"))
+        os.makedirs(dirOutput, exist_ok=True)
+        fileData = os.path.join(dirOutput, "CRLF.tsv")
+        with open(fileData, 'w', encoding="utf-8", newline="\r\n") as fidData:
+            fidData.writelines("{:d}\tcaf\u00e9\n".format(i) for i in range(1000))
+
+        totalBytes = os.path.getsize(fileData)
+        reporter = progress.ProgressReporter(totalBytes, interval=3600, stream=None, logger=None, checkEvery=100)
+        with open(fileData, 'r', encoding="utf-8") as fidData:
+            self.assertEqual(len(list(reporter.track(fidData))), 1000)
+        finalReport = reporter.finish()
+        self.assertEqual(finalReport["BytesConsumed"], totalBytes)
+        self.assertEqual(finalReport["Fraction"], 1.0)
+
+        # Lines that do not come from a file should be counted by their encoded size.
+        reporter = progress.ProgressReporter(totalBytes, interval=3600, stream=None, logger=None, checkEvery=100)
+        list(reporter.track(["caf\u00e9\n"] * 10))
+        self.assertEqual(reporter.bytesConsumed, 60)
@@ -1,12 +1,12 @@
 """Tests for the record_outputter module."""
 
 # Python imports.
-import datetime
 import json
 import os
 import unittest
 
 # User imports.
+from PatientExtraction import association
 from PatientExtraction import conf
 
 
@@ -38,10 +38,8 @@ class TestRestrictionApplication(unittest.TestCase):
                 patientID = chunks[0]  # The ID of the patient whose record appears on the line.
                 patientRecord = json.loads(chunks[1])  # The patient's medical history in JSON format.
 
-                # Convert all dates to datetime objects.
-                for i in patientRecord:
-                    for j in patientRecord[i]:
-                        j["Date"] = datetime.datetime.strptime(j["Date"], "%Y-%m-%d")
+                # Convert all associations to association objects.
+                association.convert_record(patientRecord)
 
                 # Save the record.
                 cls.patientRecords[patientID] = patientRecord
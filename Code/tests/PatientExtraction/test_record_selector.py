@@ -1,12 +1,13 @@
 """Tests for the record_selector module."""
 
 # Python imports.
-import datetime
 import json
 import os
 import unittest
 
 # User imports.
+from PatientExtraction import association
+from PatientExtraction import conf
 from PatientExtraction import record_selector
 
 
@@ -26,25 +27,20 @@ class TestSelectors(unittest.TestCase):
         fileData = os.path.join(dirData, "RecordSelector", "Data.json")
         fileOutput = os.path.join(dirData, "RecordSelector", "ExpectedOutput.json")
 
-        # Load the patient data (replacing all dates in their string format with datetime.datetime objects).
+        # Load the patient data (converting all associations to association objects).
         fidData = open(fileData, 'r')
         cls.medicalRecords = json.load(fidData)
         fidData.close()
         for i in cls.medicalRecords:
-            for j in cls.medicalRecords[i]:
-                for k in cls.medicalRecords[i][j]:
-                    k["Date"] = datetime.datetime.strptime(k["Date"], "%Y-%m-%d")
+            association.convert_record(cls.medicalRecords[i])
 
-        # Load the expected results of performing the selections (replacing all dates in their string format with
-        # datetime.datetime objects).
+        # Load the expected results of performing the selections (converting all associations to association objects).
         fidOutput = open(fileOutput, 'r')
         cls.expectedOutput = json.load(fidOutput)
         fidOutput.close()
         for i in cls.expectedOutput:
             for j in cls.expectedOutput[i]:
-                for k in cls.expectedOutput[i][j]:
-                    for l in cls.expectedOutput[i][j][k]:
-                        l["Date"] = datetime.datetime.strptime(l["Date"], "%Y-%m-%d")
+                association.convert_record(cls.expectedOutput[i][j])
 
     def test_all_selector(self):
         """Test the mode selector that extracts all associations in the patient's history."""
@@ -95,3 +91,53 @@ class TestSelectors(unittest.TestCase):
         # Max selection for Val2.
         for i in self.medicalRecords:
             self.assertDictEqual(min2Selector(self.medicalRecords[i]), self.expectedOutput["min2"][i])
+
+    def test_parameterised_selectors(self):
+        """Test the mode extractors that extract a number of associations from the patient's history."""
+
+        # Selecting a single association should match the single association modes, including their tie-breaking.
+        for i in self.medicalRecords:
+            self.assertDictEqual(record_selector.create_selector("first1")(self.medicalRecords[i]),
+                                 self.expectedOutput["earliest"][i])
+            self.assertDictEqual(record_selector.create_selector("nth1")(self.medicalRecords[i]),
+                                 self.expectedOutput["earliest"][i])
+            self.assertDictEqual(record_selector.create_selector("last1")(self.medicalRecords[i]),
+                                 self.expectedOutput["latest"][i])
+            for j in ["1", "2"]:
+                self.assertDictEqual(record_selector.create_selector("top1_val" + j)(self.medicalRecords[i]),
+                                     self.expectedOutput["max" + j][i])
+                self.assertDictEqual(record_selector.create_selector("bottom1_val" + j)(self.medicalRecords[i]),
+                                     self.expectedOutput["min" + j][i])
+
+        # Selecting multiple associations should match sorting every association.
+        for i in self.medicalRecords:
+            associations = [(k.Date, j, l, k) for j in self.medicalRecords[i]
+                            for l, k in enumerate(self.medicalRecords[i][j])]
+            for numAssociations in [1, 2, 3, 5, 100]:
+                expectedSelections = {
+                    "first": sorted(associations, key=lambda x: x[:3])[:numAssociations],
+                    "last": sorted(associations, key=lambda x: x[:3], reverse=True)[:numAssociations],
+                    "nth": sorted(associations, key=lambda x: x[:3])[numAssociations - 1:numAssociations],
+                    "top{:d}_val1": sorted(associations, key=lambda x: (x[3].Val1, x[1], -x[2]),
+                                           reverse=True)[:numAssociations],
+                    "bottom{:d}_val2": sorted(associations, key=lambda x: (x[3].Val2, x[1], x[2]))[:numAssociations]
+                }
+                for mode, expected in expectedSelections.items():
+                    mode = mode.format(numAssociations) if '{' in mode else mode + str(numAssociations)
+                    selected = record_selector.create_selector(mode)(self.medicalRecords[i])
+                    expectedRecord = {}
+                    for _, j, l, k in sorted(expected, key=lambda x: (x[1], x[2])):
+                        expectedRecord.setdefault(j, []).append(k)
+                    self.assertDictEqual(selected, expectedRecord)
+
+        # Parameterised modes should be valid modes, and created when they are first used.
+        conf.init()
+        self.assertIn("first3", conf.validChoices["Modes"])
+        self.assertIn("top10_val2", conf.validChoices["Modes"])
+        self.assertNotIn("first0", conf.validChoices["Modes"])
+        self.assertNotIn("top3_val3", conf.validChoices["Modes"])
+        self.assertNotIn("first3", list(conf.validChoices["Modes"]))
+        self.assertIs(conf.validChoices["Modes"]["first3"], conf.validChoices["Modes"]["first3"])
+        with self.assertRaises(KeyError):
+            conf.validChoices["Modes"]["third"]
+        self.assertIsNone(record_selector.create_selector("max1"))
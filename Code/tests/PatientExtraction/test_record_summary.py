@@ -0,0 +1,149 @@
+"""Tests for the record_summary module."""
+
+# Python imports.
+import io
+import json
+import os
+import unittest
+
+# User imports.
+from PatientExtraction import annotate_case_definitions
+from PatientExtraction import conf
+from PatientExtraction import parse_case_definitions
+from PatientExtraction import patient_extraction
+from PatientExtraction import record_summary
+from PatientExtraction import run_statistics
+
+# Globals.
+CODES = "229\n2469.\n40729\n44I5\nNYSU5221\n44Q\n"
+SUMMARISABLE_CASES = (
+    "# All\n> mode all\n> out code count date exists max1 max2 mean1 mean2 min1 min2\n" + CODES + "\n"
+    "# Dates\n> mode earliest latest\n> out code count date exists\n" + CODES + "\n"
+    "# Values\n> mode max1 min1\n> out code count exists max1 mean1 median1 min1 val1\n" + CODES + "\n"
+    "# Values2\n> mode max2 min2\n> out code exists max2 mean2 median2 min2 val2\n" + CODES + "\n"
+    "# Combined\n> mode all earliest\n> out count date\n" + CODES
+)
+RESTRICTED_CASES = (
+    "# Recent\n> mode all latest\n> out count date val1\n> from 2008-01-01\n" + CODES + "\n"
+    "# Old\n> mode all\n> out count\n> from 1990-01-01 to 1999-12-31\n" + CODES + "\n"
+    "# High\n> mode max1\n> out val1 date\n> val1 > 0.5\n" + CODES + "\n"
+    "# Both\n> mode earliest\n> out code\n> val1 >= 0.9\n> val2 < 1\n> from 2001-01-01 to 2004-12-31\n" + CODES +
+    "\n# Unrestricted\n> mode all\n> out count exists\n" + CODES
+)
+
+
+class TestRecordSummary(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        # Setup global settings-like variables.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+
+        # Write a copy of the test patient data with the summaries of each patient's codes added.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "PatientExtraction"))
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "RecordSummary"))
+        os.makedirs(cls.dirOutput, exist_ok=True)
+        cls.filePatientData = os.path.join(dirData, "FlatPatientData.tsv")
+        cls.fileSummarisedData = os.path.join(cls.dirOutput, "FlatPatientData.tsv")
+        record_summary.add_summaries(cls.filePatientData, cls.fileSummarisedData)
+        cls.fileCodeDescriptions = os.path.join(dirData, "CodeDescriptions.tsv")
+        cls.fileCaseDefinitions = os.path.join(dirData, "CaseDefinitions.txt")
+        cls.filePatientSubsetBlank = os.path.join(dirData, "PatientSubsetBlank.txt")
+        cls.fileExpectedOutputBlank = os.path.join(dirData, "ExpectedOutputBlank.txt")
+        cls.mapCodeToDescription = annotate_case_definitions.load_code_descriptions(cls.fileCodeDescriptions)
+
+    def parse(self, caseDefinitionsText):
+        """Annotate and parse the text of a case definitions file."""
+
+        annotatedCaseDefs = io.StringIO()
+        annotate_case_definitions.annotate(io.StringIO(caseDefinitionsText), self.mapCodeToDescription,
+                                           annotatedCaseDefs)
+        annotatedCaseDefs.seek(0)
+        return parse_case_definitions.parse(annotatedCaseDefs)[0]
+
+    def test_summarise_record(self):
+        record = json.loads('{"A": [{"Date": "2001-07-24", "Val1": 1.5, "Val2": 0.0}, '
+                            '{"Date": "2003-01-01", "Val1": 3.0, "Val2": -1.0}, '
+                            '{"Date": "2005-06-14", "Val1": 3.0, "Val2": -2.0}], "B": [{"Date": "2002-02-02"}]}')
+        summaries = record_summary.summarise_record(record)
+        self.assertEqual(list(summaries), ["A", "B"])
+        self.assertEqual(dict(zip(record_summary.SUMMARY_FIELDS, summaries["A"])), {
+            "Count": 3, "FirstDate": "2001-07-24", "LastDate": "2005-06-14",
+            "MinVal1": 1.5, "MinVal1Position": 0, "MaxVal1": 3.0, "MaxVal1Position": 1, "SumVal1": 7.5,
+            "MinVal2": -2.0, "MinVal2Position": 2, "MaxVal2": 0.0, "MaxVal2Position": 0, "SumVal2": -3.0
+        })
+        self.assertEqual(summaries["B"], [1, "2002-02-02", "2002-02-02", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+
+    def test_prune_codes(self):
+        caseDefinitions = self.parse(RESTRICTED_CASES)
+        summaries = {"Early": [2, "1995-01-01", "2000-06-01", 0.2, 0, 0.9, 1, 1.1, 0, 0, 0, 0, 0],
+                     "Late": [1, "2009-03-01", "2009-03-01", 0.4, 0, 0.4, 0, 0.4, 2.0, 0, 2.0, 0, 2.0]}
+        self.assertEqual(list(record_summary.prune_codes(summaries, caseDefinitions["Recent"])), ["Late"])
+        self.assertEqual(list(record_summary.prune_codes(summaries, caseDefinitions["Old"])), ["Early"])
+        self.assertEqual(list(record_summary.prune_codes(summaries, caseDefinitions["High"])), ["Early"])
+        self.assertEqual(list(record_summary.prune_codes(summaries, caseDefinitions["Both"])), [])
+        self.assertEqual(record_summary.prune_codes(summaries, caseDefinitions["Unrestricted"]), summaries)
+
+    def test_is_summarisable(self):
+        caseDefinitions = self.parse(SUMMARISABLE_CASES)
+        self.assertTrue(all(record_summary.is_summarisable(i) for i in caseDefinitions.values()))
+
+        # Most of the cases of the test data use outputs that need the full record.
+        with open(self.fileCaseDefinitions, 'r') as fidCaseDefinitions:
+            caseDefinitions = self.parse(fidCaseDefinitions.read())
+        self.assertFalse(record_summary.is_summarisable(caseDefinitions["Case_1"]))  # Uses the median.
+        self.assertFalse(record_summary.is_summarisable(caseDefinitions["Case_2"]))  # Uses val outputs.
+        self.assertTrue(record_summary.is_summarisable(caseDefinitions["Empty_Case"]))
+
+    def test_summarised_extraction(self):
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        # Extracting cases from the summaries should give the same output as extracting them from the full records.
+        outputs = []
+        for filePatientData in [self.filePatientData, self.fileSummarisedData]:
+            runStats = run_statistics.RunStatistics()
+            with open(filePatientData, 'r') as fidPatientData:
+                header, rows = patient_extraction.extract(SUMMARISABLE_CASES, fidPatientData, runStats=runStats,
+                                                          mapCodeToDescription=self.mapCodeToDescription)
+                outputs.append([header] + [[patientID] + values for patientID, values in rows])
+            summarised = runStats.counters["PatientsSummarised"]
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(summarised, len(outputs[1]) - 1)
+
+        # Pruning the codes of restricted cases using their summaries should not change the output either.
+        outputs = []
+        for filePatientData in [self.filePatientData, self.fileSummarisedData]:
+            runStats = run_statistics.RunStatistics()
+            with open(filePatientData, 'r') as fidPatientData:
+                header, rows = patient_extraction.extract(RESTRICTED_CASES, fidPatientData, runStats=runStats,
+                                                          mapCodeToDescription=self.mapCodeToDescription)
+                outputs.append([header] + [[patientID] + values for patientID, values in rows])
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertGreater(runStats.counters["CodesPruned"], 0)
+        self.assertGreater(runStats.counters["PatientsSummarised"], 0)
+
+        # Cases needing the full record should still be extracted from it.
+        with open(self.fileExpectedOutputBlank, 'r') as fidExpected:
+            expectedOutput = fidExpected.read()
+        for processes in [1, 2]:
+            patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.fileSummarisedData,
+                                    self.fileCodeDescriptions, self.filePatientSubsetBlank, processes=processes)
+            with open(os.path.join(self.dirOutput, "DataExtraction.tsv"), 'r') as fidOutput:
+                self.assertEqual(fidOutput.read(), expectedOutput)
+
+    def test_streamed_records(self):
+        # Records with summaries that are needed in full should still be decodable one code at a time.
+        with open(self.fileCaseDefinitions, 'r') as fidCaseDefinitions:
+            caseDefinitionsText = fidCaseDefinitions.read()
+        with open(self.fileExpectedOutputBlank, 'r') as fidExpected:
+            expectedOutput = [i.split('\t') for i in fidExpected.read().split('\n') if i]
+        with open(self.fileSummarisedData, 'r') as fidPatientData:
+            header, rows = patient_extraction.extract(caseDefinitionsText, fidPatientData,
+                                                      mapCodeToDescription=self.mapCodeToDescription, maxRecordBytes=0)
+            actualOutput = [header] + [[patientID] + values for patientID, values in rows]
+        self.assertEqual(actualOutput, expectedOutput)
@@ -0,0 +1,74 @@
+"""Tests for the run_statistics module."""
+
+# Python imports.
+import json
+import os
+import unittest
+
+# User imports.
+from PatientExtraction import run_statistics
+
+
+class TestRunStatistics(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "RunStatistics"))
+        os.makedirs(cls.dirOutput, exist_ok=True)
+
+    def test_timings_and_counters(self):
+        runStats = run_statistics.RunStatistics()
+        runStats.add_time("StageA", 1.5)
+        runStats.add_time("StageA", 0.5, calls=3)
+        runStats.count("Patients")
+        runStats.count("Patients", 4)
+
+        # Check that iterating through a timed iterator records one call per item.
+        self.assertEqual(list(run_statistics.timed_iterator(range(5), runStats, "StageB")), list(range(5)))
+
+        statistics = runStats.to_dict()
+        self.assertEqual(statistics["Timings"]["StageA"], {"Seconds": 2.0, "Calls": 4})
+        self.assertEqual(statistics["Timings"]["StageB"]["Calls"], 5)
+        self.assertEqual(statistics["Counters"], {"Patients": 5})
+        self.assertNotIn("Cases", statistics)
+
+        # Check that the statistics can be merged (as is done with the statistics from worker processes).
+        mergedStats = run_statistics.RunStatistics()
+        mergedStats.merge(runStats)
+        mergedStats.merge(statistics)
+        self.assertEqual(mergedStats.to_dict()["Timings"]["StageA"], {"Seconds": 4.0, "Calls": 8})
+        self.assertEqual(mergedStats.to_dict()["Counters"], {"Patients": 10})
+
+        # Check that the report is written out.
+        fileReport = os.path.join(self.dirOutput, "RunReport.json")
+        runStats.write_report(fileReport)
+        with open(fileReport, 'r') as fidReport:
+            self.assertEqual(json.load(fidReport)["Counters"], {"Patients": 5})
+
+    def test_case_statistics(self):
+        runStats = run_statistics.RunStatistics(explain=True)
+        runStats.set_case_codes("CaseA", 10)
+        runStats.add_case("CaseA", 0.25, 6, [("Date_1", 4), ("Val1_1", 2)], {"all": 2, "earliest": 1})
+        runStats.add_case("CaseA", 0.25, 0, [("Date_1", 0), ("Val1_1", 0)], {"all": 0, "earliest": 0})
+        mergedStats = run_statistics.RunStatistics(explain=True)
+        mergedStats.merge(runStats.to_dict())
+        mergedStats.merge(runStats.to_dict())
+
+        # Check the statistics for the case.
+        fileReport = os.path.join(self.dirOutput, "ExplainReport.json")
+        mergedStats.write_explain_report(fileReport, ["CaseA", "CaseB"])
+        with open(fileReport, 'r') as fidReport:
+            report = json.load(fidReport)
+        self.assertEqual([i["Case"] for i in report], ["CaseA", "CaseB"])
+        self.assertEqual(report[0]["ExpandedCodes"], 10)
+        self.assertEqual(report[0]["Seconds"], 1.0)
+        self.assertEqual(report[0]["Patients"], 4)
+        self.assertEqual(report[0]["PatientsWithCodes"], 2)
+        self.assertEqual(report[0]["AssociationsWithCodes"], 12)
+        self.assertEqual(list(report[0]["Restrictions"].items()), [("Date_1", 8), ("Val1_1", 4)])
+        self.assertEqual(report[0]["Modes"]["all"], {"Patients": 2, "Associations": 4})
+        self.assertEqual(report[0]["Modes"]["earliest"], {"Patients": 2, "Associations": 2})
+        self.assertEqual(report[1]["Patients"], 0)
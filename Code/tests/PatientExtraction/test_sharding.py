@@ -0,0 +1,91 @@
+"""Tests for the sharding module."""
+
+# Python imports.
+import os
+import unittest
+
+# User imports.
+from Benchmark import synthetic_data
+from GenerateDataFiles import generate_flat_files
+from PatientExtraction import conf
+from PatientExtraction import patient_extraction
+from PatientExtraction import sharding
+
+
+class TestSharding(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        # Setup global settings-like variables.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+
+        # Shard the test patient data.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "PatientExtraction"))
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "Sharding"))
+        os.makedirs(cls.dirOutput, exist_ok=True)
+        cls.filePatientData = os.path.join(dirData, "FlatPatientData.tsv")
+        cls.fileShards = sharding.shard_file(cls.filePatientData, 3, os.path.join(cls.dirOutput, "FlatPatientData.tsv"))
+        cls.fileCodeDescriptions = os.path.join(dirData, "CodeDescriptions.tsv")
+        cls.fileCaseDefinitions = os.path.join(dirData, "CaseDefinitions.txt")
+        cls.filePatientSubsetBlank = os.path.join(dirData, "PatientSubsetBlank.txt")
+        cls.fileExpectedOutputBlank = os.path.join(dirData, "ExpectedOutputBlank.txt")
+
+    def test_shard_file(self):
+        # The shard of a patient should not depend on the process (as Python's hash would).
+        self.assertEqual(sharding.shard_of("12345", 7), 1)
+        self.assertEqual(sharding.shard_of("26972", 4), 1)
+
+        # Each patient should be in their shard, in the order of the flat file.
+        with open(self.filePatientData, 'r') as fidPatientData:
+            lines = fidPatientData.readlines()
+        for shard, fileShard in enumerate(self.fileShards):
+            with open(fileShard, 'r') as fidShard:
+                self.assertEqual(fidShard.readlines(),
+                                 [i for i in lines if sharding.shard_of(i.split('\t')[0], 3) == shard])
+
+    def test_sharded_extraction(self):
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        # Concatenating the extracted data of the shards should give the expected rows in shard order.
+        with open(self.fileExpectedOutputBlank, 'r') as fidExpected:
+            expectedOutput = fidExpected.readlines()
+        expectedRows = sorted(expectedOutput[1:], key=lambda i: sharding.shard_of(i.split('\t')[0], 3))
+        for processes in [1, 2]:
+            fileMerged = sharding.extract_shards(self.fileCaseDefinitions, self.dirOutput, self.fileShards,
+                                                 self.fileCodeDescriptions, self.filePatientSubsetBlank,
+                                                 processes=processes, useCohortIndex=False)
+            with open(fileMerged, 'r') as fidMerged:
+                self.assertEqual(fidMerged.readlines(), expectedOutput[:1] + expectedRows)
+
+        # The test patients are not in order of their IDs, and so can not be merged in order.
+        fileShardOutputs = [os.path.join(self.dirOutput, "Shard{:d}".format(i), "DataExtraction.tsv") for i in range(3)]
+        self.assertRaises(ValueError, sharding.merge_outputs, fileShardOutputs,
+                          os.path.join(self.dirOutput, "Sorted.tsv"), True)
+
+    def test_sorted_merge(self):
+        # Merging the extracted data of generated shards in order should give the same output as the unsharded data.
+        dirSynthetic = os.path.join(self.dirOutput, "SyntheticData")
+        files = synthetic_data.main(dirSynthetic, numPatients=60, numCodes=200, codesPerPatient=5,
+                                    associationsPerCode=2, edgeCaseRate=0.2, seed=3)
+        fileFlatData = os.path.join(dirSynthetic, "FlatPatientData.tsv")
+        fileShards = sharding.shard_files(fileFlatData, 4)
+        for i in [fileFlatData] + fileShards:
+            if os.path.isfile(i):
+                os.remove(i)
+        generate_flat_files.main(files["Journal"], fileFlatData)
+        generate_flat_files.main(files["Journal"], fileFlatData, shards=4)
+        for sink in ["tsv", "ndjson"]:
+            dirUnsharded = os.path.join(dirSynthetic, "Unsharded")
+            os.makedirs(dirUnsharded, exist_ok=True)
+            patient_extraction.main(files["CaseDefinitions"], dirUnsharded, fileFlatData, files["Coding"],
+                                    self.filePatientSubsetBlank, sink=sink)
+            fileMerged = sharding.extract_shards(files["CaseDefinitions"], dirSynthetic, fileShards, files["Coding"],
+                                                 self.filePatientSubsetBlank, processes=2, sink=sink, sortedOrder=True)
+            with open(os.path.join(dirUnsharded, os.path.basename(fileMerged)), 'r') as fidUnsharded, \
+                    open(fileMerged, 'r') as fidMerged:
+                self.assertEqual(fidMerged.read(), fidUnsharded.read())
@@ -0,0 +1,65 @@
+"""Tests for the sparse_output module."""
+
+# Python imports.
+import os
+import unittest
+
+# User imports.
+from PatientExtraction import conf
+from PatientExtraction import patient_extraction
+from PatientExtraction import sparse_output
+
+
+class TestSparseOutput(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        # Setup global settings-like variables.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+
+        # Determine the files needed to load the data and the expected results of the tests.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "PatientExtraction"))
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "SparseOutput"))
+        os.makedirs(cls.dirOutput, exist_ok=True)
+        cls.filePatientData = os.path.join(dirData, "FlatPatientData.tsv")
+        cls.fileCodeDescriptions = os.path.join(dirData, "CodeDescriptions.tsv")
+        cls.fileCaseDefinitions = os.path.join(dirData, "CaseDefinitions.txt")
+        cls.filePatientSubsetBlank = os.path.join(dirData, "PatientSubsetBlank.txt")
+        cls.fileExpectedOutputBlank = os.path.join(dirData, "ExpectedOutputBlank.txt")
+
+    def test_format_patient(self):
+        # Only the values differing from the empty values should be recorded.
+        self.assertEqual(sparse_output.format_patient("P1", ['', '0', '3', "1.50"], ['', '0', '0', '']),
+                         ("P1", "P1\t3\t3\nP1\t4\t1.50\n"))
+        self.assertEqual(sparse_output.format_patient("P2", ['', '0'], ['', '0']), ("P2", ''))
+
+    def test_sparse_extraction(self):
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        with open(self.fileExpectedOutputBlank, 'r') as fidExpected:
+            expectedOutput = fidExpected.read()
+
+        # Converting the sparse output back to the dense format should give the normal output.
+        for pipelined, processes in [(False, 1), (True, 1), (False, 2)]:
+            patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, self.filePatientData,
+                                    self.fileCodeDescriptions, self.filePatientSubsetBlank, pipelined=pipelined,
+                                    processes=processes, sink="sparse")
+            fileDense = os.path.join(self.dirOutput, "Dense.tsv")
+            sparse_output.to_dense(self.dirOutput, fileDense)
+            with open(fileDense, 'r') as fidDense:
+                self.assertEqual(fidDense.read(), expectedOutput)
+
+            # The sparse output should only contain the non-empty values.
+            numValues = 0
+            with open(os.path.join(self.dirOutput, sparse_output.FILE_VALUES), 'r') as fidValues:
+                for line in fidValues:
+                    numValues += 1
+                    self.assertEqual(len(line.split('\t')), 3)
+            numColumns = len(expectedOutput.split('\n')[0].split('\t')) - 1
+            numPatients = len([i for i in expectedOutput.split('\n') if i]) - 1
+            self.assertLess(numValues, numColumns * numPatients)
@@ -0,0 +1,123 @@
+"""Tests for the split_layout module."""
+
+# Python imports.
+import io
+import json
+import os
+import unittest
+
+# User imports.
+from PatientExtraction import annotate_case_definitions
+from PatientExtraction import conf
+from PatientExtraction import parse_case_definitions
+from PatientExtraction import patient_extraction
+from PatientExtraction import record_summary
+from PatientExtraction import split_layout
+
+# Globals.
+DATE_CASES = (
+    "# Dates\n> mode all earliest latest first2\n> out code count date exists\n> from 2001-01-01\n229\n44I5\n44Q\n\n"
+    "# After\n> mode earliest\n> out date\n> relative Dates earliest 0 3650\n2469.\n40729\n"
+)
+
+
+class TestSplitLayout(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Perform setup needed for all tests."""
+
+        # Setup global settings-like variables.
+        conf.init()
+        conf.control_logging(False)  # Turn logging off.
+
+        # Write the test patient data (with and without summaries) in the split layout.
+        dirCurrent = os.path.dirname(os.path.join(os.getcwd(), __file__))  # Directory containing this file.
+        dirData = os.path.abspath(os.path.join(dirCurrent, "TestData", "PatientExtraction"))
+        cls.dirOutput = os.path.abspath(os.path.join(dirCurrent, "TestData", "TempData", "SplitLayout"))
+        os.makedirs(cls.dirOutput, exist_ok=True)
+        cls.filePatientData = os.path.join(dirData, "FlatPatientData.tsv")
+        cls.files = split_layout.split_file(cls.filePatientData, os.path.join(cls.dirOutput, "FlatPatientData.tsv"))
+        fileSummarisedData = os.path.join(cls.dirOutput, "SummarisedPatientData.tsv")
+        record_summary.add_summaries(cls.filePatientData, fileSummarisedData)
+        cls.summarisedFiles = split_layout.split_file(fileSummarisedData)
+        cls.fileCodeDescriptions = os.path.join(dirData, "CodeDescriptions.tsv")
+        cls.fileCaseDefinitions = os.path.join(dirData, "CaseDefinitions.txt")
+        cls.filePatientSubsetBlank = os.path.join(dirData, "PatientSubsetBlank.txt")
+        cls.fileExpectedOutputBlank = os.path.join(dirData, "ExpectedOutputBlank.txt")
+        cls.mapCodeToDescription = annotate_case_definitions.load_code_descriptions(cls.fileCodeDescriptions)
+
+    def parse(self, caseDefinitionsText):
+        """Annotate and parse the text of a case definitions file."""
+
+        annotatedCaseDefs = io.StringIO()
+        annotate_case_definitions.annotate(io.StringIO(caseDefinitionsText), self.mapCodeToDescription,
+                                           annotatedCaseDefs)
+        annotatedCaseDefs.seek(0)
+        return parse_case_definitions.parse(annotatedCaseDefs)
+
+    def test_split_file(self):
+        # Each file should have one line per patient, in the same order as the flat file.
+        with open(self.filePatientData, 'r') as fidPatientData:
+            records = [(i.split('\t')[0], json.loads(i.split('\t')[1])) for i in fidPatientData]
+        for i in self.files.values():
+            with open(i, 'r') as fidSplit:
+                self.assertEqual([j.split('\t')[0] for j in fidSplit], [j for j, _ in records])
+
+        # The columns should hold each code's dates, values and text.
+        patientID, record = records[0]
+        code = next(iter(record))
+        lines = {}
+        for i, j in self.files.items():
+            with open(j, 'r') as fidSplit:
+                lines[i] = json.loads(fidSplit.readline().split('\t')[1])
+        self.assertEqual(lines["Dates"][code], [i["Date"] for i in record[code]])
+        self.assertEqual(lines["Values"][code], [[i["Val1"] for i in record[code]], [i["Val2"] for i in record[code]]])
+        self.assertEqual(lines["Text"][code], [i["Text"] for i in record[code]])
+
+    def test_needs_values(self):
+        caseDefinitions, caseNames = self.parse(DATE_CASES)
+        self.assertFalse(split_layout.needs_values(caseDefinitions, caseNames))
+        with open(self.fileCaseDefinitions, 'r') as fidCaseDefinitions:
+            caseDefinitions, caseNames = self.parse(fidCaseDefinitions.read())
+        self.assertTrue(split_layout.needs_values(caseDefinitions, caseNames))
+        self.assertTrue(split_layout.needs_values(*self.parse("# Values\n> mode all\n> out count\n> val1 > 0\n229\n")))
+        self.assertTrue(split_layout.needs_values(*self.parse("# Values\n> mode max1\n> out date\n229\n")))
+
+    def test_split_extraction(self):
+        # Set the test to output the entire difference between the actual and expected outputs.
+        self.maxDiff = None
+
+        # Extracting the cases from the split layout should give the same output as extracting them from the flat file.
+        with open(self.fileExpectedOutputBlank, 'r') as fidExpected:
+            expectedOutput = fidExpected.read()
+        for files in [self.files, self.summarisedFiles]:
+            for processes in [1, 2]:
+                patient_extraction.main(self.fileCaseDefinitions, self.dirOutput, files["Dates"],
+                                        self.fileCodeDescriptions, self.filePatientSubsetBlank, processes=processes,
+                                        useCohortIndex=False)
+                with open(os.path.join(self.dirOutput, "DataExtraction.tsv"), 'r') as fidOutput:
+                    self.assertEqual(fidOutput.read(), expectedOutput)
+
+        # Cases only needing the dates should be extracted without reading the values.
+        outputs = []
+        for filePatientData in [self.filePatientData, self.files["Dates"]]:
+            with split_layout.open_patient_data(filePatientData, readValues=False) as fidPatientData:
+                header, rows = patient_extraction.extract(DATE_CASES, fidPatientData,
+                                                          mapCodeToDescription=self.mapCodeToDescription)
+                outputs.append([header] + [[patientID] + values for patientID, values in rows])
+                if filePatientData == self.files["Dates"]:
+                    self.assertIsNone(fidPatientData.fidValues)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_mismatched_files(self):
+        # The reader should fail if the values file is not in the same order as the dates file.
+        fileDates = os.path.join(self.dirOutput, "Mismatched.dates.tsv")
+        with open(fileDates, 'w') as fidDates:
+            fidDates.write('A\t{"229": ["2001-01-01"]}\n')
+        with open(os.path.join(self.dirOutput, "Mismatched.values.tsv"), 'w') as fidValues:
+            fidValues.write('B\t{"229": [[1.0], [0.0]]}\n')
+        with split_layout.SplitReader(fileDates, readValues=False) as reader:
+            self.assertEqual(list(reader), ['A\t[{"229": ["2001-01-01"]}]\n'])
+        with split_layout.SplitReader(fileDates) as reader:
+            self.assertRaises(ValueError, list, reader)